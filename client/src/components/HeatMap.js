@@ -1,12 +1,12 @@
 import React, { useEffect, useRef, useState } from 'react';
 import * as d3 from 'd3';
-import axios from 'axios';
 
 const HeatMap = ({ playerName = "Bruno Fernandes" }) => {
   const svgRef = useRef();
   const containerRef = useRef();
   const [data, setData] = useState(null);
   const [error, setError] = useState(null);
+  const [progress, setProgress] = useState(null);
 
   const HEATMAP_CONFIG = {
     width: 500,  
@@ -32,15 +32,56 @@ const HeatMap = ({ playerName = "Bruno Fernandes" }) => {
   };
 
   useEffect(() => {
+    const API_BASE = 'http://127.0.0.1:8001';
+    const controller = new AbortController();
+
+    const handleLine = (line) => {
+      const record = JSON.parse(line);
+      if (record.type === 'meta') {
+        setData({ coordinates: [], pitch_dimensions: record.pitch_dimensions });
+      } else if (record.type === 'match' || record.type === 'season') {
+        // Redraw with each match so the heatmap fills in while the season is scraped
+        setData(prev => ({ ...prev, coordinates: prev.coordinates.concat(record.coordinates) }));
+        if (record.type === 'match') {
+          setProgress({ completed: record.completed, total: record.total });
+        }
+      } else if (record.type === 'done') {
+        setProgress(null);
+      } else if (record.type === 'error') {
+        setError(record.error);
+      }
+    };
+
     const fetchData = async () => {
       try {
-        const response = await axios.get(`http://127.0.0.1:8001/api/heatmap/${playerName}`);
-        setData(response.data);
+        const response = await fetch(`${API_BASE}/api/heatmap/${playerName}?stream=1`, {
+          headers: { Accept: 'application/x-ndjson' },
+          signal: controller.signal
+        });
+        if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split('\n');
+          buffer = lines.pop();
+          lines.filter(line => line.trim()).forEach(handleLine);
+        }
+        if (buffer.trim()) handleLine(buffer);
       } catch (err) {
-        setError(err.message);
+        if (err.name !== 'AbortError') setError(err.message);
       }
     };
+    setData(null);
+    setError(null);
+    setProgress(null);
     fetchData();
+
+    return () => controller.abort();
   }, [playerName]);
 
   useEffect(() => {
@@ -225,6 +266,11 @@ const HeatMap = ({ playerName = "Bruno Fernandes" }) => {
     <div className="bg-[#11150F]/95 rounded-2xl p-5 h-full">
       <h3 className="text-gray-400 text-sm mb-4">Position Heat Map (Season Average)</h3>
       <div ref={containerRef} className="relative flex items-center justify-center">
+        {progress && (
+          <div className="absolute top-2 right-2 text-gray-400 text-xs">
+            {`Processing matches ${progress.completed}/${progress.total}...`}
+          </div>
+        )}
         <svg ref={svgRef} className="w-full h-full" preserveAspectRatio="xMidYMid meet" />
       </div>
     </div>
@@ -45,7 +45,12 @@ const PlayerProfile = ({ playerName }) => {
       
       <div className="image-container">
   {playerImage ? (
-    <img src={playerImage} alt={playerName} className="player-image" />
+    <img
+      src={playerImage}
+      alt={playerName}
+      className="player-image"
+      onError={() => setPlayerImage(null)}
+    />
   ) : (
     <span className="text-white">No Image Found</span>
   )}
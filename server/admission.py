@@ -0,0 +1,313 @@
+"""
+Admission control shared by both backends: per-route-class bulkheads and
+request deadlines.
+
+Every API route belongs to a class (ROUTE_CLASSES) and every class has its
+own bulkhead, a bounded number of requests running at once plus a bounded
+queue of requests waiting briefly for a slot:
+
+  interactive   search, player info and images, metric lists
+  analytical    radars, scatter/parallel plots, leaderboards, similarity
+  scrape        heatmaps (Sofascore)
+  stream        NDJSON heatmap streams, scraping a season match by match
+  export        bulk CSV/Parquet exports, streamed for minutes at a time
+
+Streams hold their slot until the whole body has been sent (streamed()), so
+the stream and export classes bound the scrapes and exports actually running,
+with deadlines long enough for a season. Slow scrapes or heavy radar queries therefore only ever occupy their own
+class's slots, and search keeps its own. A request that finds its class's
+queue full, or waits longer than the class allows, is answered at once with
+503 and a Retry-After estimated from the class's recent service times,
+instead of tying up a server thread.
+
+Admitted requests get a deadline (per class, overridable per route). Long
+running work checks it cooperatively with check_deadline() (between
+Sofascore matches, leaderboard chunks, career partitions) and PostgreSQL
+queries run with statement_timeout set to the time left, so the server
+stops the work itself rather than only the response. A request that fails
+after its deadline has passed is answered with 504.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+
+from flask import g, has_request_context, jsonify, request
+
+from instrumentation import register_collector, registry
+
+
+def _pool_config(name, concurrency, queue, wait, deadline):
+    prefix = f'QUANTIFICO_{name.upper()}'
+    return {
+        'concurrency': int(os.getenv(f'{prefix}_CONCURRENCY', concurrency)),   # Requests running at once
+        'queue': int(os.getenv(f'{prefix}_QUEUE', queue)),                     # Requests waiting for a slot
+        'wait': float(os.getenv(f'{prefix}_WAIT', wait)),                      # Longest wait for a slot (s)
+        'deadline': float(os.getenv(f'{prefix}_DEADLINE', deadline)),          # Time allowed once admitted (s)
+    }
+
+
+ADMISSION_CONFIG = {
+    'enabled': os.getenv('QUANTIFICO_ADMISSION', '1').lower() not in ('0', 'false', 'no'),
+    'pools': {
+        'interactive': _pool_config('interactive', 16, 64, 0.5, 5),
+        'analytical': _pool_config('analytical', 4, 16, 2, 30),
+        'scrape': _pool_config('scrape', 2, 2, 0.1, 180),
+        'stream': _pool_config('stream', 8, 8, 5, 900),
+        'export': _pool_config('export', 2, 2, 0.5, 600),
+    },
+}
+
+# Endpoint -> route class; endpoints not listed (metrics, jobs, profiles) are not admission controlled
+ROUTE_CLASSES = {
+    'search_players': 'interactive',
+    'get_player_info': 'interactive',
+    'get_player_image': 'interactive',
+    'get_available_metrics': 'interactive',
+    'get_player_form': 'interactive',
+    'get_radar_data': 'analytical',
+    'get_career_radar_data': 'analytical',
+    'compare_radar_data': 'analytical',
+    'get_scatter_data': 'analytical',
+    'get_parallel_data': 'analytical',
+    'query_parallel_data': 'analytical',
+    'get_leaderboard': 'analytical',
+    'get_similar_players': 'analytical',
+    'get_heatmap': 'scrape',
+    'get_aggregate_heatmap': 'analytical',
+    'export_players': 'export',
+}
+
+# Endpoints whose NDJSON streams are admitted as 'stream' requests
+STREAMED_ROUTES = {'get_heatmap'}
+
+# Endpoint -> deadline in seconds, where it differs from its class's
+ROUTE_DEADLINES = {
+    'search_players': float(os.getenv('QUANTIFICO_SEARCH_DEADLINE', 2)),
+}
+
+registry.describe('quantifico_admission_rejected_total', 'Requests answered with 503 by admission control')
+registry.describe('quantifico_deadline_exceeded_total', 'Requests answered with 504 after their deadline passed')
+
+
+class Overloaded(Exception):
+    def __init__(self, pool, reason, detail):
+        super().__init__(f"The server is busy ({pool.name} requests: {detail}); retry later")
+        self.pool = pool
+        self.reason = reason
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Bulkhead:
+    """At most `concurrency` holders, at most `queue` waiters, each waiting at most `wait` seconds"""
+
+    def __init__(self, name, concurrency, queue, wait, deadline):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.wait = wait
+        self.deadline = deadline
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.service_time = 0.0   # Moving average of seconds a slot is held
+
+    def resize(self, concurrency, queue, wait):
+        """Change the slots, waiters and wait; only before the first request is admitted"""
+        self.concurrency = concurrency
+        self.queue = queue
+        self.wait = wait
+        self._slots = threading.Semaphore(concurrency)
+
+    def _enqueue(self):
+        with self._lock:
+            if self.waiting >= self.queue:
+                raise Overloaded(self, 'queue_full', 'queue is full')
+            self.waiting += 1
+
+    def _dequeue(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def _admitted(self, acquired):
+        if not acquired:
+            raise Overloaded(self, 'wait_timeout', f'no slot within {self.wait:g}s')
+        with self._lock:
+            self.active += 1
+            self.admitted += 1
+        return time.monotonic()
+
+    def acquire(self):
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            self._enqueue()
+            try:
+                acquired = self._slots.acquire(timeout=self.wait)
+            finally:
+                self._dequeue()
+        return self._admitted(acquired)
+
+    async def acquire_async(self, poll=0.005, max_poll=0.05):
+        """acquire() for an event loop: polls for a slot, backing off, instead of blocking the loop"""
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            self._enqueue()
+            try:
+                give_up = time.monotonic() + self.wait
+                while not acquired and time.monotonic() < give_up:
+                    await asyncio.sleep(poll)
+                    poll = min(2 * poll, max_poll)
+                    acquired = self._slots.acquire(blocking=False)
+            finally:
+                self._dequeue()
+        return self._admitted(acquired)
+
+    def release(self, acquired_at):
+        held = time.monotonic() - acquired_at
+        with self._lock:
+            self.active -= 1
+            self.service_time = held if self.admitted == 1 else 0.9 * self.service_time + 0.1 * held
+        self._slots.release()
+
+    def retry_after(self):
+        """Seconds until the queue ahead of a new request has likely drained"""
+        with self._lock:
+            backlog = self.active + self.waiting
+            return max(1, math.ceil(self.service_time * backlog / self.concurrency))
+
+
+bulkheads = {name: Bulkhead(name, **config) for name, config in ADMISSION_CONFIG['pools'].items()}
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None without one"""
+    if not has_request_context():
+        return None
+    deadline = g.get('deadline')
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded once the current request's deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline of {g.deadline_seconds:g}s exceeded")
+
+
+def detach_slot():
+    """
+    Take the current request's slot out of the release at teardown, for a
+    streamed response that holds it until sent; returns the function releasing it
+    """
+    pool = g.pop('admission_pool', None) if has_request_context() else None
+    if pool is None:
+        return lambda: None
+    acquired_at = g.admitted_at
+    return lambda: pool.release(acquired_at)
+
+
+def wants_stream(args, headers):
+    """Whether a request asks for an NDJSON stream (?stream=1 or Accept: application/x-ndjson)"""
+    return bool(args.get('stream')) or 'application/x-ndjson' in headers.get('Accept', '')
+
+
+def route_class(endpoint, args, headers):
+    """Admission class of a request: its endpoint's, or 'stream' for a stream of STREAMED_ROUTES"""
+    if endpoint in STREAMED_ROUTES and wants_stream(args, headers):
+        return 'stream'
+    return ROUTE_CLASSES.get(endpoint)
+
+
+def streamed(body, on_close=None):
+    """
+    (body, release) for a streamed response holding the request's slot until
+    it has been sent or the client went away: the slot is released, and
+    on_close() called, once, by release (pass it to response.call_on_close)
+    or at the end of body for servers that never close() it (Starlette's
+    WSGI bridge).
+    """
+    release_slot = detach_slot()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            release_slot()
+            if on_close is not None:
+                on_close()
+
+    def stream():
+        try:
+            yield from body
+        finally:
+            release()
+
+    return stream(), release
+
+
+def _deadline_response():
+    response = jsonify({'error': f"Deadline of {g.deadline_seconds:g}s exceeded"})
+    response.status_code = 504
+    return response
+
+
+def init_admission(app):
+    """Admit API requests through their class's bulkhead and enforce deadlines"""
+
+    @app.before_request
+    def admit_request():
+        pool_name = route_class(request.endpoint, request.args, request.headers)
+        if not ADMISSION_CONFIG['enabled'] or pool_name is None:
+            return None
+        pool = bulkheads[pool_name]
+        try:
+            g.admitted_at = pool.acquire()
+        except Overloaded as e:
+            registry.inc('quantifico_admission_rejected_total', pool=pool.name, reason=e.reason)
+            response = jsonify({'error': str(e)})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(pool.retry_after())
+            return response
+        g.admission_pool = pool
+        g.deadline_seconds = ROUTE_DEADLINES.get(request.endpoint, pool.deadline)
+        g.deadline = g.admitted_at + g.deadline_seconds
+        return None
+
+    @app.after_request
+    def enforce_deadline(response):
+        # Routes turn exceptions into 500s; one raised after the deadline was the cancellation
+        left = remaining()
+        if response.status_code == 500 and left is not None and left <= 0:
+            registry.inc('quantifico_deadline_exceeded_total', route=request.url_rule.rule)
+            return _deadline_response()
+        return response
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(e):
+        registry.inc('quantifico_deadline_exceeded_total', route=request.url_rule.rule)
+        return _deadline_response()
+
+    @app.teardown_request
+    def release_slot(exc):
+        # Runs when the view returns, before a streamed body is sent; streams that must hold
+        # their slot until the end take it with streamed()
+        pool = g.pop('admission_pool', None)
+        if pool is not None:
+            pool.release(g.admitted_at)
+
+    register_collector(lambda: [
+        ('quantifico_admission_active', 'gauge', 'Requests running per route class',
+         [({'pool': pool.name}, pool.active) for pool in bulkheads.values()]),
+        ('quantifico_admission_waiting', 'gauge', 'Requests waiting for a slot per route class',
+         [({'pool': pool.name}, pool.waiting) for pool in bulkheads.values()]),
+        ('quantifico_admission_capacity', 'gauge', 'Concurrent requests allowed per route class',
+         [({'pool': pool.name}, pool.concurrency) for pool in bulkheads.values()]),
+    ])
+    return app
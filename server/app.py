@@ -1,67 +1,88 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-import pandas as pd
-import os
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-import io
-import base64
-from matplotlib.figure import Figure
-import matplotlib
-matplotlib.use('Agg')  # Required for headless mode
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.patches import Arc
-from ScraperFC import Sofascore
-import numpy as np
-from tqdm import tqdm  # For progress bar
-from flask import Flask, jsonify, request  # Add request import
-from flask import request
 import json
+from partitions import UnknownPartition, get_partition_store
+from heatmap import aggregate_heatmap, parse_aggregate_args, request_heatmap, stream_heatmap
+from jobs import jobs_blueprint
+from single_flight import coalesce
+from instrumentation import init_app, span
+from profiling import init_profiling
+from filtering import get_filter_index, parse_filter_args, parse_sample_size, sample_rows
+from leaderboard import leaderboard_page, parse_leaderboard_args
+from player_images import player_image_response
+from radar import build_compare_payload, parse_compare_players
+from similarity import get_similarity_index, index_for_dataset, parse_similarity_args
+from warming import init_warmer, warmable
+from admission import check_deadline, init_admission, streamed, wants_stream
+from form import form_payload, parse_form_args, request_form_ingest
+from derived import DERIVED_METRICS, describe_derived
+from export import dataset_chunks, dataset_columns, export_response, parse_export_args, parse_export_metrics
 
 
 app = Flask(__name__)
 CORS(app)
-
-def load_player_data():
-    try:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        file_path = os.path.join(current_dir, 'data', 'premier_league_merged_stats_labeled_2324_fbref.xlsx')
-        print(f"Attempting to read file from: {file_path}")
-        
-        df = pd.read_excel(file_path, engine='openpyxl')
-        print("Successfully read Excel file")
-        return df
-    except Exception as e:
-        print(f"Error loading data: {e}")
-        return None
-
-@app.route('/api/player/<player_name>')
-def get_player_info(player_name):
+init_app(app)
+init_profiling(app)
+init_admission(app)
+app.register_blueprint(jobs_blueprint)
+
+def load_player_data(league=None, season=None):
+    """
+    Compact player dataset for one league/season partition, taken from the
+    league/season query parameters unless given; defaults to the manifest default.
+    """
+    league = league or request.args.get('league')
+    season = season or request.args.get('season')
+    with span('data_load'):
+        return get_partition_store().get(league, season)
+
+# Warmed responses are keyed by the version of the partition a request reads
+init_warmer(app, lambda: load_player_data().version)
+
+@app.route('/api/player/<player_id>')
+def get_player_info(player_id):
     try:
-        df = load_player_data()
-        if df is None:
+        dataset = load_player_data()
+        if dataset is None:
             return jsonify({'error': 'Data loading failed'}), 500
             
-        player = df[df['player'] == player_name].iloc[0]
+        row = dataset.row(player_id)
+        if row is None:
+            return jsonify({'error': 'Player not found'}), 404
         
         player_info = {
-            'name': player['player'],
-            'value': player['Value'],
-            'team': player['team'],
-            'nationality': player['nation_'],
-            'position': player['pos_'],
-            'age': int(player['age_']),
-            'matches_played': int(player['Playing Time_MP'])
+            'id': dataset.player_id(row),
+            'name': dataset.players[row],
+            'value': dataset.label('Value', row),
+            'team': dataset.label('team', row),
+            'nationality': dataset.label('nation_', row),
+            'position': dataset.label('pos_', row),
+            'age': int(dataset.age[row]),
+            'matches_played': int(dataset.metric('Playing Time_MP', row))
         }
         
         return jsonify(player_info)
         
-    except IndexError:
-        return jsonify({'error': 'Player not found'}), 404
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+@app.route('/api/player-image/<player_id>')
+def get_player_image(player_id):
+    """Cached, resized player image (?size=small|medium|large) with an ETag"""
+    try:
+        dataset = load_player_data()
+        row = dataset.row(player_id) if dataset is not None else None
+        player_name = dataset.players[row] if row is not None else player_id
+        return player_image_response(app, player_name)
+
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error fetching player image: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/search')
 def search_players():
     try:
@@ -69,43 +90,24 @@ def search_players():
         if not query:
             return jsonify({'players': []})
             
-        df = load_player_data()
+        dataset = load_player_data()
         
         matches = []
-        for idx, row in df.iterrows():
-            player_name = row['player'].lower()
+        for row, name in enumerate(dataset.players):
+            player_name = name.lower()
             name_parts = player_name.split()
             if (any(part.startswith(query) for part in name_parts) or
                 query in player_name):
-                matches.append(row['player'])
-        
-        matches = sorted(list(set(matches)))[:5]
-        return jsonify({'players': matches})
-        
-    except Exception as e:
-        print(f"Error in search: {e}")
-        return jsonify({'error': str(e)}), 500
-    try:
-        query = request.args.get('q', '').lower()
-        if not query:
-            return jsonify({'players': []})
-            
-        df = load_player_data()
-        
-        matches = []
-        for player in df['player']:
-            if query in player.lower():
-                matches.append(player)
-                
-            parts = player.lower().split()
-            if len(parts) > 1 and query in parts[-1]:
-                matches.append(player)
-                
-        matches = list(set(matches))
-        matches.sort()
+                matches.append((name, dataset.player_id(row)))
         
-        return jsonify({'players': matches})
+        matches = sorted(set(matches))[:5]
+        return jsonify({
+            'players': [name for name, _ in matches],
+            'results': [{'id': player_id, 'name': name} for name, player_id in matches]
+        })
         
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error in search: {e}")
         return jsonify({'error': str(e)}), 500
@@ -117,78 +119,125 @@ def normalize_value(value, min_val, max_val):
     return ((value - min_val) / (max_val - min_val)) * 100
 
 
+DEFAULT_PARALLEL_METRICS = {
+    'Position': 'pos_',
+    'Minutes': 'Playing Time_Min',
+    'Age': 'age_',
+    'Value': 'Value',
+    'Goals': 'Performance_Gls',
+    'Assists': 'Performance_Ast',
+    'SCA': 'goal_shot_creation_SCA_SCA',
+    'Key Passes': 'passing_KP_',
+    'Tackles + Int': 'defensive_Tkl+Int_',
+    'Prog Carries': 'possession_Carries_PrgC',
+    'Prog Passes': 'passing_PrgP_'
+}
 
-
-def convert_value_to_millions(value_str):
-    """Convert value string (e.g., '€900k', '€70.00m') to float in millions"""
-    try:
-        value_str = str(value_str).replace('€', '')
-        
-        if 'm' in value_str:
-            return float(value_str.replace('m', ''))
-        elif 'k' in value_str:
-            return float(value_str.replace('k', '')) / 1000
+def parallel_row(dataset, row, metrics):
+    """One player's line in the parallel coordinates plot"""
+    values = {}
+    for metric_name, column in metrics.items():
+        if metric_name == 'Position':
+            value = dataset.primary_position(row)
+        elif metric_name == 'Value':
+            value = float(dataset.value_millions[row])
+        elif dataset.has_metric(column):
+            value = dataset.metric(column, row)
         else:
-            return float(value_str) / 1000000
+            value = 0.0
+        values[metric_name] = value
+    return {'player': dataset.players[row], 'id': dataset.player_id(row), 'values': values}
+
+@app.route('/api/parallel/query')
+def query_parallel_data():
+    """
+    League-wide brushing: players matching range predicates (?ranges={"column": [low, high]})
+    and team/nation/position filters, with an evenly spaced sample of their rows
+    """
+    try:
+        dataset = load_player_data()
+        if dataset is None:
+            return jsonify({'error': 'Data loading failed'}), 500
+
+        metrics_param = request.args.get('metrics')
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_PARALLEL_METRICS
+        ranges, categories = parse_filter_args(request.args)
+        sample_size = parse_sample_size(request.args)
+
+        index = get_filter_index(dataset)
+        with span('filter_query'):
+            rows = index.query(ranges, categories)
+        sample = sample_rows(rows, sample_size)
+
+        return jsonify({
+            'total': len(dataset),
+            'matched': int(len(rows)),
+            'ids': [dataset.player_id(r) for r in rows],
+            'sampled': bool(len(sample) < len(rows)),
+            'metrics': list(metrics.keys()),
+            'data': [parallel_row(dataset, r, metrics) for r in sample],
+            'domains': {
+                'Position': ['GK', 'DF', 'MF', 'FW']
+            }
+        })
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        print(f"Error converting value: {value_str}, {str(e)}")
-        return 0.0
+        print(f"Error querying parallel coordinates data: {e}")
+        return jsonify({'error': str(e)}), 500
 
-def get_primary_position(pos_str):
-    """Extract primary position from position string"""
-    if pd.isna(pos_str) or not pos_str:
-        return 'NA'
+@app.route('/api/export')
+def export_players():
+    """
+    Every player matching the /api/parallel/query filters, with the selected
+    metrics, streamed as CSV or Parquet (?format=)
+    """
+    try:
+        dataset = load_player_data()
+        if dataset is None:
+            return jsonify({'error': 'Data loading failed'}), 500
 
-    first_pos = str(pos_str).split(',')[0].split('/')[0].strip().upper()
-    
+        metrics = parse_export_metrics(request.args, DEFAULT_PARALLEL_METRICS)
+        ranges, categories = parse_filter_args(request.args)
+        export_format = parse_export_args(request.args)
+        columns = dataset_columns(dataset, metrics)
 
-    if 'GK' in first_pos:
-        return 'GK'
-    elif 'DF' in first_pos:
-        return 'DF'
-    elif 'MF' in first_pos:
-        return 'MF'
-    elif 'FW' in first_pos:
-        return 'FW'
-    return 'NA'
+        with span('filter_query'):
+            rows = get_filter_index(dataset).query(ranges, categories)
+        return export_response(export_format, columns, dataset_chunks(dataset, rows, metrics))
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error exporting players: {e}")
+        return jsonify({'error': str(e)}), 500
 
-@app.route('/api/parallel/<player_name>')
-def get_parallel_data(player_name):
+@app.route('/api/parallel/<player_id>')
+@warmable
+def get_parallel_data(player_id):
     try:
-        df = load_player_data()
-        if df is None:
+        dataset = load_player_data()
+        if dataset is None:
             return jsonify({'error': 'Data loading failed'}), 500
             
 
         metrics_param = request.args.get('metrics')
-        if metrics_param:
-            metrics = json.loads(metrics_param)
-        else:
-           
-            metrics = {
-                'Position': 'pos_', 
-                'Minutes': 'Playing Time_Min',
-                'Age': 'age_',
-                'Value': 'Value',
-                'Goals': 'Performance_Gls',
-                'Assists': 'Performance_Ast',
-                'SCA': 'goal_shot_creation_SCA_SCA',
-                'Key Passes': 'passing_KP_',
-                'Tackles + Int': 'defensive_Tkl+Int_',
-                'Prog Carries': 'possession_Carries_PrgC',
-                'Prog Passes': 'passing_PrgP_'
-            }
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_PARALLEL_METRICS
 
-     
-        player_team = df[df['player'] == player_name]['team'].iloc[0]
-    
-        team_players = df[df['team'] == player_team].copy()
-        
-        team_players['position_category'] = team_players['pos_'].apply(get_primary_position)
+        row = dataset.row(player_id)
+        if row is None:
+            return jsonify({'error': 'Player not found'}), 404
+
+        team_rows = dataset.rows_with('team', dataset.label('team', row))
+        team_players = [dataset.players[r] for r in team_rows]
         
         result = {
-            'players': team_players['player'].tolist(),
+            'players': team_players,
             'metrics': list(metrics.keys()),
             'data': [],
             'domains': {
@@ -196,293 +245,218 @@ def get_parallel_data(player_name):
             }
         }
         
-        for _, player in team_players.iterrows():
-            player_data = {
-                'player': player['player'],
-                'values': {}
-            }
-            
-            for metric_name, column in metrics.items():
-                value = player[column]
-                if metric_name == 'Position':
-                    value = get_primary_position(player['pos_'])
-                elif metric_name == 'Value':
-                    value = convert_value_to_millions(value)
-                else:
-                    try:
-                        value = float(value)
-                    except (TypeError, ValueError):
-                        value = 0.0
-                
-                player_data['values'][metric_name] = value
-                
-            result['data'].append(player_data)
+        for player_row in team_rows:
+            result['data'].append(parallel_row(dataset, player_row, metrics))
             
         return jsonify(result)
         
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error processing parallel coordinates data: {e}")
         return jsonify({'error': str(e)}), 500
-@app.route('/api/scatter/<player_name>')
-def get_scatter_data(player_name):
+@app.route('/api/scatter/<player_id>')
+@warmable
+@coalesce
+def get_scatter_data(player_id):
     try:
-        df = load_player_data()
-        if df is None:
+        dataset = load_player_data()
+        if dataset is None:
             return jsonify({'error': 'Data loading failed'}), 500
-            
-   
-        midfielders = df[df['pos_'].str.contains('MF', na=False)].copy()
-       
-        attacking_metrics = [
-            'goal_shot_creation_SCA_SCA90',  # SCA
-            'passing_KP_',                    # Key passes
-            'possession_Carries_PrgC',        # Progressive carries
-            'passing_PrgP_',                  # Progressive passes
-            'Per 90 Minutes_xAG',            # xAG/90
-            'Per 90 Minutes_npxG',           # npxG/90
-            'possession_Take-Ons_Succ%'      # Take ons success rate
-        ]
-        
-        defensive_metrics = [
-            'misc_Aerial Duels_Won%',        # Aerial duels won
-            'defensive_Challenges_Tkl%',      # Defensive challenges tackled
-            'defensive_Blocks_Blocks',        # Defensive blocks
-            'defensive_Int_'                  # Defensive interceptions
-        ]
-        
-      
-        def calculate_pca(metrics):
-            X = midfielders[metrics].fillna(0)
-            
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            
-            pca = PCA(n_components=1)
-            principal_components = pca.fit_transform(X_scaled)
-            
-            return principal_components.flatten(), pca.explained_variance_ratio_[0]
-        
-        attacking_pca, att_variance = calculate_pca(attacking_metrics)
-        defensive_pca, def_variance = calculate_pca(defensive_metrics)
-        
+
+        selected_row = dataset.row(player_id)
+        selected_player = dataset.players[selected_row] if selected_row is not None else player_id
+
+        # PCA components are fitted once per published dataset version
+        midfielders = [dataset.players[r] for r in dataset.midfielder_rows]
+        attacking_pca, defensive_pca = dataset.scatter_pca
+        att_variance = dataset.scatter_variance['attacking']
+        def_variance = dataset.scatter_variance['defensive']
+
         result = {
-            'players': midfielders['player'].tolist(),
+            'players': midfielders,
             'data': [],
-            'selected_player': player_name,
+            'selected_player': selected_player,
             'variance_explained': {
                 'attacking': round(att_variance * 100, 2),
                 'defensive': round(def_variance * 100, 2)
             }
         }
         
-        for i, player in enumerate(midfielders['player']):
+        for i, player in enumerate(midfielders):
+            row = dataset.midfielder_rows[i]
             result['data'].append({
                 'player': player,
+                'id': dataset.player_id(row),
                 'attacking': float(attacking_pca[i]),
                 'defensive': float(defensive_pca[i]),
-                'team': midfielders.iloc[i]['team']
+                'team': dataset.label('team', row)
             })
             
         return jsonify(result)
         
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error processing scatter plot data: {e}")
         return jsonify({'error': str(e)}), 500
     
 
-HEATMAP_PARAMS = {
-    'bw_adjust': 0.7,     # ADJUST THIS: Lower (0.5-0.8) for more distinct spots, Higher for more blur
-    'levels': 90,        # ADJUST THIS: Lower (20-50) for more distinct levels, Higher for smoother gradient
-    'thresh': 0.08,       # ADJUST THIS: Higher (0.1-0.2) for less spread, Lower for more spread
-}
-
-# Coordinate scaling and positioning
-SCALING = {
-    'x_scale': 1.29,      # ADJUST THIS: Changes horizontal stretch/compression
-    'y_scale': 0.9,       # ADJUST THIS: Changes vertical stretch/compression
-    'x_offset': 0,        # ADJUST THIS: Shifts entire heatmap left (-) or right (+)
-    'y_offset': 0         # ADJUST THIS: Shifts entire heatmap up (+) or down (-)
-}
+@app.route('/api/heatmap/<player_id>')
+@warmable
+def get_heatmap(player_id):
+    try:
+        store = get_partition_store()
+        partition = store.info(store.resolve_key(request.args.get('league'), request.args.get('season')))
+        sofascore = partition['sofascore']
+
+        dataset = load_player_data()
+        row = dataset.row(player_id) if dataset is not None else None
+        player_name = dataset.players[row] if row is not None else player_id
+
+        # Sofascore team names differ from FBref's for a few clubs
+        team_name = request.args.get('team') or "Manchester United"
+        if row is not None:
+            team = dataset.label('team', row)
+            team_name = sofascore.get('teams', {}).get(team, team)
+
+        if wants_stream(request.args, request.headers):
+            # One NDJSON line per match so the client can draw as data arrives; the
+            # 'stream' admission slot is held until the season has been sent
+            body, release = streamed(stream_heatmap(sofascore['year'], sofascore['league'], player_name, team_name))
+            response = Response(
+                stream_with_context(body),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            response.call_on_close(release)
+            return response
+
+        payload, job = request_heatmap(
+            sofascore['year'], sofascore['league'], player_name, team_name,
+            result_url=request.full_path.rstrip('?')
+        )
+        if payload is not None:
+            return jsonify(payload)
 
-def create_soccer_field(ax):
-    # White background
-    ax.set_facecolor('white')
-    
-    # Black lines for the pitch
-    line_color = 'black'
-    line_width = 1
-    
-    # Pitch outline and center line
-    plt.plot([0, 0], [0, 90], color=line_color, linewidth=line_width)
-    plt.plot([0, 130], [90, 90], color=line_color, linewidth=line_width)
-    plt.plot([130, 130], [90, 0], color=line_color, linewidth=line_width)
-    plt.plot([130, 0], [0, 0], color=line_color, linewidth=line_width)
-    plt.plot([65, 65], [0, 90], color=line_color, linewidth=line_width)
-
-    # Left penalty area
-    plt.plot([16.5, 16.5], [65, 25], color=line_color, linewidth=line_width)
-    plt.plot([0, 16.5], [65, 65], color=line_color, linewidth=line_width)
-    plt.plot([16.5, 0], [25, 25], color=line_color, linewidth=line_width)
-
-    # Right penalty area
-    plt.plot([130, 113.5], [65, 65], color=line_color, linewidth=line_width)
-    plt.plot([113.5, 113.5], [65, 25], color=line_color, linewidth=line_width)
-    plt.plot([113.5, 130], [25, 25], color=line_color, linewidth=line_width)
-
-    # Left 6-yard box
-    plt.plot([0, 5.5], [54, 54], color=line_color, linewidth=line_width)
-    plt.plot([5.5, 5.5], [54, 36], color=line_color, linewidth=line_width)
-    plt.plot([5.5, 0], [36, 36], color=line_color, linewidth=line_width)
-
-    # Right 6-yard box
-    plt.plot([130, 124.5], [54, 54], color=line_color, linewidth=line_width)
-    plt.plot([124.5, 124.5], [54, 36], color=line_color, linewidth=line_width)
-    plt.plot([124.5, 130], [36, 36], color=line_color, linewidth=line_width)
-
-    # Center circle
-    center_circle = plt.Circle((65, 45), 9.15, color=line_color, fill=False, linewidth=line_width)
-    ax.add_patch(center_circle)
-    
-    # Penalty spots and center spot
-    plt.scatter([11, 65, 119], [45, 45, 45], color=line_color, s=20)
-
-    # Penalty arcs
-    left_arc = Arc((11, 45), height=18.3, width=18.3, angle=0, theta1=310, theta2=50, 
-                   color=line_color, linewidth=line_width)
-    right_arc = Arc((119, 45), height=18.3, width=18.3, angle=0, theta1=130, theta2=230, 
-                    color=line_color, linewidth=line_width)
-    ax.add_patch(left_arc)
-    ax.add_patch(right_arc)
-
-def get_season_heatmap_data(year="2023/2024", league="EPL", player_name="Bruno Fernandes", team_name="Manchester United"):
-    """Collect heatmap data from all matches in a season for a specific player"""
-    ss = Sofascore()
-    
-    # Get all matches from the season
-    print(f"Fetching {league} matches for {year} season...")
-    matches = ss.get_match_dicts(year, league)
-    
-    # Filter for team's matches
-    team_matches = [
-        match for match in matches 
-        if team_name in match['homeTeam']['name'] or team_name in match['awayTeam']['name']
-    ]
-    
-    print(f"Found {len(team_matches)} matches for {team_name}")
-    
-    # Collect coordinates from all matches
-    all_coordinates = []
-    skipped_matches = 0
-    
-    for match in tqdm(team_matches, desc="Processing matches"):
-        try:
-            match_id = match['id']
-            heatmap_data = ss.scrape_heatmaps(match_id)
-            
-            # Find player data
-            player_data = None
-            for player_id, data in heatmap_data.items():
-                if player_name.lower() in player_id.lower():
-                    player_data = data
-                    break
-            
-            if player_data and player_data['heatmap']:
-                all_coordinates.extend(player_data['heatmap'])
-        except Exception as e:
-            print(f"Skipped match {match_id} due to error: {str(e)}")
-            skipped_matches += 1
-    
-    print(f"Processed {len(team_matches) - skipped_matches} matches successfully")
-    print(f"Total coordinates collected: {len(all_coordinates)}")
+        # Season scrapes take minutes; hand back a job to poll or subscribe to
+        response = jsonify(job.to_dict())
+        response.headers['Location'] = job.to_dict()['status_url']
+        return response, 202
+        
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error processing heatmap data: {e}")
+        return jsonify({'error': str(e)}), 500
     
-    return all_coordinates
 
+@app.route('/api/heatmap/aggregate')
+def get_aggregate_heatmap():
+    """
+    Season heatmap of a cohort summed from per-player occupancy grids: the
+    players matching team/nation/position/age/ranges filters (as
+    /api/parallel/query) and min_minutes, or ?players=a,b,c. weight=points|
+    equal|minutes, normalize=none|max|sum; scrape=1 queues scrapes for
+    players whose season is not cached yet.
+    """
+    try:
+        store = get_partition_store()
+        partition = store.info(store.resolve_key(request.args.get('league'), request.args.get('season')))
+        sofascore = partition['sofascore']
 
-def create_season_heatmap(year="2023/2024", league="EPL", player_name="Bruno Fernandes", team_name="Manchester United"):
-    """Create a heatmap visualization for an entire season"""
-    # Get the combined coordinates
-    coordinates = get_season_heatmap_data(year, league, player_name, team_name)
-    
-    if not coordinates:
-        raise ValueError("No heatmap data found for the specified parameters")
-    
-    # Convert to DataFrame
-    coords_df = pd.DataFrame(coordinates, columns=['x', 'y'])
-    
-    # Apply scaling
-    coords_df['x'] = coords_df['x'] * SCALING['x_scale'] + SCALING['x_offset']
-    coords_df['y'] = coords_df['y'] * SCALING['y_scale'] + SCALING['y_offset']
-    
-    # Create figure
-    plt.figure(figsize=(13, 8))
-    ax = plt.gca()
-    
-    # Create pitch
-    create_soccer_field(ax)
-    
-    # Create heatmap
-    sns.kdeplot(
-        data=coords_df, 
-        x='x', 
-        y='y', 
-        cmap='YlOrRd',
-        fill=True,
-        alpha=1.0,
-        levels=HEATMAP_PARAMS['levels'],
-        bw_adjust=HEATMAP_PARAMS['bw_adjust'],
-        clip=((0, 130), (0, 90)),
-        thresh=HEATMAP_PARAMS['thresh']
-    )
-    
-    # Styling
-    plt.title(f"{player_name} - {year} Season Heatmap", pad=20, color='black')
-    plt.axis('off')
-    
-    # Set figure background to white
-    fig = plt.gcf()
-    fig.patch.set_facecolor('white')
-    
-    return fig
+        dataset = load_player_data()
+        if dataset is None:
+            return jsonify({'error': 'Data loading failed'}), 500
 
+        players, weight, normalize, scrape = parse_aggregate_args(request.args)
+        not_found = []
+        if players:
+            rows = []
+            for player in players:
+                row = dataset.row(player)
+                if row is None:
+                    not_found.append(player)
+                else:
+                    rows.append(row)
+        else:
+            ranges, categories = parse_filter_args(request.args)
+            if request.args.get('min_minutes'):
+                ranges['Playing Time_Min'] = (float(request.args['min_minutes']), None)
+            with span('filter_query'):
+                rows = get_filter_index(dataset).query(ranges, categories)
+
+        # Sofascore team names differ from FBref's for a few clubs
+        teams = sofascore.get('teams', {})
+        members = [
+            (dataset.player_id(row), dataset.players[row],
+             teams.get(dataset.label('team', row), dataset.label('team', row)),
+             dataset.metric('Playing Time_Min', row))
+            for row in rows
+        ]
+        payload = aggregate_heatmap(sofascore['year'], sofascore['league'], members, weight, normalize, scrape)
+        payload['not_found'] = not_found
+        return jsonify(payload)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error aggregating heatmap data: {e}")
+        return jsonify({'error': str(e)}), 500
+    
 
-@app.route('/api/heatmap/<player_name>')
-def get_heatmap(player_name):
+@app.route('/api/form/<player_id>')
+def get_player_form(player_id):
+    """
+    Rolling form over a player's matches in the per-match store (form.py):
+    ?window=5 (or several, e.g. 5,10), metrics=xG,xA,... and per90=0 for
+    window totals. With scrape=1, a player without recorded matches gets a
+    background job recording their team's season instead (202).
+    """
     try:
-        coordinates = get_season_heatmap_data(
-            year="23/24", 
-            league="EPL", 
-            player_name=player_name, 
-            team_name="Manchester United"
-        )
-        scaled_coordinates = [
-            {
-                'x': coord[0] * SCALING['x_scale'] + SCALING['x_offset'],
-                'y': coord[1] * SCALING['y_scale'] + SCALING['y_offset']
-            }
-            for coord in coordinates
-        ]
-        
-        return jsonify({
-            'coordinates': scaled_coordinates,
-            'pitch_dimensions': {
-                'width': 130,
-                'height': 90
-            }
-        })
-        
+        store = get_partition_store()
+        partition = store.info(store.resolve_key(request.args.get('league'), request.args.get('season')))
+        sofascore = partition['sofascore']
+
+        dataset = load_player_data()
+        row = dataset.row(player_id) if dataset is not None else None
+        player_name = dataset.players[row] if row is not None else player_id
+
+        # Sofascore team names differ from FBref's for a few clubs
+        team_name = request.args.get('team') or "Manchester United"
+        if row is not None:
+            team = dataset.label('team', row)
+            team_name = sofascore.get('teams', {}).get(team, team)
+
+        windows, metrics, per90 = parse_form_args(request.args)
+        payload = form_payload(sofascore['year'], sofascore['league'], player_name, windows, metrics, per90)
+        if not payload['matches'] and request.args.get('scrape', '').lower() in ('1', 'true', 'yes'):
+            job = request_form_ingest(sofascore['year'], sofascore['league'], team_name,
+                                      result_url=request.full_path.rstrip('?'))
+            response = jsonify(job.to_dict())
+            response.headers['Location'] = job.to_dict()['status_url']
+            return response, 202
+        return jsonify(payload)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        print(f"Error processing heatmap data: {e}")
+        print(f"Error processing form data: {e}")
         return jsonify({'error': str(e)}), 500
     
 
 @app.route('/api/available-metrics')
 def get_available_metrics():
     try:
-        df = load_player_data()
-        if df is None:
+        dataset = load_player_data()
+        if dataset is None:
             return jsonify({'error': 'Data loading failed'}), 500
       
-        numerical_cols = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+        numerical_cols = [m for m in dataset.metrics if m not in DERIVED_METRICS]
         
        
         if 'pos_' not in numerical_cols:
@@ -496,69 +470,265 @@ def get_available_metrics():
             }
             for col in numerical_cols
         ]
+        metrics.extend(describe_derived(dataset.metrics))
         
         return jsonify({'metrics': metrics})
         
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error getting metrics: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/radar/<player_name>')
-def get_radar_data(player_name):
+DEFAULT_RADAR_METRICS = {
+    'Shot Creating Actions': 'goal_shot_creation_SCA_SCA',
+    'Key Passes': 'passing_KP_',
+    'Prog. Carries': 'possession_Carries_1/3',
+    'Prog. Passes': 'passing_PrgP_',
+    'xAG': 'Expected_xAG',
+    'npxG': 'Expected_npxG',
+    'Tackles+Interceptions': 'defensive_Tkl+Int_',
+    'Take-ons Succ.': 'possession_Take-Ons_Succ%',
+    'Recoveries': 'misc_Performance_Recov'
+}
+
+def build_radar_payload(dataset, row, metrics):
+    """Normalize one player's metrics against the partition's midfielder cohort"""
+    player_values = {}
+    league_averages = {}
+    raw_values = {}
+
+    for display_name, column in metrics.items():
+        # Midfielder min/max/mean are precomputed per dataset version
+        min_val, max_val, avg_val = dataset.cohort_stats(column)
+        player_value = dataset.metric(column, row)
+        
+        raw_values[display_name] = {
+            'player': player_value,
+            'league_avg': avg_val,
+            'max': max_val
+        }
+        
+        player_values[display_name] = normalize_value(player_value, min_val, max_val)
+        league_averages[display_name] = normalize_value(avg_val, min_val, max_val)
+
+    return {
+        'player': player_values,
+        'league_average': league_averages,
+        'raw_values': raw_values,
+        'metrics': list(metrics.keys())
+    }
+
+@app.route('/api/radar/<player_id>')
+@warmable
+@coalesce
+def get_radar_data(player_id):
     try:
-        df = load_player_data()
-        if df is None:
+        dataset = load_player_data()
+        if dataset is None:
             return jsonify({'error': 'Data loading failed'}), 500
 
         
         metrics_param = request.args.get('metrics')
-        if metrics_param:
-            metrics = json.loads(metrics_param)
-        else:
-           
-            metrics = {
-                'Shot Creating Actions': 'goal_shot_creation_SCA_SCA',
-                'Key Passes': 'passing_KP_',
-                'Prog. Carries': 'possession_Carries_1/3',
-                'Prog. Passes': 'passing_PrgP_',
-                'xAG': 'Expected_xAG',
-                'npxG': 'Expected_npxG',
-                'Tackles+Interceptions': 'defensive_Tkl+Int_',
-                'Take-ons Succ.': 'possession_Take-Ons_Succ%',
-                'Recoveries': 'misc_Performance_Recov'
-            }
-        
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_RADAR_METRICS
        
-        midfielders = df[df['pos_'].str.contains('MF', na=False)]
-        player_data = df[df['player'] == player_name].iloc[0]
+        row = dataset.row(player_id)
+        if row is None:
+            return jsonify({'error': 'Player not found'}), 404
 
-        player_values = {}
-        league_averages = {}
-        raw_values = {}
+        return jsonify(build_radar_payload(dataset, row, metrics))
+        
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error processing radar data: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        for display_name, column in metrics.items():
-            min_val = midfielders[column].min()
-            max_val = midfielders[column].max()
-            avg_val = midfielders[column].mean()
-            
-            raw_values[display_name] = {
-                'player': float(player_data[column]),
-                'league_avg': float(avg_val),
-                'max': float(max_val)
+@app.route('/api/radar/<player_id>/career')
+@coalesce
+def get_career_radar_data(player_id):
+    """Radar for every league/season the player appears in, each against its own cohort"""
+    try:
+        store = get_partition_store()
+        metrics_param = request.args.get('metrics')
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_RADAR_METRICS
+
+        # Ids end in their season, so only that season's partitions are needed
+        # to map an id back to the player's name; anything else is a name
+        player_name = player_id
+        for league, season in store.partitions_for_id(player_id):
+            dataset = store.get(league, season)
+            row = dataset.index.id_index.get(player_id) if dataset is not None else None
+            if row is not None:
+                player_name = dataset.players[row]
+                break
+
+        seasons = []
+        # Only partitions whose manifest lists the player are loaded
+        for league, season in store.partitions_for_player(player_name):
+            check_deadline()
+            dataset = store.get(league, season)
+            if dataset is None:
+                continue
+            for row in dataset.index.matches(player_name):
+                seasons.append({
+                    'league': league,
+                    'season': season,
+                    'id': dataset.player_id(row),
+                    'team': dataset.label('team', row),
+                    **build_radar_payload(dataset, row, metrics)
+                })
+
+        if not seasons:
+            return jsonify({'error': 'Player not found'}), 404
+
+        return jsonify({'player': player_name, 'metrics': list(metrics.keys()), 'seasons': seasons})
+
+    except Exception as e:
+        print(f"Error processing career radar data: {e}")
+        return jsonify({'error': str(e)}), 500
+@app.route('/api/radar/compare')
+@coalesce
+def compare_radar_data():
+    """Radar values of several players, normalized against one cohort in a single pass"""
+    try:
+        dataset = load_player_data()
+        if dataset is None:
+            return jsonify({'error': 'Data loading failed'}), 500
+
+        metrics_param = request.args.get('metrics')
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_RADAR_METRICS
+        unknown = [column for column in metrics.values() if not dataset.has_metric(column)]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+
+        rows, players, not_found = [], [], []
+        for player_key in parse_compare_players(request.args):
+            row = dataset.row(player_key)
+            if row is None:
+                not_found.append(player_key)
+                continue
+            if row in rows:   # The same player by id and by name
+                continue
+            rows.append(row)
+            players.append({
+                'id': dataset.player_id(row),
+                'name': dataset.players[row],
+                'team': dataset.label('team', row)
+            })
+        if not rows:
+            return jsonify({'error': 'Player not found', 'not_found': not_found}), 404
+
+        # One gather of metric x player values and of the cohort's (min, max, mean)
+        metric_rows = [dataset.metric_index[column] for column in metrics.values()]
+        values = dataset.matrix[metric_rows][:, rows].T
+        min_vals, max_vals, avg_vals = dataset.midfielder_stats[:, metric_rows]
+
+        return jsonify(build_compare_payload(players, metrics.keys(), values,
+                                             min_vals, max_vals, avg_vals, not_found))
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error comparing radar data: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/leaderboard')
+def get_leaderboard():
+    """
+    Top players by one metric (?metric=, optionally per90=1 and order=asc), with
+    position/team/nation/min_minutes filters and cursor pagination. league and
+    season may be comma-separated or 'all' to rank across partitions.
+    """
+    try:
+        query = parse_leaderboard_args(request.args)
+        store = get_partition_store()
+        keys = store.select(request.args.get('league'), request.args.get('season'))
+        with span('data_load'):
+            datasets = {f'{league} {season}': store.get(league, season) for league, season in keys}
+        if any(dataset is None for dataset in datasets.values()):
+            return jsonify({'error': 'Data loading failed'}), 500
+
+        with span('leaderboard'):
+            entries, next_cursor = leaderboard_page(datasets, query, request.args.get('cursor'))
+
+        results = []
+        for rank, label, dataset, row, value in entries:
+            league, season = label.split(' ', 1)
+            results.append({
+                'rank': rank,
+                'id': dataset.player_id(row),
+                'name': dataset.players[row],
+                'team': dataset.label('team', row),
+                'position': dataset.label('pos_', row),
+                'age': int(dataset.age[row]),
+                'minutes': int(dataset.metric('Playing Time_Min', row)),
+                'league': league,
+                'season': season,
+                'value': value
+            })
+
+        return jsonify({
+            'metric': query['metric'],
+            'per90': query['per90'],
+            'order': query['order'],
+            'partitions': list(datasets),
+            'results': results,
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error building leaderboard: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/similar/<player_id>')
+def get_similar_players(player_id):
+    """Players whose standardized per-90 profile is closest to this player's"""
+    try:
+        dataset = load_player_data()
+        if dataset is None:
+            return jsonify({'error': 'Data loading failed'}), 500
+
+        row = dataset.row(player_id)
+        if row is None:
+            return jsonify({'error': 'Player not found'}), 404
+
+        metrics, k, filters = parse_similarity_args(request.args)
+        index = get_similarity_index(dataset.version, lambda: index_for_dataset(dataset))
+        with span('similarity_search'):
+            rows, distances = index.nearest(row, metrics, k, index.candidates(**filters))
+
+        def describe(r):
+            return {
+                'id': dataset.player_id(r),
+                'name': dataset.players[r],
+                'team': dataset.label('team', r),
+                'position': dataset.label('pos_', r),
+                'age': int(dataset.age[r]),
+                'value': dataset.label('Value', r),
+                'minutes': int(index.minutes[r])
             }
-            
-            player_values[display_name] = normalize_value(player_data[column], min_val, max_val)
-            league_averages[display_name] = normalize_value(avg_val, min_val, max_val)
-        
+
         return jsonify({
-            'player': player_values,
-            'league_average': league_averages,
-            'raw_values': raw_values,
-            'metrics': list(metrics.keys())
+            'player': describe(row),
+            'metrics': metrics,
+            'filters': {name: value for name, value in filters.items() if value is not None},
+            'results': [{**describe(r), 'distance': round(float(d), 4)} for r, d in zip(rows, distances)]
         })
-        
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        print(f"Error processing radar data: {e}")
+        print(f"Error finding similar players: {e}")
         return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True, port=8000)
\ No newline at end of file
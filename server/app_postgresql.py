@@ -1,24 +1,41 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import psycopg2
 from psycopg2.extras import RealDictCursor
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-import numpy as np
 import json
 import traceback
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.patches import Arc
-from ScraperFC import Sofascore
-from tqdm import tqdm
+import numpy as np
 from dotenv import load_dotenv
 load_dotenv()
 import os
+import threading
+import time
+from player_ids import PlayerIndex
+from heatmap import aggregate_heatmap, parse_aggregate_args, request_heatmap, stream_heatmap
+from jobs import jobs_blueprint
+from single_flight import coalesce
+from instrumentation import init_app, span
+from profiling import init_profiling
+from db import ConnectionPool, register_pool_metrics
+from filtering import parse_filter_args, parse_sample_size, sample_rows
+from leaderboard import decode_cursor, encode_cursor, parse_leaderboard_args, query_fingerprint
+from player_images import player_image_response
+from radar import build_compare_payload, parse_compare_players
+from similarity import SIMILARITY_METRICS, get_similarity_index, index_for_rows, parse_similarity_args
+from warming import init_warmer, warmable
+from admission import init_admission, streamed, wants_stream
+from form import form_payload, parse_form_args, request_form_ingest
+from export import EXPORT_CONFIG, export_response, parse_export_args, parse_export_metrics
+from process_pool import run_cpu_bound
+from scatter import scatter_components
+from partitions import UnknownPartition, get_partition_store
 
 app = Flask(__name__)
 CORS(app)
+init_app(app)
+init_profiling(app)
+init_admission(app)
+app.register_blueprint(jobs_blueprint)
 
 # Database connection details
 DB_CONFIG = {
@@ -29,15 +46,100 @@ DB_CONFIG = {
     "port": int(os.getenv("DB_PORT", 5432))
 }
 
+db_pool = ConnectionPool(DB_CONFIG)
+register_pool_metrics(db_pool)
+
 def get_db_connection():
-    """Establish and return a database connection."""
+    """Check a connection out of the pool; return it with release_db_connection()."""
     try:
-        connection = psycopg2.connect(**DB_CONFIG)
+        connection = db_pool.getconn()
         return connection
     except Exception as e:
         print(f"Error connecting to the database: {e}")
         return None
 
+def release_db_connection(connection):
+    db_pool.putconn(connection)
+
+@app.teardown_request
+def release_request_connections(exc):
+    # Error paths that skipped release_db_connection() must not leak pool slots
+    db_pool.release_request_connections()
+
+# Player id index, refreshed from players_info at most every PLAYER_INDEX_TTL seconds
+PLAYER_INDEX_TTL = int(os.getenv("PLAYER_INDEX_TTL", 300))
+_player_index = {"index": None, "loaded_at": 0.0}
+_player_index_lock = threading.Lock()
+
+def get_player_index(connection):
+    """
+    Return the in-process PlayerIndex mapping slug ids and normalized names to
+    players_info.player_id, so routes never scan players_info by name.
+    """
+    index = cached_player_index()
+    if index is not None:
+        return index
+
+    with _player_index_lock:
+        with connection.cursor() as cursor:
+            cursor.execute(PLAYER_INDEX_QUERY)
+            index = PlayerIndex(cursor.fetchall())
+        set_player_index(index)
+        return index
+
+PLAYER_INDEX_QUERY = """
+    SELECT player_id, player, team, season, born_
+    FROM players_info
+    ORDER BY player_id
+"""
+
+def cached_player_index():
+    """The loaded PlayerIndex, or None once it is older than PLAYER_INDEX_TTL"""
+    index = _player_index["index"]
+    if index is not None and time.monotonic() - _player_index["loaded_at"] < PLAYER_INDEX_TTL:
+        return index
+    return None
+
+def set_player_index(index):
+    _player_index["index"] = index
+    _player_index["loaded_at"] = time.monotonic()
+
+def resolve_in_index(index, player_key):
+    """
+    Resolve a slug id, a numeric players_info.player_id or (for backwards
+    compatibility) a player name to players_info.player_id.
+    """
+    if str(player_key).isdigit() and int(player_key) in index.key_ids:
+        return int(player_key)
+    return index.resolve(player_key)
+
+def resolve_player_id(connection, player_key):
+    return resolve_in_index(get_player_index(connection), player_key)
+
+def table_version(connection):
+    """The row count and highest player_id of players_info act as the data version"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*), max(player_id) FROM players_info")
+        return ('postgres',) + tuple(cursor.fetchone())
+
+# Data version used to key warmed responses, re-read at most every DATA_VERSION_TTL seconds
+DATA_VERSION_TTL = int(os.getenv("DATA_VERSION_TTL", 10))
+_data_version = {"version": None, "loaded_at": 0.0}
+
+def data_version():
+    if _data_version["version"] is None or time.monotonic() - _data_version["loaded_at"] >= DATA_VERSION_TTL:
+        connection = get_db_connection()
+        if connection is None:
+            raise RuntimeError("Failed to connect to the database")
+        try:
+            _data_version["version"] = table_version(connection)
+            _data_version["loaded_at"] = time.monotonic()
+        finally:
+            release_db_connection(connection)
+    return _data_version["version"]
+
+init_warmer(app, data_version)
+
 @app.route('/api/search', methods=['GET'])
 def search_players():
     try:
@@ -50,40 +152,51 @@ def search_players():
             return jsonify({"error": "Failed to connect to the database"}), 500
 
         with connection.cursor() as cursor:
-            # Advanced search query with multiple match strategies
-            search_query = """
-            SELECT DISTINCT player
-            FROM players_info
-            WHERE 
-                LOWER(player) LIKE %s OR  -- Partial name match
-                LOWER(player) LIKE %s OR  -- First word match
-                LOWER(player) LIKE %s     -- Last word match
-            LIMIT 5
-            """
-            
-            # Different search pattern variations
-            search_patterns = [
-                f'%{query}%',              # Anywhere in name
-                f'{query}%',               # Starting of name
-                f'% {query}%'              # After a space (word start)
-            ]
-            
-            cursor.execute(search_query, search_patterns)
+            cursor.execute(SEARCH_QUERY, search_patterns(query))
             matches = [row[0] for row in cursor.fetchall()]
 
-        connection.close()
-        
-        # Sort matches to ensure consistent order
-        matches = sorted(list(set(matches)))[:5]
+        index = get_player_index(connection)
+        release_db_connection(connection)
         
-        return jsonify({'players': matches})
+        return jsonify(search_payload(matches, index))
         
     except Exception as e:
         print(f"Error in search: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/player/<player_name>', methods=['GET'])
-def get_player_info(player_name):
+# Advanced search query with multiple match strategies
+SEARCH_QUERY = """
+SELECT DISTINCT player
+FROM players_info
+WHERE 
+    LOWER(player) LIKE %s OR  -- Partial name match
+    LOWER(player) LIKE %s OR  -- First word match
+    LOWER(player) LIKE %s     -- Last word match
+LIMIT 5
+"""
+
+def search_patterns(query):
+    # Different search pattern variations
+    return [
+        f'%{query}%',              # Anywhere in name
+        f'{query}%',               # Starting of name
+        f'% {query}%'              # After a space (word start)
+    ]
+
+def search_payload(matches, index):
+    # Sort matches to ensure consistent order
+    matches = sorted(list(set(matches)))[:5]
+    return {
+        'players': matches,
+        'results': [
+            {'id': index.id_of(player_id), 'name': name}
+            for name in matches
+            for player_id in index.matches(name)
+        ]
+    }
+
+@app.route('/api/player/<player_id>', methods=['GET'])
+def get_player_info(player_id):
     """
     Fetch player information from the database for the PlayerProfile component.
     """
@@ -93,39 +206,75 @@ def get_player_info(player_name):
         if not connection:
             return jsonify({"error": "Failed to connect to the database"}), 500
 
-        # Query to fetch player details
-        query = """
-        SELECT 
-            p.player AS name,
-            p.nation_ AS nationality,
-            p.team,
-            p.pos_ AS position,
-            p.age_ AS age,
-            p.value AS value,
-            pt.matches_played AS matches_played
-        FROM players_info p
-        LEFT JOIN playing_time_stats pt ON p.player_id = pt.player_id
-        WHERE p.player ILIKE %s
-        """
+        # Resolve once, then look the player up by primary key
+        key = resolve_player_id(connection, player_id)
+        if key is None:
+            release_db_connection(connection)
+            return jsonify({"error": "Player not found"}), 404
 
         # Execute the query
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (player_name,))
+            cursor.execute(PLAYER_INFO_QUERY, (key,))
             result = cursor.fetchone()  # Fetch a single result
+        player_slug = get_player_index(connection).id_of(key)
 
         # Close the connection
-        connection.close()
+        release_db_connection(connection)
 
         if not result:
             return jsonify({"error": "Player not found"}), 404
 
         # Return the player's data as JSON
-        return jsonify(result)
+        return jsonify({'id': player_slug, **result})
 
     except Exception as e:
         print(f"Error fetching player info: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Query to fetch player details
+PLAYER_INFO_QUERY = """
+SELECT 
+    p.player AS name,
+    p.nation_ AS nationality,
+    p.team,
+    p.pos_ AS position,
+    p.age_ AS age,
+    p.value AS value,
+    pt.matches_played AS matches_played
+FROM players_info p
+LEFT JOIN playing_time_stats pt ON p.player_id = pt.player_id
+WHERE p.player_id = %s
+"""
+
+PLAYER_NAME_QUERY = "SELECT player FROM players_info WHERE player_id = %s"
+
+
+@app.route('/api/player-image/<player_id>', methods=['GET'])
+def get_player_image(player_id):
+    """
+    Cached, resized player image (?size=small|medium|large) with an ETag.
+    """
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
+
+        player_name = player_id
+        key = resolve_player_id(connection, player_id)
+        if key is not None:
+            with connection.cursor() as cursor:
+                cursor.execute(PLAYER_NAME_QUERY, (key,))
+                result = cursor.fetchone()
+            if result:
+                player_name = result[0]
+        release_db_connection(connection)
+
+        return player_image_response(app, player_name)
+
+    except Exception as e:
+        print(f"Error fetching player image: {e}")
+        return jsonify({"error": str(e)}), 500
+
 
 def normalize_value(value, min_val, max_val):
     """
@@ -161,8 +310,22 @@ def convert_value_to_millions(value_str):
         return 0.0
 
 
-@app.route('/api/radar/<player_name>', methods=['GET'])
-def get_radar_data(player_name):
+DEFAULT_RADAR_METRICS = {
+    'Shot Creating Actions': 'sca',
+    'Key Passes': 'key_passes',
+    'Prog. Carries': 'progressive_carries',
+    'Prog. Passes': 'progressive_passes',
+    'xAG': 'xag',
+    'npxG': 'npxg',
+    'Tackles+Interceptions': 'tackles_interceptions',
+    'Take-ons Succ.': 'dribbles_completed_pct',
+    'Recoveries': 'passes_received'
+}
+
+@app.route('/api/radar/<player_id>', methods=['GET'])
+@warmable
+@coalesce
+def get_radar_data(player_id):
     """
     Fetch radar chart data for a player based on metrics from the unified dataset.
     """
@@ -178,17 +341,7 @@ def get_radar_data(player_name):
             metrics = json.loads(metrics_param)  # Expected: { "display_name": "column_name" }
         else:
             # Default metrics (from all available columns)
-            metrics = {
-                'Shot Creating Actions': 'sca',
-                'Key Passes': 'key_passes',
-                'Prog. Carries': 'progressive_carries',
-                'Prog. Passes': 'progressive_passes',
-                'xAG': 'xag',
-                'npxG': 'npxg',
-                'Tackles+Interceptions': 'tackles_interceptions',
-                'Take-ons Succ.': 'dribbles_completed_pct',
-                'Recoveries': 'passes_received'
-            }
+            metrics = DEFAULT_RADAR_METRICS
 
         # Build query for the unified dataset
         query = """
@@ -209,7 +362,7 @@ def get_radar_data(player_name):
         LEFT JOIN playing_time_stats ON players_info.player_id = playing_time_stats.player_id
         LEFT JOIN possession_stats ON players_info.player_id = possession_stats.player_id
         LEFT JOIN shooting_stats ON players_info.player_id = shooting_stats.player_id
-        WHERE players_info.player ILIKE %s
+        WHERE players_info.player_id = %s
         """
 
         league_query = """
@@ -229,21 +382,28 @@ def get_radar_data(player_name):
         LEFT JOIN playing_time_stats ON players_info.player_id = playing_time_stats.player_id
         LEFT JOIN possession_stats ON players_info.player_id = possession_stats.player_id
         LEFT JOIN shooting_stats ON players_info.player_id = shooting_stats.player_id
+        WHERE {scope}
         """
+        scope, scope_params = partition_scope(request.args)
+
+        key = resolve_player_id(connection, player_id)
+        if key is None:
+            release_db_connection(connection)
+            return jsonify({"error": "Player not found"}), 404
 
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
             # Fetch player data
-            cursor.execute(query, (player_name,))
+            cursor.execute(query, (key,))
             player_data = cursor.fetchone()
             if not player_data:
                 return jsonify({"error": "Player not found"}), 404
 
             # Fetch league data
-            cursor.execute(league_query)
+            cursor.execute(league_query.format(scope=scope), scope_params)
             league_data = cursor.fetchall()
 
         # Close the connection
-        connection.close()
+        release_db_connection(connection)
 
         # Prepare response data
         player_values = {}
@@ -287,10 +447,106 @@ def get_radar_data(player_name):
             'metrics': list(metrics.keys())
         })
 
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         print(f"Error processing radar data: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Stat tables in the order the radar query joins them; for a column present in
+# several tables the last one wins, as in the radar's merged RealDictCursor rows
+RADAR_STAT_TABLES = [
+    'creation_stats', 'defensive_stats', 'passing_stats', 'performance_stats',
+    'playing_time_stats', 'possession_stats', 'shooting_stats'
+]
+_stat_columns = {}
+
+def get_stat_columns(connection):
+    """Column name -> stat table, read once from information_schema"""
+    if not _stat_columns:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT table_name, column_name
+                FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = ANY(%s)
+            """, (RADAR_STAT_TABLES,))
+            columns = {}
+            for table, column in sorted(cursor.fetchall(), key=lambda tc: RADAR_STAT_TABLES.index(tc[0])):
+                columns[column] = table
+        _stat_columns.update(columns)
+    return _stat_columns
+
+@app.route('/api/radar/compare', methods=['GET'])
+@coalesce
+def compare_radar_data():
+    """
+    Radar values of several players against one set of league statistics: the
+    league's min/max/avg come from a single aggregate query instead of every
+    player re-fetching the whole league.
+    """
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
+
+        metrics_param = request.args.get('metrics')
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_RADAR_METRICS
+        player_keys = parse_compare_players(request.args)
+
+        # Columns are checked against the schema before they go into SQL
+        stat_columns = get_stat_columns(connection)
+        unknown = [column for column in metrics.values() if column not in stat_columns]
+        if unknown:
+            release_db_connection(connection)
+            return jsonify({"error": f"Unknown metrics: {', '.join(unknown)}"}), 400
+        columns = [f"{stat_columns[column]}.{column}" for column in metrics.values()]
+
+        keys, not_found = [], []
+        for player_key in player_keys:
+            key = resolve_player_id(connection, player_key)
+            if key is None:
+                not_found.append(player_key)
+            elif key not in keys:
+                keys.append(key)
+        if not keys:
+            release_db_connection(connection)
+            return jsonify({"error": "Player not found", "not_found": not_found}), 404
+
+        joins = "\n".join(
+            f"LEFT JOIN {table} ON players_info.player_id = {table}.player_id" for table in RADAR_STAT_TABLES
+        )
+        aggregates = ", ".join(f"min({c}), max({c}), avg({c})" for c in columns)
+        scope, scope_params = partition_scope(request.args)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {aggregates} FROM players_info {joins} WHERE {scope}", scope_params)
+            league = [float(v) if v is not None else float('nan') for v in cursor.fetchone()]
+
+            cursor.execute(f"""
+                SELECT players_info.player_id, players_info.player, players_info.team, {", ".join(columns)}
+                FROM players_info {joins}
+                WHERE players_info.player_id = ANY(%s)
+            """, (keys,))
+            rows = {row[0]: row for row in cursor.fetchall()}
+        index = get_player_index(connection)
+        release_db_connection(connection)
+
+        keys = [key for key in keys if key in rows]
+        players = [{'id': index.id_of(key), 'name': rows[key][1], 'team': rows[key][2]} for key in keys]
+        values = [[float(v) if v is not None else float('nan') for v in rows[key][3:]] for key in keys]
+
+        return jsonify(build_compare_payload(
+            players, metrics.keys(), values, league[0::3], league[1::3], league[2::3], not_found
+        ))
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error comparing radar data: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/available-metrics', methods=['GET'])
 def get_available_metrics():
     """
@@ -338,8 +594,10 @@ def get_available_metrics():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/scatter/<player_name>', methods=['GET'])
-def get_scatter_data(player_name):
+@app.route('/api/scatter/<player_id>', methods=['GET'])
+@warmable
+@coalesce
+def get_scatter_data(player_id):
     try:
         connection = get_db_connection()
         if not connection:
@@ -348,6 +606,7 @@ def get_scatter_data(player_name):
         # Get all midfielders with their stats
         query = """
         SELECT 
+            pi.player_id,
             pi.player,
             pi.team,
             cs.sca,                -- SCA
@@ -367,59 +626,32 @@ def get_scatter_data(player_name):
         LEFT JOIN possession_stats poss ON pi.player_id = poss.player_id
         LEFT JOIN performance_stats ps ON pi.player_id = ps.player_id
         LEFT JOIN defensive_stats ds ON pi.player_id = ds.player_id
-        WHERE pi.pos_ LIKE '%MF%'
+        WHERE pi.pos_ LIKE '%%MF%%' AND {scope}
         """
+        scope, scope_params = partition_scope(request.args, 'pi')
 
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query)
+            cursor.execute(query.format(scope=scope), scope_params)
             midfielders_data = cursor.fetchall()
 
-        connection.close()
+        index = get_player_index(connection)
+        selected_key = resolve_player_id(connection, player_id)
+        release_db_connection(connection)
 
         if not midfielders_data:
             return jsonify({"error": "No midfielder data found"}), 404
 
-        # Convert to DataFrame for PCA calculation
-        df = pd.DataFrame(midfielders_data)
-
-        # Define attacking and defensive metrics based on available columns
-        attacking_metrics = [
-            'sca',              # SCA
-            'key_passes',             # Key passes
-            'progressive_carries',     # Progressive carries
-            'progressive_passes',      # Progressive passes
-            'xag',                    # xAG/90
-            'npxg',                   # npxG/90
-            'dribbles_completed_pct'  # Take ons success rate
-        ]
-        
-        defensive_metrics = [
-            'challenge_tackles_pct',           # Tackles percentage
-            'blocks',                # Defensive blocks
-            'interceptions',         # Defensive interceptions
-            'tackles'  
-        ]
-
-        # Function to calculate PCA
-        def calculate_pca(metrics):
-            X = df[metrics].fillna(0)
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            
-            pca = PCA(n_components=1)
-            principal_components = pca.fit_transform(X_scaled)
-            
-            return principal_components.flatten(), pca.explained_variance_ratio_[0]
-
-        # Calculate PCA components
-        attacking_pca, att_variance = calculate_pca(attacking_metrics)
-        defensive_pca, def_variance = calculate_pca(defensive_metrics)
+        # The PCA fits run in a worker process when QUANTIFICO_CPU_WORKERS is set
+        with span('pca_fit'):
+            (attacking_pca, att_variance), (defensive_pca, def_variance) = run_cpu_bound(
+                scatter_components, [dict(row) for row in midfielders_data]
+            )
 
         # Prepare response data
         result = {
-            'players': df['player'].tolist(),
+            'players': [row['player'] for row in midfielders_data],
             'data': [],
-            'selected_player': player_name,
+            'selected_player': player_id,
             'variance_explained': {
                 'attacking': round(att_variance * 100, 2),
                 'defensive': round(def_variance * 100, 2)
@@ -427,16 +659,22 @@ def get_scatter_data(player_name):
         }
 
         # Create the data points
-        for i, player in enumerate(df['player']):
+        for i, row in enumerate(midfielders_data):
+            key = int(row['player_id'])
+            if key == selected_key:
+                result['selected_player'] = row['player']
             result['data'].append({
-                'player': player,
+                'player': row['player'],
+                'id': index.id_of(key),
                 'attacking': float(attacking_pca[i]),
                 'defensive': float(defensive_pca[i]),
-                'team': df.iloc[i]['team']
+                'team': row['team']
             })
 
         return jsonify(result)
 
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         print(f"Error processing scatter plot data: {e}")
         import traceback
@@ -460,8 +698,254 @@ def get_primary_position(pos_str):
         return 'FW'
     return 'NA'
 
-@app.route('/api/parallel/<player_name>', methods=['GET'])
-def get_parallel_data(player_name):
+DEFAULT_PARALLEL_QUERY_METRICS = {
+    'Position': 'pos_',
+    'Minutes': 'minutes_played',
+    'Age': 'age_',
+    'Value': 'value',
+    'Goals': 'goals',
+    'Assists': 'assists',
+    'SCA': 'sca',
+    'Key Passes': 'key_passes',
+    'Tackles + Int': 'tackles_interceptions',
+    'Prog Carries': 'progressive_carries',
+    'Prog Passes': 'progressive_passes'
+}
+
+# players_info columns usable in ranges and sampled rows
+PLAYER_INFO_RANGE_COLUMNS = ['age_', 'born_']
+PLAYER_INFO_COLUMNS = PLAYER_INFO_RANGE_COLUMNS + ['pos_', 'value', 'team', 'nation_', 'league', 'season']
+
+PRIMARY_POSITION_SQL = """
+CASE
+    WHEN upper(split_part(split_part(players_info.pos_, ',', 1), '/', 1)) LIKE '%%GK%%' THEN 'GK'
+    WHEN upper(split_part(split_part(players_info.pos_, ',', 1), '/', 1)) LIKE '%%DF%%' THEN 'DF'
+    WHEN upper(split_part(split_part(players_info.pos_, ',', 1), '/', 1)) LIKE '%%MF%%' THEN 'MF'
+    WHEN upper(split_part(split_part(players_info.pos_, ',', 1), '/', 1)) LIKE '%%FW%%' THEN 'FW'
+    ELSE 'NA'
+END
+"""
+
+def qualify_column(connection, column, player_info_columns):
+    """table.column for a whitelisted column name; ValueError otherwise"""
+    if column in player_info_columns:
+        return f"players_info.{column}"
+    table = get_stat_columns(connection).get(column)
+    if table is None:
+        raise ValueError(f"Unknown column: {column}")
+    return f"{table}.{column}"
+
+def partition_labels(args):
+    """
+    players_info (league, season) pairs of the league/season query parameters,
+    resolved through the manifest like the Excel backend's partitions ('all'
+    and comma-separated lists included); a partition's league_name is its
+    league label in the data. None without either parameter (every row in the
+    database); UnknownPartition if the manifest has no such partition.
+    """
+    league, season = args.get('league'), args.get('season')
+    if not league and not season:
+        return None
+    store = get_partition_store()
+    return [(store.info(key).get('league_name', key[0]), key[1]) for key in store.select(league, season)]
+
+def partition_scope(args, table='players_info'):
+    """(SQL condition, parameters) restricting players_info rows (aliased table) to partition_labels(args)"""
+    labels = partition_labels(args)
+    if labels is None:
+        return "TRUE", []
+    condition = " OR ".join(f"({table}.league = %s AND {table}.season = %s)" for _ in labels)
+    return f"({condition})", [value for pair in labels for value in pair]
+
+def filter_query(connection, ranges, categories, columns=(), scope=("TRUE", [])):
+    """
+    (SQL, parameters, market value range) selecting (player_id, value, *columns)
+    of the players matching parse_filter_args() ranges and categories, by
+    player_id. Predicates become one parameterized WHERE clause, so PostgreSQL
+    combines them (with bitmap index scans where indexes exist) instead of
+    Python. Market value is stored as text ('€12.50m'), so its range is left
+    to in_value_range(). scope is a partition_scope().
+    """
+    ranges = dict(ranges)
+    value_range = ranges.pop('Value', None)
+
+    conditions, params = [scope[0]], list(scope[1])
+    for column, (low, high) in ranges.items():
+        qualified = qualify_column(connection, column, PLAYER_INFO_RANGE_COLUMNS)
+        if low is not None:
+            conditions.append(f"{qualified} >= %s")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{qualified} <= %s")
+            params.append(high)
+    for column, labels in categories.items():
+        target = PRIMARY_POSITION_SQL if column == 'position' else f"players_info.{column}"
+        conditions.append(f"{target} = ANY(%s)")
+        params.append(labels)
+
+    joins = "\n".join(
+        f"LEFT JOIN {table} ON players_info.player_id = {table}.player_id" for table in RADAR_STAT_TABLES
+    )
+    where = f"WHERE {' AND '.join(conditions)}"
+    selected = ", ".join(["players_info.player_id", "players_info.value", *columns])
+    query = f"""
+        SELECT {selected}
+        FROM players_info {joins}
+        {where}
+        ORDER BY players_info.player_id
+    """
+    return query, params, value_range
+
+def in_value_range(value, value_range):
+    """Whether a players_info.value label lies in a (low, high) range of millions"""
+    if value_range is None:
+        return True
+    low, high = value_range
+    millions = convert_value_to_millions(value)
+    return (low is None or millions >= low) and (high is None or millions <= high)
+
+def filter_players(connection, ranges, categories, columns=(), scope=("TRUE", [])):
+    """(player_id, value, *columns) of the players matching ranges and categories (see filter_query)"""
+    query, params, value_range = filter_query(connection, ranges, categories, columns, scope)
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        matches = cursor.fetchall()
+    return [row for row in matches if in_value_range(row[1], value_range)]
+
+
+@app.route('/api/parallel/query', methods=['GET'])
+def query_parallel_data():
+    """
+    League-wide brushing: players matching range predicates (?ranges={"column": [low, high]})
+    and team/nation/position filters, with an evenly spaced sample of their rows
+    """
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
+
+        metrics_param = request.args.get('metrics')
+        metrics = json.loads(metrics_param) if metrics_param else DEFAULT_PARALLEL_QUERY_METRICS
+        ranges, categories = parse_filter_args(request.args)
+        sample_size = parse_sample_size(request.args)
+
+        joins = "\n".join(
+            f"LEFT JOIN {table} ON players_info.player_id = {table}.player_id" for table in RADAR_STAT_TABLES
+        )
+        metric_columns = [qualify_column(connection, column, PLAYER_INFO_COLUMNS) for column in metrics.values()]
+        scope = partition_scope(request.args)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM players_info WHERE {scope[0]}", scope[1])
+            total = cursor.fetchone()[0]
+        matches = filter_players(connection, ranges, categories, scope=scope)
+        keys = [key for key, *_ in matches]
+        sample = [int(key) for key in sample_rows(keys, sample_size)]
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT players_info.player_id, players_info.player, {", ".join(metric_columns)}
+                FROM players_info {joins}
+                WHERE players_info.player_id = ANY(%s)
+                ORDER BY players_info.player_id
+            """, (sample,))
+            sample_data = cursor.fetchall()
+        index = get_player_index(connection)
+        release_db_connection(connection)
+
+        data = []
+        for key, player, *values in sample_data:
+            row_values = {}
+            for metric_name, value in zip(metrics.keys(), values):
+                if metric_name == 'Position':
+                    value = get_primary_position(value)
+                elif metric_name == 'Value':
+                    value = convert_value_to_millions(value)
+                row_values[metric_name] = value
+            data.append({'player': player, 'id': index.id_of(key), 'values': row_values})
+
+        return jsonify({
+            'total': total,
+            'matched': len(keys),
+            'ids': [index.id_of(key) for key in keys],
+            'sampled': len(sample) < len(keys),
+            'metrics': list(metrics.keys()),
+            'data': data,
+            'domains': {
+                'Position': ['GK', 'DF', 'MF', 'FW']
+            }
+        })
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error querying parallel data: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_players():
+    """
+    Every player matching the /api/parallel/query filters, with the selected
+    metrics, streamed as CSV or Parquet (?format=) from a server-side cursor
+    """
+    try:
+        metrics = parse_export_metrics(request.args, DEFAULT_PARALLEL_QUERY_METRICS)
+        ranges, categories = parse_filter_args(request.args)
+        export_format = parse_export_args(request.args)
+        scope = partition_scope(request.args)
+
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
+
+        metric_columns = [qualify_column(connection, column, PLAYER_INFO_COLUMNS) for column in metrics.values()]
+        query, params, value_range = filter_query(
+            connection, ranges, categories, ["players_info.player", *metric_columns], scope)
+        index = get_player_index(connection)
+
+        # A named cursor keeps the result on the server; each fetchmany() is one chunk
+        cursor = connection.cursor(name='export')
+        cursor.execute(query, params)
+        first = cursor.fetchmany(EXPORT_CONFIG['chunk_rows'])
+        columns = [('id', 'string'), ('player', 'string')] + [
+            (name, 'float' if name == 'Value' or (name != 'Position' and column.type_code == psycopg2.NUMBER)
+             else 'string')
+            for name, column in zip(metrics, cursor.description[3:])
+        ]
+
+        def chunks(rows):
+            while rows:
+                rows = [row for row in rows if in_value_range(row[1], value_range)]
+                if rows:
+                    keys, _, players, *values = zip(*rows)
+                    chunk = [[index.id_of(key) for key in keys], players]
+                    for name, column in zip(metrics, values):
+                        if name == 'Position':
+                            column = [get_primary_position(value) for value in column]
+                        elif name == 'Value':
+                            column = [convert_value_to_millions(value) for value in column]
+                        chunk.append(column)
+                    yield chunk
+                rows = cursor.fetchmany(EXPORT_CONFIG['chunk_rows'])
+
+        # The connection outlives the view; returning it rolls back the transaction, closing the cursor
+        db_pool.detach(connection)
+        return export_response(export_format, columns, chunks(first),
+                               on_close=lambda: release_db_connection(connection))
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error exporting players: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/parallel/<player_id>', methods=['GET'])
+@warmable
+def get_parallel_data(player_id):
     try:
         connection = get_db_connection()
         if not connection:
@@ -487,19 +971,24 @@ def get_parallel_data(player_name):
                 'Prog Passes': 'pass.progressive_passes'
             }
 
-        # First get the player's team
+        key = resolve_player_id(connection, player_id)
+        if key is None:
+            release_db_connection(connection)
+            return jsonify({"error": "Player not found"}), 404
+
+        # First get the player's team (and its league season, as a team plays in several)
         with connection.cursor() as cursor:
             cursor.execute("""
-                SELECT team 
+                SELECT team, league, season
                 FROM players_info 
-                WHERE player ILIKE %s
-            """, (player_name,))
+                WHERE player_id = %s
+            """, (key,))
             
             result = cursor.fetchone()
             if not result:
                 return jsonify({"error": "Player not found"}), 404
             
-            player_team = result[0]
+            player_team = result
 
         # Build SELECT clause with properly quoted column aliases
         metric_columns = []
@@ -507,7 +996,7 @@ def get_parallel_data(player_name):
             # Properly quote both the alias and the column reference
             metric_columns.append(f'{column_path} as "{display_name}"')
         
-        select_clause = ', '.join(['pi.player'] + metric_columns)
+        select_clause = ', '.join(['pi.player', 'pi.player_id AS "__player_id"'] + metric_columns)
 
         # Construct the main query
         query = f"""
@@ -519,14 +1008,15 @@ def get_parallel_data(player_name):
             LEFT JOIN passing_stats pass ON pi.player_id = pass.player_id
             LEFT JOIN defensive_stats ds ON pi.player_id = ds.player_id
             LEFT JOIN possession_stats poss ON pi.player_id = poss.player_id
-            WHERE pi.team = %s
+            WHERE pi.team = %s AND pi.league IS NOT DISTINCT FROM %s AND pi.season IS NOT DISTINCT FROM %s
         """
 
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (player_team,))
+            cursor.execute(query, player_team)
             team_data = cursor.fetchall()
 
-        connection.close()
+        index = get_player_index(connection)
+        release_db_connection(connection)
 
         if not team_data:
             return jsonify({"error": "No data found"}), 404
@@ -544,6 +1034,7 @@ def get_parallel_data(player_name):
         for row in team_data:
             player_data = {
                 'player': row['player'],
+                'id': index.id_of(row['__player_id']),
                 'values': {}
             }
 
@@ -571,189 +1062,367 @@ def get_parallel_data(player_name):
         print(f"Error processing parallel data: {e}")
         return jsonify({"error": str(e)}), 500
     
-HEATMAP_PARAMS = {
-    'bw_adjust': 0.7,     # ADJUST THIS: Lower (0.5-0.8) for more distinct spots, Higher for more blur
-    'levels': 90,        # ADJUST THIS: Lower (20-50) for more distinct levels, Higher for smoother gradient
-    'thresh': 0.08,       # ADJUST THIS: Higher (0.1-0.2) for less spread, Lower for more spread
-}
+# Season and league the heatmaps are scraped for without league/season parameters,
+# and the team of a player missing from players_info
+HEATMAP_YEAR, HEATMAP_LEAGUE, HEATMAP_TEAM = "23/24", "EPL", "Manchester United"
 
-# Coordinate scaling and positioning
-SCALING = {
-    'x_scale': 1.29,      # ADJUST THIS: Changes horizontal stretch/compression
-    'y_scale': 0.9,       # ADJUST THIS: Changes vertical stretch/compression
-    'x_offset': 0,        # ADJUST THIS: Shifts entire heatmap left (-) or right (+)
-    'y_offset': 0         # ADJUST THIS: Shifts entire heatmap up (+) or down (-)
-}
+def heatmap_season(args):
+    """
+    Sofascore (year, league, FBref -> Sofascore team names) of the
+    league/season query parameters, from the manifest partition's sofascore
+    entry as in app.py; HEATMAP_YEAR and HEATMAP_LEAGUE without them.
+    UnknownPartition if the manifest has no such partition.
+    """
+    store = get_partition_store()
+    if args.get('league') or args.get('season'):
+        sofascore = store.info(store.resolve_key(args.get('league'), args.get('season')))['sofascore']
+        return sofascore['year'], sofascore['league'], sofascore.get('teams', {})
+    key = (HEATMAP_LEAGUE, HEATMAP_YEAR)
+    teams = store.info(key).get('sofascore', {}).get('teams', {}) if key in store.partitions else {}
+    return HEATMAP_YEAR, HEATMAP_LEAGUE, teams
+
+def heatmap_player(row, teams):
+    """(Sofascore player name, team name) of a PLAYER_HEATMAP_QUERY row"""
+    player_name, team = row
+    team = team or HEATMAP_TEAM
+    return player_name, teams.get(team, team)
+
+PLAYER_HEATMAP_QUERY = "SELECT player, team FROM players_info WHERE player_id = %s"
+
+@app.route('/api/heatmap/<player_id>')
+@warmable
+def get_heatmap(player_id):
+    try:
+        year, league, teams = heatmap_season(request.args)
+        player_name, team_name = player_id, HEATMAP_TEAM
+        connection = get_db_connection()
+        if connection:
+            # Sofascore matches on the display name and team, so map ids back to them
+            with connection.cursor() as cursor:
+                key = resolve_player_id(connection, player_id)
+                if key is not None:
+                    cursor.execute(PLAYER_HEATMAP_QUERY, (key,))
+                    player_name, team_name = heatmap_player(cursor.fetchone(), teams)
+            release_db_connection(connection)
+
+        if wants_stream(request.args, request.headers):
+            # One NDJSON line per match so the client can draw as data arrives; the
+            # 'stream' admission slot is held until the season has been sent
+            body, release = streamed(stream_heatmap(year, league, player_name, team_name))
+            response = Response(
+                stream_with_context(body),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            response.call_on_close(release)
+            return response
+
+        payload, job = request_heatmap(
+            year, league, player_name, team_name,
+            result_url=request.full_path.rstrip('?')
+        )
+        if payload is not None:
+            return jsonify(payload)
 
-def create_soccer_field(ax):
-    # White background
-    ax.set_facecolor('white')
-    
-    # Black lines for the pitch
-    line_color = 'black'
-    line_width = 1
-    
-    # Pitch outline and center line
-    plt.plot([0, 0], [0, 90], color=line_color, linewidth=line_width)
-    plt.plot([0, 130], [90, 90], color=line_color, linewidth=line_width)
-    plt.plot([130, 130], [90, 0], color=line_color, linewidth=line_width)
-    plt.plot([130, 0], [0, 0], color=line_color, linewidth=line_width)
-    plt.plot([65, 65], [0, 90], color=line_color, linewidth=line_width)
-
-    # Left penalty area
-    plt.plot([16.5, 16.5], [65, 25], color=line_color, linewidth=line_width)
-    plt.plot([0, 16.5], [65, 65], color=line_color, linewidth=line_width)
-    plt.plot([16.5, 0], [25, 25], color=line_color, linewidth=line_width)
-
-    # Right penalty area
-    plt.plot([130, 113.5], [65, 65], color=line_color, linewidth=line_width)
-    plt.plot([113.5, 113.5], [65, 25], color=line_color, linewidth=line_width)
-    plt.plot([113.5, 130], [25, 25], color=line_color, linewidth=line_width)
-
-    # Left 6-yard box
-    plt.plot([0, 5.5], [54, 54], color=line_color, linewidth=line_width)
-    plt.plot([5.5, 5.5], [54, 36], color=line_color, linewidth=line_width)
-    plt.plot([5.5, 0], [36, 36], color=line_color, linewidth=line_width)
-
-    # Right 6-yard box
-    plt.plot([130, 124.5], [54, 54], color=line_color, linewidth=line_width)
-    plt.plot([124.5, 124.5], [54, 36], color=line_color, linewidth=line_width)
-    plt.plot([124.5, 130], [36, 36], color=line_color, linewidth=line_width)
-
-    # Center circle
-    center_circle = plt.Circle((65, 45), 9.15, color=line_color, fill=False, linewidth=line_width)
-    ax.add_patch(center_circle)
-    
-    # Penalty spots and center spot
-    plt.scatter([11, 65, 119], [45, 45, 45], color=line_color, s=20)
-
-    # Penalty arcs
-    left_arc = Arc((11, 45), height=18.3, width=18.3, angle=0, theta1=310, theta2=50, 
-                   color=line_color, linewidth=line_width)
-    right_arc = Arc((119, 45), height=18.3, width=18.3, angle=0, theta1=130, theta2=230, 
-                    color=line_color, linewidth=line_width)
-    ax.add_patch(left_arc)
-    ax.add_patch(right_arc)
-
-def get_season_heatmap_data(year="2023/2024", league="EPL", player_name="Bruno Fernandes", team_name="Manchester United"):
-    """Collect heatmap data from all matches in a season for a specific player"""
-    ss = Sofascore()
-    
-    # Get all matches from the season
-    print(f"Fetching {league} matches for {year} season...")
-    matches = ss.get_match_dicts(year, league)
-    
-    # Filter for team's matches
-    team_matches = [
-        match for match in matches 
-        if team_name in match['homeTeam']['name'] or team_name in match['awayTeam']['name']
-    ]
-    
-    print(f"Found {len(team_matches)} matches for {team_name}")
-    
-    # Collect coordinates from all matches
-    all_coordinates = []
-    skipped_matches = 0
-    
-    for match in tqdm(team_matches, desc="Processing matches"):
-        try:
-            match_id = match['id']
-            heatmap_data = ss.scrape_heatmaps(match_id)
-            
-            # Find player data
-            player_data = None
-            for player_id, data in heatmap_data.items():
-                if player_name.lower() in player_id.lower():
-                    player_data = data
-                    break
-            
-            if player_data and player_data['heatmap']:
-                all_coordinates.extend(player_data['heatmap'])
-        except Exception as e:
-            print(f"Skipped match {match_id} due to error: {str(e)}")
-            skipped_matches += 1
-    
-    print(f"Processed {len(team_matches) - skipped_matches} matches successfully")
-    print(f"Total coordinates collected: {len(all_coordinates)}")
-    
-    return all_coordinates
+        # Season scrapes take minutes; hand back a job to poll or subscribe to
+        response = jsonify(job.to_dict())
+        response.headers['Location'] = job.to_dict()['status_url']
+        return response, 202
+        
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error processing heatmap data: {e}")
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/heatmap/aggregate')
+def get_aggregate_heatmap():
+    """
+    Season heatmap of a cohort summed from per-player occupancy grids: the
+    players matching team/nation/position/age/ranges filters (as
+    /api/parallel/query) and min_minutes, or ?players=a,b,c. weight=points|
+    equal|minutes, normalize=none|max|sum; scrape=1 queues scrapes for
+    players whose season is not cached yet.
+    """
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
 
-def create_season_heatmap(year="2023/2024", league="EPL", player_name="Bruno Fernandes", team_name="Manchester United"):
-    """Create a heatmap visualization for an entire season"""
-    # Get the combined coordinates
-    coordinates = get_season_heatmap_data(year, league, player_name, team_name)
-    
-    if not coordinates:
-        raise ValueError("No heatmap data found for the specified parameters")
-    
-    # Convert to DataFrame
-    coords_df = pd.DataFrame(coordinates, columns=['x', 'y'])
-    
-    # Apply scaling
-    coords_df['x'] = coords_df['x'] * SCALING['x_scale'] + SCALING['x_offset']
-    coords_df['y'] = coords_df['y'] * SCALING['y_scale'] + SCALING['y_offset']
-    
-    # Create figure
-    plt.figure(figsize=(13, 8))
-    ax = plt.gca()
-    
-    # Create pitch
-    create_soccer_field(ax)
-    
-    # Create heatmap
-    sns.kdeplot(
-        data=coords_df, 
-        x='x', 
-        y='y', 
-        cmap='YlOrRd',
-        fill=True,
-        alpha=1.0,
-        levels=HEATMAP_PARAMS['levels'],
-        bw_adjust=HEATMAP_PARAMS['bw_adjust'],
-        clip=((0, 130), (0, 90)),
-        thresh=HEATMAP_PARAMS['thresh']
-    )
-    
-    # Styling
-    plt.title(f"{player_name} - {year} Season Heatmap", pad=20, color='black')
-    plt.axis('off')
-    
-    # Set figure background to white
-    fig = plt.gcf()
-    fig.patch.set_facecolor('white')
-    
-    return fig
+        players, weight, normalize, scrape = parse_aggregate_args(request.args)
+        year, league, teams = heatmap_season(request.args)
+        minutes_column = "playing_time_stats.minutes_played"
+        not_found = []
+        if players:
+            keys = []
+            for player in players:
+                key = resolve_player_id(connection, player)
+                if key is None:
+                    not_found.append(player)
+                else:
+                    keys.append(key)
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT players_info.player_id, players_info.player, players_info.team, {minutes_column}
+                    FROM players_info
+                    LEFT JOIN playing_time_stats ON players_info.player_id = playing_time_stats.player_id
+                    WHERE players_info.player_id = ANY(%s)
+                    ORDER BY players_info.player_id
+                """, (keys,))
+                rows = cursor.fetchall()
+        else:
+            ranges, categories = parse_filter_args(request.args)
+            if request.args.get('min_minutes'):
+                ranges['minutes_played'] = (float(request.args['min_minutes']), None)
+            rows = [(key, player, team, minutes) for key, _, player, team, minutes
+                    in filter_players(connection, ranges, categories,
+                                      ["players_info.player", "players_info.team", minutes_column],
+                                      partition_scope(request.args))]
+        index = get_player_index(connection)
+        release_db_connection(connection)
+
+        # Grids are scraped per team's matches; Sofascore team names differ from FBref's for a few clubs
+        members = [(index.id_of(key), *heatmap_player((player, team), teams), minutes)
+                   for key, player, team, minutes in rows]
+        payload = aggregate_heatmap(year, league, members, weight, normalize, scrape)
+        payload['not_found'] = not_found
+        return jsonify(payload)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error aggregating heatmap data: {e}")
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/form/<player_id>')
+def get_player_form(player_id):
+    """
+    Rolling form over a player's matches in the per-match store (form.py):
+    ?window=5 (or several, e.g. 5,10), metrics=xG,xA,... and per90=0 for
+    window totals. With scrape=1, a player without recorded matches gets a
+    background job recording their team's season instead (202).
+    """
+    try:
+        year, league, teams = heatmap_season(request.args)
+        player_name, team_name = player_id, HEATMAP_TEAM
+        connection = get_db_connection()
+        if connection:
+            # Sofascore matches on the display name and team, so map ids back to them
+            with connection.cursor() as cursor:
+                key = resolve_player_id(connection, player_id)
+                if key is not None:
+                    cursor.execute(PLAYER_HEATMAP_QUERY, (key,))
+                    player_name, team_name = heatmap_player(cursor.fetchone(), teams)
+            release_db_connection(connection)
+
+        windows, metrics, per90 = parse_form_args(request.args)
+        payload = form_payload(year, league, player_name, windows, metrics, per90)
+        if not payload['matches'] and request.args.get('scrape', '').lower() in ('1', 'true', 'yes'):
+            job = request_form_ingest(year, league, team_name,
+                                      result_url=request.full_path.rstrip('?'))
+            response = jsonify(job.to_dict())
+            response.headers['Location'] = job.to_dict()['status_url']
+            return response, 202
+        return jsonify(payload)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error processing form data: {e}")
+        return jsonify({'error': str(e)}), 500
 
-@app.route('/api/heatmap/<player_name>')
-def get_heatmap(player_name):
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """
+    Top players by one metric (?metric=, optionally per90=1 and order=asc), with
+    position/team/nation/min_minutes filters and keyset cursor pagination:
+    each page resumes after the last (value, player_id) instead of using OFFSET.
+    """
     try:
-        coordinates = get_season_heatmap_data(
-            year="23/24", 
-            league="EPL", 
-            player_name=player_name, 
-            team_name="Manchester United"
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
+
+        query = parse_leaderboard_args(request.args)
+        metric = qualify_column(connection, query['metric'], PLAYER_INFO_RANGE_COLUMNS)
+        if query['per90']:
+            metric = f"{metric}::float / NULLIF(playing_time_stats.minutes_90s, 0)"
+
+        scope, params = partition_scope(request.args)
+        conditions = [f"({metric}) IS NOT NULL", scope]
+        for column, labels in query['categories'].items():
+            target = PRIMARY_POSITION_SQL if column == 'position' else f"players_info.{column}"
+            conditions.append(f"{target} = ANY(%s)")
+            params.append(labels)
+        if query['min_minutes'] is not None:
+            conditions.append("playing_time_stats.minutes_played >= %s")
+            params.append(query['min_minutes'])
+
+        versions = {'postgres': list(table_version(connection)[1:])}
+
+        # A cursor of one league season does not resume another's ranking
+        scoped = ['postgres'] + [f"{league}|{season}" for league, season in partition_labels(request.args) or []]
+        fingerprint = query_fingerprint(query, scoped)
+        rank = 0
+        comparison, direction = ('<', 'DESC') if query['order'] == 'desc' else ('>', 'ASC')
+        cursor_param = request.args.get('cursor')
+        if cursor_param:
+            keyset, rank = decode_cursor(cursor_param, fingerprint, versions)
+            try:
+                last_value, last_key = float(keyset[0]), int(keyset[1])
+            except (IndexError, KeyError, TypeError, ValueError):
+                raise ValueError("Malformed cursor")
+            conditions.append(f"(({metric}), players_info.player_id) {comparison} (%s, %s)")
+            params.extend([last_value, last_key])
+
+        joins = "\n".join(
+            f"LEFT JOIN {table} ON players_info.player_id = {table}.player_id" for table in RADAR_STAT_TABLES
         )
-        scaled_coordinates = [
-            {
-                'x': coord[0] * SCALING['x_scale'] + SCALING['x_offset'],
-                'y': coord[1] * SCALING['y_scale'] + SCALING['y_offset']
-            }
-            for coord in coordinates
-        ]
-        
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT players_info.player_id, players_info.player, players_info.team, players_info.pos_,
+                       players_info.age_, playing_time_stats.minutes_played, ({metric}) AS value
+                FROM players_info {joins}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY value {direction}, players_info.player_id {direction}
+                LIMIT %s
+            """, params + [query['limit']])
+            rows = cursor.fetchall()
+        index = get_player_index(connection)
+        release_db_connection(connection)
+
+        results = []
+        for key, player, team, position, age, minutes, value in rows:
+            rank += 1
+            results.append({
+                'rank': rank,
+                'id': index.id_of(key),
+                'name': player,
+                'team': team,
+                'position': position,
+                'age': age,
+                'minutes': int(minutes) if minutes is not None else None,
+                'value': float(value)
+            })
+
+        next_cursor = None
+        if len(rows) == query['limit']:
+            next_cursor = encode_cursor(fingerprint, [float(rows[-1][-1]), rows[-1][0]], versions, rank)
+
         return jsonify({
-            'coordinates': scaled_coordinates,
-            'pitch_dimensions': {
-                'width': 130,
-                'height': 90
-            }
+            'metric': query['metric'],
+            'per90': query['per90'],
+            'order': query['order'],
+            'results': results,
+            'next_cursor': next_cursor
         })
-        
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
-        print(f"Error processing heatmap data: {e}")
-        return jsonify({'error': str(e)}), 500
+        print(f"Error building leaderboard: {e}")
+        return jsonify({"error": str(e)}), 500
+
+SIMILARITY_QUERY = """
+SELECT
+    pi.player_id, pi.league, pi.season, pi.pos_, pi.age_, pi.value, pt.minutes_played, pt.minutes_90s,
+    {columns}
+FROM players_info pi
+LEFT JOIN playing_time_stats pt ON pi.player_id = pt.player_id
+LEFT JOIN performance_stats ps ON pi.player_id = ps.player_id
+LEFT JOIN shooting_stats ss ON pi.player_id = ss.player_id
+LEFT JOIN creation_stats cs ON pi.player_id = cs.player_id
+LEFT JOIN passing_stats pass ON pi.player_id = pass.player_id
+LEFT JOIN possession_stats poss ON pi.player_id = poss.player_id
+LEFT JOIN defensive_stats ds ON pi.player_id = ds.player_id
+ORDER BY pi.player_id
+""".format(columns=',\n    '.join(column for _, column, _ in SIMILARITY_METRICS.values()))
+
+def load_similarity_index(connection):
+    """
+    SimilarityIndex plus player_id -> row for the current table contents; the
+    row count and highest player_id act as the data version.
+    """
+    version = table_version(connection)
+
+    def build():
+        with connection.cursor() as cursor:
+            cursor.execute(SIMILARITY_QUERY)
+            rows = cursor.fetchall()
+        player_ids = [row[0] for row in rows]
+        index = index_for_rows([row[3:] for row in rows])
+        index.player_ids = player_ids
+        index.partitions = np.array([f"{row[1]}|{row[2]}" for row in rows], dtype=object)
+        index.rows = {player_id: i for i, player_id in enumerate(player_ids)}
+        return index
+
+    return get_similarity_index(version, build)
+
+@app.route('/api/similar/<player_id>', methods=['GET'])
+def get_similar_players(player_id):
+    """
+    Players whose standardized per-90 profile is closest to this player's.
+    """
+    try:
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({"error": "Failed to connect to the database"}), 500
+
+        key = resolve_player_id(connection, player_id)
+        if key is None:
+            release_db_connection(connection)
+            return jsonify({"error": "Player not found"}), 404
+
+        metrics, k, filters = parse_similarity_args(request.args)
+        index = load_similarity_index(connection)
+        player_index = get_player_index(connection)
+        row = index.rows.get(key)
+        if row is None:
+            release_db_connection(connection)
+            return jsonify({"error": "Player not found"}), 404
+
+        candidates = index.candidates(**filters)
+        labels = partition_labels(request.args)
+        if labels is not None:
+            candidates &= np.isin(index.partitions, [f"{league}|{season}" for league, season in labels])
+        with span('similarity_search'):
+            rows, distances = index.nearest(row, metrics, k, candidates)
+        keys = [index.player_ids[row]] + [index.player_ids[r] for r in rows]
+
+        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT player_id, player AS name, team, pos_ AS position, age_ AS age, value
+                FROM players_info
+                WHERE player_id = ANY(%s)
+            """, (keys,))
+            players = {p.pop('player_id'): p for p in cursor.fetchall()}
+        release_db_connection(connection)
+
+        def describe(player_key, r):
+            return {'id': player_index.id_of(player_key), **players.get(player_key, {}),
+                    'minutes': int(index.minutes[r])}
+
+        return jsonify({
+            'player': describe(keys[0], row),
+            'metrics': metrics,
+            'filters': {name: value for name, value in filters.items() if value is not None},
+            'results': [{**describe(player_key, r), 'distance': round(float(d), 4)}
+                        for player_key, r, d in zip(keys[1:], rows, distances)]
+        })
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UnknownPartition as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error finding similar players: {e}")
+        return jsonify({"error": str(e)}), 500
   
 if __name__ == '__main__':
     app.run(debug=True, port=8001)
@@ -0,0 +1,393 @@
+"""
+ASGI serving mode for the PostgreSQL backend.
+
+    uvicorn asgi_postgresql:app --host 0.0.0.0 --port 8001 --workers 4
+
+Serves the same routes as app_postgresql.py with the same responses, on an
+event loop instead of one thread per request:
+
+- search, player info, heatmaps and job status/events are native async
+  routes. Their queries go through an asyncpg connection pool, with the SQL,
+  id resolution and payload building shared with app_postgresql.py.
+- Heatmap scrapes stay in the blocking Sofascore client. A stream therefore
+  steps through stream_heatmap() one match at a time on a dedicated scrape
+  executor, and the event loop is never blocked. Job events wait on the job
+  without holding a thread, so an open dashboard costs no thread while it
+  waits.
+- Every other route is the Flask app itself, run through a WSGI bridge on a
+  bounded thread pool. Scatter PCA fits run in the process_pool.py worker
+  processes, so they do not hold the GIL.
+
+Native routes use the same admission classes and deadlines (admission.py),
+metrics and access log as the Flask routes. asyncpg is only needed for this
+mode.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app_postgresql as backend
+from admission import (ADMISSION_CONFIG, ROUTE_DEADLINES, DeadlineExceeded, Overloaded, bulkheads, route_class,
+                       wants_stream)
+from db import POOL_CONFIG
+from heatmap import request_heatmap, stream_heatmap
+from instrumentation import registry
+from jobs import JOB_CONFIG, job_manager
+from partitions import UnknownPartition
+from player_ids import PlayerIndex
+from process_pool import PROCESS_POOL_CONFIG, get_executor, shutdown as shutdown_process_pool
+from warming import WARM_HEADER
+
+
+ASYNC_CONFIG = {
+    'db_pool_min': int(os.getenv('ASYNC_DB_POOL_MIN', POOL_CONFIG['minconn'])),
+    'db_pool_max': int(os.getenv('ASYNC_DB_POOL_MAX', 20)),
+    'bridge_threads': int(os.getenv('QUANTIFICO_BRIDGE_THREADS', 16)),   # Threads running the Flask routes
+    'scrape_threads': int(os.getenv('QUANTIFICO_SCRAPE_THREADS', 16)),   # Threads stepping Sofascore scrapes
+}
+
+# PCA fits leave the event loop's process unless configured otherwise
+if 'QUANTIFICO_CPU_WORKERS' not in os.environ:
+    PROCESS_POOL_CONFIG['workers'] = 2
+
+# Streams hold a scrape thread only while a match is fetched and wait for a slot without one,
+# so the stream class is sized to the scrape executor rather than to the sync server's threads
+if 'QUANTIFICO_STREAM_CONCURRENCY' not in os.environ:
+    bulkheads['stream'].resize(
+        ASYNC_CONFIG['scrape_threads'],
+        int(os.getenv('QUANTIFICO_STREAM_QUEUE', 4 * ASYNC_CONFIG['scrape_threads'])),
+        float(os.getenv('QUANTIFICO_STREAM_WAIT', 10)),
+    )
+
+_state = {'db': None, 'scrapes': None}
+
+
+def asyncpg_sql(query):
+    """psycopg2 query with %s placeholders -> asyncpg query with $1, $2, ..."""
+    parts = query.split('%s')
+    sql = parts[0]
+    for n, part in enumerate(parts[1:], start=1):
+        sql += f'${n}{part}'
+    return sql.replace('%%', '%')
+
+
+SEARCH_SQL = asyncpg_sql(backend.SEARCH_QUERY)
+PLAYER_INFO_SQL = asyncpg_sql(backend.PLAYER_INFO_QUERY)
+PLAYER_HEATMAP_SQL = asyncpg_sql(backend.PLAYER_HEATMAP_QUERY)
+
+
+def json_response(payload, status=200, headers=None):
+    # Rendered by Flask's JSON provider, so bodies are byte-identical to jsonify()
+    return Response(backend.app.json.response(payload).get_data(), status_code=status, headers=headers,
+                    media_type='application/json')
+
+
+def query_timeout(request):
+    """Seconds a query may take before the request's deadline, None without one"""
+    deadline = request.state.deadline
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded before the query ran")
+    return left
+
+
+async def player_index(connection):
+    """The PlayerIndex shared with the Flask routes, reloaded through asyncpg when stale"""
+    index = backend.cached_player_index()
+    if index is None:
+        rows = await connection.fetch(backend.PLAYER_INDEX_QUERY)
+        index = PlayerIndex([tuple(row) for row in rows])
+        backend.set_player_index(index)
+    return index
+
+
+def _record(rule, status, started):
+    elapsed = time.perf_counter() - started
+    registry.observe('quantifico_request_duration_seconds', elapsed, route=rule, method='GET')
+    registry.inc('quantifico_requests_total', route=rule, method='GET', status=status)
+
+
+async def _release_after(body, pool, admitted_at, rule):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        if pool is not None:
+            pool.release(admitted_at)
+        registry.add_gauge('quantifico_requests_in_flight', -1, route=rule)
+
+
+def native(endpoint, rule):
+    """
+    Wrap an async handler with what the Flask hooks do for the sync routes:
+    admission and deadlines, request metrics and error responses.
+    """
+    def decorate(handler):
+        async def route(request):
+            started = time.perf_counter()
+            pool_name = route_class(endpoint, request.query_params, request.headers)
+            pool = bulkheads[pool_name] if pool_name and ADMISSION_CONFIG['enabled'] else None
+            admitted_at, deadline_seconds = None, None
+            request.state.deadline = None
+            if pool is not None:
+                try:
+                    admitted_at = await pool.acquire_async()
+                except Overloaded as e:
+                    registry.inc('quantifico_admission_rejected_total', pool=pool.name, reason=e.reason)
+                    _record(rule, 503, started)
+                    return json_response({'error': str(e)}, 503, {'Retry-After': str(pool.retry_after())})
+                deadline_seconds = ROUTE_DEADLINES.get(endpoint, pool.deadline)
+                request.state.deadline = admitted_at + deadline_seconds
+
+            registry.add_gauge('quantifico_requests_in_flight', 1, route=rule)
+            streaming = False
+            try:
+                response = await handler(request)
+                streaming = isinstance(response, StreamingResponse)
+                if streaming:
+                    # The slot is held until the stream ends, as with stream_with_context
+                    response.body_iterator = _release_after(response.body_iterator, pool, admitted_at, rule)
+            except (asyncio.TimeoutError, DeadlineExceeded) as e:
+                if request.state.deadline is not None and time.monotonic() >= request.state.deadline - 0.001:
+                    registry.inc('quantifico_deadline_exceeded_total', route=rule)
+                    response = json_response({'error': f"Deadline of {deadline_seconds:g}s exceeded"}, 504)
+                else:
+                    print(f"Error in {endpoint}: {e}")
+                    response = json_response({'error': str(e)}, 500)
+            except Exception as e:
+                print(f"Error in {endpoint}: {e}")
+                response = json_response({'error': str(e)}, 500)
+            finally:
+                if not streaming:
+                    if pool is not None:
+                        pool.release(admitted_at)
+                    registry.add_gauge('quantifico_requests_in_flight', -1, route=rule)
+            _record(rule, response.status_code, started)
+            return response
+
+        route.__name__ = endpoint
+        return route
+    return decorate
+
+
+def _record_warm(request, endpoint, rule, status, result):
+    # What warming.warmable and its after_request hook record for the Flask route
+    if request.headers.get(WARM_HEADER):
+        return
+    registry.inc('quantifico_warm_requests_total', route=rule, result=result)
+    warmer = backend.app.extensions.get('warmer')
+    if warmer is not None and status in (200, 202):
+        path = request.url.path + (f'?{request.url.query}' if request.url.query else '')
+        warmer.access_log.record(endpoint, path, request.path_params.get('player_id'))
+
+
+@native('search_players', '/api/search')
+async def search_players(request):
+    query = request.query_params.get('q', '').lower()
+    if not query:
+        return json_response({'players': []})
+
+    async with _state['db'].acquire() as connection:
+        rows = await connection.fetch(SEARCH_SQL, *backend.search_patterns(query),
+                                      timeout=query_timeout(request))
+        index = await player_index(connection)
+    return json_response(backend.search_payload([row[0] for row in rows], index))
+
+
+@native('get_player_info', '/api/player/<player_id>')
+async def get_player_info(request):
+    async with _state['db'].acquire() as connection:
+        index = await player_index(connection)
+        key = backend.resolve_in_index(index, request.path_params['player_id'])
+        if key is None:
+            return json_response({"error": "Player not found"}, 404)
+        result = await connection.fetchrow(PLAYER_INFO_SQL, key, timeout=query_timeout(request))
+
+    if not result:
+        return json_response({"error": "Player not found"}, 404)
+    return json_response({'id': index.id_of(key), **dict(result)})
+
+
+async def _stream_lines(lines, request):
+    """Step a blocking generator on the scrape executor, one item per hop"""
+    loop = asyncio.get_running_loop()
+    lock = threading.Lock()   # next() and close() must not overlap
+    done = object()
+
+    def step():
+        with lock:
+            return next(lines, done)
+
+    def close():
+        with lock:
+            lines.close()
+
+    try:
+        while True:
+            deadline = request.state.deadline
+            if deadline is not None and time.monotonic() >= deadline:
+                # What stream_heatmap() emits when check_deadline() stops it
+                seconds = ROUTE_DEADLINES.get('get_heatmap', bulkheads['stream'].deadline)
+                yield json.dumps({'type': 'error', 'error': f"Deadline of {seconds:g}s exceeded"},
+                                 separators=(',', ':')) + '\n'
+                return
+            line = await loop.run_in_executor(_state['scrapes'], step)
+            if line is done:
+                return
+            yield line
+    finally:
+        # Stops the scrape when the client goes away; not awaited, as the task may be cancelled
+        _state['scrapes'].submit(close)
+
+
+@native('get_heatmap', '/api/heatmap/<player_id>')
+async def get_heatmap(request):
+    player_id = request.path_params['player_id']
+    try:
+        year, league, teams = backend.heatmap_season(request.query_params)
+    except UnknownPartition as e:
+        return json_response({'error': str(e)}, 404)
+    player_name, team_name = player_id, backend.HEATMAP_TEAM
+    async with _state['db'].acquire() as connection:
+        # Sofascore matches on the display name and team, so map ids back to them
+        key = backend.resolve_in_index(await player_index(connection), player_id)
+        if key is not None:
+            row = await connection.fetchrow(PLAYER_HEATMAP_SQL, key, timeout=query_timeout(request))
+            player_name, team_name = backend.heatmap_player(tuple(row), teams)
+
+    if wants_stream(request.query_params, request.headers):
+        lines = stream_heatmap(year, league, player_name, team_name)
+        return StreamingResponse(
+            _stream_lines(lines, request),
+            media_type='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    path = request.url.path + (f'?{request.url.query}' if request.url.query else '')
+    payload, job = request_heatmap(year, league, player_name, team_name, result_url=path)
+    if payload is not None:
+        _record_warm(request, 'get_heatmap', '/api/heatmap/<player_id>', 200, 'warm')
+        return json_response(payload)
+
+    # Season scrapes take minutes; hand back a job to poll or subscribe to
+    _record_warm(request, 'get_heatmap', '/api/heatmap/<player_id>', 202, 'cold')
+    return json_response(job.to_dict(), 202, {'Location': job.to_dict()['status_url']})
+
+
+@native('jobs.get_job', '/api/jobs/<job_id>')
+async def get_job(request):
+    job = job_manager.get(request.path_params['job_id'])
+    if job is None:
+        return json_response({'error': 'Job not found'}, 404)
+    return json_response(job.to_dict())
+
+
+@native('jobs.stream_job_events', '/api/jobs/<job_id>/events')
+async def stream_job_events(request):
+    job = job_manager.get(request.path_params['job_id'])
+    if job is None:
+        return json_response({'error': 'Job not found'}, 404)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(changed.set)
+
+        job.subscribe(notify)
+        try:
+            revision = -1
+            while True:
+                changed.clear()
+                if job.revision == revision:
+                    try:
+                        await asyncio.wait_for(changed.wait(), JOB_CONFIG['keepalive'])
+                    except asyncio.TimeoutError:
+                        yield ': keep-alive\n\n'
+                        continue
+                revision = job.revision
+                event = job.status if job.finished else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+        finally:
+            job.unsubscribe(notify)
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def wsgi_bridge(wsgi_app):
+    """The Flask app as an ASGI app, each request on a bridge thread"""
+    try:
+        from a2wsgi import WSGIMiddleware
+        return WSGIMiddleware(wsgi_app, workers=ASYNC_CONFIG['bridge_threads'])
+    except ImportError:
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            from starlette.middleware.wsgi import WSGIMiddleware
+        return WSGIMiddleware(wsgi_app)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    import anyio.to_thread
+    import asyncpg
+
+    config = backend.DB_CONFIG
+    _state['db'] = await asyncpg.create_pool(
+        host=config['host'], database=config['database'], user=config['user'],
+        password=config['password'], port=config['port'],
+        min_size=ASYNC_CONFIG['db_pool_min'], max_size=ASYNC_CONFIG['db_pool_max'],
+    )
+    _state['scrapes'] = ThreadPoolExecutor(ASYNC_CONFIG['scrape_threads'], thread_name_prefix='quantifico-scrape')
+    # Bounds starlette's WSGI bridge threads (a2wsgi has its own pool)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASYNC_CONFIG['bridge_threads']
+    executor = get_executor()
+    if executor is not None:
+        # Start the PCA workers now rather than on the first scatter request
+        for _ in range(PROCESS_POOL_CONFIG['workers']):
+            executor.submit(os.getpid)
+    try:
+        yield
+    finally:
+        await _state['db'].close()
+        _state['scrapes'].shutdown(wait=False, cancel_futures=True)
+        shutdown_process_pool()
+
+
+flask_app = wsgi_bridge(backend.app)
+
+app = Starlette(
+    routes=[
+        Route('/api/search', search_players),
+        Route('/api/player/{player_id}', get_player_info),
+        # Flask route that the native heatmap route would otherwise shadow
+        Route('/api/heatmap/aggregate', flask_app),
+        Route('/api/heatmap/{player_id}', get_heatmap),
+        Route('/api/jobs/{job_id}', get_job),
+        Route('/api/jobs/{job_id}/events', stream_job_events),
+        Mount('/', app=flask_app),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='127.0.0.1', port=8001)
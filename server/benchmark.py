@@ -0,0 +1,554 @@
+"""
+Benchmark suite for every API route on both backends.
+
+    python benchmark.py run [--backend app] [--backend app_postgresql] [--output run.json]
+    python benchmark.py compare baseline.json run.json [--threshold 0.1]
+    python benchmark.py sessions [--backend app_postgresql] [--backend asgi_postgresql]
+
+`run` starts each backend in its own process on a free port, against the
+local fixtures: the partition files listed in data/manifest.json (shared
+memory goes to a temporary directory) and, for app_postgresql, the database
+configured through the usual DB_* variables. Sofascore is replaced by a
+deterministic fake inside the server process, so heatmaps exercise the real
+scrape, cache and streaming code without network access. For every route it
+records the cold first request, p50/p95/p99 latency over sequential
+requests and throughput with concurrent clients, plus the server's peak RSS,
+and writes everything as JSON.
+
+`compare` flags routes whose p95 latency or throughput regressed by more than
+the threshold between two runs (and peak RSS growth), exiting 1 if any did.
+
+`sessions` simulates whole dashboard sessions (typing a search, opening the
+player, radar, parallel and scatter panels and streaming the season heatmap)
+from many concurrent clients, with the heatmap caches disabled so every session
+really scrapes. Synchronous backends run under gunicorn with a bounded
+number of threads (--threads), the way they are deployed; ASGI backends run
+under uvicorn. It reports sessions per second, session latency, errors and
+the server's CPU time (all of its processes), so backends can be compared on
+sessions per CPU second.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARK_CONFIG = {
+    'player': 'Bruno Fernandes',
+    'requests': 200,        # Sequential requests per route for the latency percentiles
+    'warmup': 5,            # Requests per route before measuring
+    'concurrency': 8,       # Client threads for the throughput phase
+    'duration': 5.0,        # Seconds of the throughput phase per route
+    'startup_timeout': 60,
+    'fake_latency': float(os.getenv('QUANTIFICO_FAKE_SOFASCORE_LATENCY', 0.005)),   # Seconds per fake scrape
+    'fake_matches': 38,
+    'sessions': 32,         # Concurrent dashboard sessions for `sessions`
+    'session_duration': 20.0,
+    'session_threads': 8,   # Server threads of a synchronous backend for `sessions`
+    'session_latency': 0.05,   # Seconds per fake scrape for `sessions`
+}
+
+# Backends that serve another backend's schema
+SCHEMA_BACKEND = {'asgi_postgresql': 'app_postgresql'}
+
+# Custom radar metrics use each backend's own column names
+RADAR_METRICS = {
+    'app': {'xAG': 'Expected_xAG', 'npxG': 'Expected_npxG', 'Key Passes': 'passing_KP_'},
+    'app_postgresql': {'xAG': 'xag', 'npxG': 'npxg', 'Key Passes': 'key_passes'},
+}
+
+BRUSH_COLUMN = {'app': 'Playing Time_Min', 'app_postgresql': 'minutes_played'}
+LEADERBOARD_METRIC = {'app': 'possession_Carries_PrgC', 'app_postgresql': 'progressive_carries'}
+
+# Extra players for the ten-player radar comparison
+COMPARE_PLAYERS = [urllib.parse.quote(name) for name in (
+    'Declan Rice', 'Rodri', 'Martin Ødegaard', 'Kevin De Bruyne', 'James Maddison',
+    'Dominik Szoboszlai', 'Bruno Guimarães', 'Moisés Caicedo', 'Enzo Fernández'
+)]
+
+
+def benchmark_routes(player, backend):
+    backend = SCHEMA_BACKEND.get(backend, backend)
+    quoted = urllib.parse.quote(player)
+    return {
+        'search': '/api/search?q=' + urllib.parse.quote(player.split()[0][:3].lower()),
+        'player': f'/api/player/{quoted}',
+        'radar': f'/api/radar/{quoted}',
+        'radar_custom_metrics': f'/api/radar/{quoted}?metrics=' + urllib.parse.quote(json.dumps(RADAR_METRICS[backend])),
+        'radar_compare': '/api/radar/compare?players=' + ','.join([quoted] + COMPARE_PLAYERS),
+        'parallel': f'/api/parallel/{quoted}',
+        'parallel_query': '/api/parallel/query?position=MF,FW&min_age=20&max_age=27&sample=100&ranges='
+                          + urllib.parse.quote(json.dumps({BRUSH_COLUMN[backend]: [900, None], 'Value': [10, None]})),
+        'leaderboard': f'/api/leaderboard?metric={LEADERBOARD_METRIC[backend]}&per90=1&position=MF&min_minutes=900',
+        'scatter': f'/api/scatter/{quoted}',
+        'similar': f'/api/similar/{quoted}',
+        'similar_filtered': f'/api/similar/{quoted}?position=FW,MF&max_age=25&metrics=npxG,xAG,Key%20Passes',
+        'heatmap_stream': f'/api/heatmap/{quoted}?stream=1',
+        'form': f'/api/form/{quoted}?window=5,10',
+        'available_metrics': '/api/available-metrics',
+    }
+
+
+class FakeSofascore:
+    """Deterministic stand-in for ScraperFC.Sofascore"""
+
+    TEAMS = ['Manchester United', 'Arsenal', 'Liverpool', 'Chelsea', 'Newcastle United',
+             'Tottenham', 'Aston Villa', 'Brighton', 'West Ham', 'Everton']
+
+    def get_match_dicts(self, year, league):
+        time.sleep(BENCHMARK_CONFIG['fake_latency'])
+        matches = []
+        for i in range(BENCHMARK_CONFIG['fake_matches'] * len(self.TEAMS) // 2):
+            home = self.TEAMS[i % len(self.TEAMS)]
+            away = self.TEAMS[(i * 7 + 3) % len(self.TEAMS)]
+            matches.append({'id': 1000 + i, 'homeTeam': {'name': home}, 'awayTeam': {'name': away},
+                            'startTimestamp': 1692000000 + (i // 5) * 7 * 86400})
+        return matches
+
+    def scrape_heatmaps(self, match_id):
+        time.sleep(BENCHMARK_CONFIG['fake_latency'])
+        points = [[(match_id * 7 + i * 13) % 100, (match_id * 3 + i * 29) % 100] for i in range(60)]
+        return {BENCHMARK_CONFIG['player']: {'id': 1, 'heatmap': points}}
+
+    def scrape_player_match_stats(self, match_id):
+        time.sleep(BENCHMARK_CONFIG['fake_latency'])
+        return [{
+            'name': BENCHMARK_CONFIG['player'],
+            'teamName': self.TEAMS[0],
+            'minutesPlayed': 90 - match_id % 4 * 10,
+            'expectedGoals': match_id % 7 / 20,
+            'expectedAssists': match_id % 5 / 15,
+            'keyPass': match_id % 4,
+            'rating': 6 + match_id % 30 / 10,
+        }]
+
+
+def install_fake_sofascore():
+    module = types.ModuleType('ScraperFC')
+    if os.getenv('QUANTIFICO_SYNTHETIC_SOFASCORE'):
+        # Heatmap payloads written by synthetic.py
+        from synthetic import SyntheticSofascore
+        module.Sofascore = SyntheticSofascore
+    else:
+        module.Sofascore = FakeSofascore
+    sys.modules['ScraperFC'] = module
+
+
+def session_paths(player, backend):
+    """Requests of one dashboard session, in order"""
+    routes = benchmark_routes(player, backend)
+    prefix = player.split()[0].lower()
+    searches = ['/api/search?q=' + urllib.parse.quote(prefix[:n]) for n in range(2, min(len(prefix), 5) + 1)]
+    return searches + [routes[name] for name in ('player', 'radar', 'parallel', 'scatter', 'heatmap_stream')]
+
+
+def serve(app_module, port, player, threads=None):
+    """Entry point of the server process"""
+    BENCHMARK_CONFIG['player'] = player
+    install_fake_sofascore()
+    sys.path.insert(0, SERVER_DIR)
+    module = __import__(app_module)
+    if app_module.startswith('asgi_'):
+        import uvicorn
+        uvicorn.run(module.app, host='127.0.0.1', port=port, log_level='warning')
+    elif threads:
+        from gunicorn.app.base import BaseApplication
+
+        class Server(BaseApplication):
+            def load_config(self):
+                for key, value in {'bind': f'127.0.0.1:{port}', 'workers': 1, 'worker_class': 'gthread',
+                                   'threads': threads, 'timeout': 300, 'loglevel': 'warning'}.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return module.app
+
+        Server().run()
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, module.app, threaded=True).serve_forever()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _peak_rss_mb(pid):
+    # VmHWM is the resident set high-water mark; only available on Linux
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _process_tree(pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def _cpu_seconds(pid):
+    """User + system CPU seconds of a process and its live descendants (Linux only)"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0
+    try:
+        for process_id in _process_tree(pid):
+            try:
+                with open(f'/proc/{process_id}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except OSError:
+                pass
+    except OSError:
+        return None
+    return total / ticks
+
+
+def _get(base_url, path):
+    """Status code and full body read time for one request"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(base_url + path, timeout=120) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def _percentile(sorted_samples, q):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, max(0, int(round(q * (len(sorted_samples) - 1)))))
+    return sorted_samples[index]
+
+
+def _throughput(base_url, path, concurrency, duration):
+    deadline = time.perf_counter() + duration
+    counts = [0] * concurrency
+    errors = [0] * concurrency
+
+    def client(i):
+        while time.perf_counter() < deadline:
+            status, _ = _get(base_url, path)
+            counts[i] += 1
+            if status >= 500:
+                errors[i] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return sum(counts) / elapsed, sum(errors)
+
+
+def benchmark_route(base_url, path, config):
+    status, cold = _get(base_url, path)
+    for _ in range(config['warmup']):
+        _get(base_url, path)
+
+    samples = []
+    errors = 0
+    for _ in range(config['requests']):
+        code, elapsed = _get(base_url, path)
+        samples.append(elapsed)
+        errors += code >= 500
+    samples.sort()
+
+    throughput, throughput_errors = _throughput(base_url, path, config['concurrency'], config['duration'])
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'path': path,
+        'status': status,
+        'cold_ms': ms(cold),
+        'p50_ms': ms(_percentile(samples, 0.50)),
+        'p95_ms': ms(_percentile(samples, 0.95)),
+        'p99_ms': ms(_percentile(samples, 0.99)),
+        'mean_ms': ms(statistics.fmean(samples)),
+        'requests': len(samples),
+        'errors': errors + throughput_errors,
+        'throughput_rps': round(throughput, 2),
+        'concurrency': config['concurrency'],
+    }
+
+
+@contextlib.contextmanager
+def started_backend(app_module, config, threads=None, env=None):
+    """(process, base_url) of a benchmark server, stopped on exit"""
+    port = _free_port()
+    shared_dir = tempfile.mkdtemp(prefix='quantifico-bench-')
+    env = dict(os.environ, QUANTIFICO_SHARED_DIR=shared_dir, PYTHONUNBUFFERED='1', **(env or {}))
+    log = tempfile.TemporaryFile()
+    command = [sys.executable, os.path.abspath(__file__), 'serve', '--app', app_module,
+               '--port', str(port), '--player', config['player']]
+    if threads:
+        command += ['--threads', str(threads)]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.time() + config['startup_timeout']
+        while True:
+            if process.poll() is not None:
+                log.seek(0)
+                raise RuntimeError(f"{app_module} exited during start-up:\n{log.read().decode()[-2000:]}")
+            try:
+                _get(base_url, '/metrics')
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError(f"{app_module} did not start within {config['startup_timeout']}s")
+                time.sleep(0.1)
+        yield process, base_url
+    finally:
+        process.terminate()
+        process.wait()
+        log.close()
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def run_backend(app_module, config):
+    with started_backend(app_module, config) as (process, base_url):
+        routes = {}
+        for name, path in benchmark_routes(config['player'], app_module).items():
+            print(f"{app_module} {name} ...", flush=True)
+            routes[name] = benchmark_route(base_url, path, config)
+        return {'routes': routes, 'peak_rss_mb': _peak_rss_mb(process.pid)}
+
+
+def run_sessions_backend(app_module, config):
+    """Concurrent dashboard sessions against one backend"""
+    env = {
+        'QUANTIFICO_FAKE_SOFASCORE_LATENCY': str(config['session_latency']),
+        'HEATMAP_CACHE_SIZE': '0',
+        'MATCH_HEATMAP_CACHE_SIZE': '0',
+        'QUANTIFICO_WARM': '0',
+    }
+    threads = None if app_module.startswith('asgi_') else config['session_threads']
+    paths = session_paths(config['player'], app_module)
+    with started_backend(app_module, config, threads=threads, env=env) as (process, base_url):
+        for path in paths:
+            _get(base_url, path)
+
+        deadline = time.perf_counter() + config['session_duration']
+        durations, errors, rejected = [], [0], [0]
+        lock = threading.Lock()
+
+        def session_client():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                failed = False
+                for path in paths:
+                    status, _ = _get(base_url, path)
+                    if status >= 500:
+                        failed = True
+                        with lock:
+                            errors[0] += 1
+                            rejected[0] += status == 503
+                if not failed:
+                    with lock:
+                        durations.append(time.perf_counter() - start)
+
+        cpu_start, start = _cpu_seconds(process.pid), time.perf_counter()
+        clients = [threading.Thread(target=session_client) for _ in range(config['sessions'])]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapsed = time.perf_counter() - start
+        cpu_end = _cpu_seconds(process.pid)
+
+    durations.sort()
+    cpu = cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        'sessions': len(durations),
+        'concurrent_sessions': config['sessions'],
+        'server_threads': threads,
+        'sessions_per_second': round(len(durations) / elapsed, 2),
+        'session_p50_ms': ms(_percentile(durations, 0.50)),
+        'session_p95_ms': ms(_percentile(durations, 0.95)),
+        'errors': errors[0],
+        'rejected': rejected[0],
+        'server_cpu_seconds': round(cpu, 2) if cpu is not None else None,
+        'sessions_per_cpu_second': round(len(durations) / cpu, 2) if cpu else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(backends, config, run_one=run_backend):
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'config': config,
+        },
+        'backends': {},
+    }
+    for backend in backends:
+        try:
+            report['backends'][backend] = run_one(backend, config)
+        except Exception as e:
+            print(f"Skipping {backend}: {e}")
+            report['backends'][backend] = {'error': str(e)}
+    return report
+
+
+def compare(baseline, current, threshold=0.1):
+    """Regressions between two reports as a list of messages"""
+    regressions = []
+    for backend, result in current['backends'].items():
+        old = baseline['backends'].get(backend)
+        if not old or 'routes' not in old or 'routes' not in result:
+            continue
+        for route, stats in result['routes'].items():
+            before = old['routes'].get(route)
+            if before is None:
+                continue
+            if before['p95_ms'] and stats['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f"{backend} {route}: p95 {before['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms")
+            if before['throughput_rps'] and stats['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+                regressions.append(f"{backend} {route}: throughput {before['throughput_rps']:.1f} -> "
+                                   f"{stats['throughput_rps']:.1f} req/s")
+            if stats['errors'] > before['errors']:
+                regressions.append(f"{backend} {route}: errors {before['errors']} -> {stats['errors']}")
+        if old.get('peak_rss_mb') and result.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"{backend}: peak RSS {old['peak_rss_mb']:.1f} -> {result['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def print_report(report):
+    for backend, result in report['backends'].items():
+        if 'error' in result:
+            print(f"\n{backend}: {result['error'].splitlines()[0]}")
+            continue
+        rss = result['peak_rss_mb']
+        print(f"\n{backend} (peak RSS {rss:.1f} MB)" if rss else f"\n{backend}")
+        print(f"{'route':<22}{'status':>7}{'cold':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>10}")
+        for name, stats in result['routes'].items():
+            print(f"{name:<22}{stats['status']:>7}{stats['cold_ms']:>10.1f}{stats['p50_ms']:>9.2f}"
+                  f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['throughput_rps']:>10.1f}")
+
+
+def print_sessions(report):
+    print(f"\n{'backend':<18}{'threads':>8}{'sessions':>10}{'per s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'errors':>8}{'cpu s':>8}{'per cpu s':>11}")
+    for backend, result in report['backends'].items():
+        if 'error' in result:
+            print(f"{backend:<18}{result['error'].splitlines()[0]}")
+            continue
+        print(f"{backend:<18}{result['server_threads'] or 'async':>8}{result['sessions']:>10}"
+              f"{result['sessions_per_second']:>8.2f}{result['session_p50_ms'] or 0:>9.0f}"
+              f"{result['session_p95_ms'] or 0:>9.0f}{result['errors']:>8}"
+              f"{result['server_cpu_seconds'] or 0:>8.1f}{result['sessions_per_cpu_second'] or 0:>11.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Quantifico API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--backend', action='append', choices=['app', 'app_postgresql', 'asgi_postgresql'])
+    run_parser.add_argument('--player', default=BENCHMARK_CONFIG['player'])
+    run_parser.add_argument('--requests', type=int, default=BENCHMARK_CONFIG['requests'])
+    run_parser.add_argument('--concurrency', type=int, default=BENCHMARK_CONFIG['concurrency'])
+    run_parser.add_argument('--duration', type=float, default=BENCHMARK_CONFIG['duration'])
+    run_parser.add_argument('--output', help='Write the JSON report to this file')
+
+    sessions_parser = commands.add_parser('sessions')
+    sessions_parser.add_argument('--backend', action='append', choices=['app', 'app_postgresql', 'asgi_postgresql'])
+    sessions_parser.add_argument('--player', default=BENCHMARK_CONFIG['player'])
+    sessions_parser.add_argument('--sessions', type=int, default=BENCHMARK_CONFIG['sessions'])
+    sessions_parser.add_argument('--duration', type=float, default=BENCHMARK_CONFIG['session_duration'])
+    sessions_parser.add_argument('--threads', type=int, default=BENCHMARK_CONFIG['session_threads'])
+    sessions_parser.add_argument('--latency', type=float, default=BENCHMARK_CONFIG['session_latency'])
+    sessions_parser.add_argument('--output', help='Write the JSON report to this file')
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--app', required=True)
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--player', default=BENCHMARK_CONFIG['player'])
+    serve_parser.add_argument('--threads', type=int, help='Serve under gunicorn with this many threads')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.app, args.port, args.player, args.threads)
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if not regressions:
+            print("No regressions")
+        sys.exit(1 if regressions else 0)
+    else:
+        if args.command == 'sessions':
+            config = dict(BENCHMARK_CONFIG, player=args.player, sessions=args.sessions,
+                          session_duration=args.duration, session_threads=args.threads,
+                          session_latency=args.latency)
+            report = run(args.backend or ['app_postgresql', 'asgi_postgresql'], config, run_sessions_backend)
+            print_sessions(report)
+        else:
+            config = dict(BENCHMARK_CONFIG, player=args.player, requests=args.requests,
+                          concurrency=args.concurrency, duration=args.duration)
+            report = run(args.backend or ['app', 'app_postgresql'], config)
+            print_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
@@ -0,0 +1,59 @@
+"""Small in-process result caches shared by both backends."""
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+_caches = weakref.WeakSet()
+
+
+def all_caches():
+    """Every live ResultCache, for metrics"""
+    return sorted(_caches, key=lambda cache: cache.name)
+
+
+class ResultCache:
+    """Thread-safe LRU cache with an optional TTL and hit/miss counters"""
+
+    def __init__(self, name, max_entries=256, ttl=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (self.ttl is None or time.monotonic() - entry[0] <= self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,330 @@
+"""
+Compact, typed in-memory representation of the player table.
+
+Stats live in one float32 metric x player matrix, the repeated string columns
+(team, nation, position, league, season, market value label) are stored as
+small integer codes into per-column category lists, market value and age are
+parsed once at load time, derived metrics (derived.py) are appended as extra
+metric rows, and player ids and names are resolved through hash indexes.
+Routes go through the accessors below instead of indexing a DataFrame.
+"""
+import json
+import os
+import sys
+import zlib
+from functools import cached_property
+
+import numpy as np
+
+from derived import DERIVED_METRICS, DERIVED_ORDER, derived_rows
+from instrumentation import span
+from player_ids import PlayerIndex
+
+
+PLAYER_DATA_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'data', 'premier_league_merged_stats_labeled_2324_fbref.xlsx'
+)
+
+# Layout of the saved arrays. Bump the revision when it changes; the derived
+# metric names are part of it, so segments and snapshots saved before a
+# derived metric was added or removed are not used as they are
+DATASET_LAYOUT = f"2-{zlib.crc32('|'.join(DERIVED_ORDER).encode()):08x}"
+
+# String columns stored as category codes
+CATEGORICAL_COLUMNS = ['Season', 'league', 'team', 'nation_', 'pos_', 'Value']
+
+# Default scatter plot PCA inputs, computed once per dataset version
+SCATTER_METRICS = {
+    'attacking': [
+        'goal_shot_creation_SCA_SCA90',  # SCA
+        'passing_KP_',                    # Key passes
+        'possession_Carries_PrgC',        # Progressive carries
+        'passing_PrgP_',                  # Progressive passes
+        'Per 90 Minutes_xAG',            # xAG/90
+        'Per 90 Minutes_npxG',           # npxG/90
+        'possession_Take-Ons_Succ%'      # Take ons success rate
+    ],
+    'defensive': [
+        'misc_Aerial Duels_Won%',        # Aerial duels won
+        'defensive_Challenges_Tkl%',      # Defensive challenges tackled
+        'defensive_Blocks_Blocks',        # Defensive blocks
+        'defensive_Int_'                  # Defensive interceptions
+    ]
+}
+
+_ARRAYS = ['matrix', 'value_millions', 'age', 'midfielder_rows',
+           'midfielder_stats', 'scatter_pca']
+
+
+def read_player_excel(file_path=PLAYER_DATA_FILE):
+    try:
+        # pandas is only needed to build a dataset, not to serve one from shared memory
+        import pandas as pd
+
+        print(f"Attempting to read file from: {file_path}")
+        with span('excel_read'):
+            if str(file_path).endswith('.csv'):
+                # Same column layout, e.g. large data sets written by synthetic.py
+                df = pd.read_csv(file_path)
+            else:
+                df = pd.read_excel(file_path, engine='openpyxl')
+        print("Successfully read Excel file")
+        return df
+    except Exception as e:
+        print(f"Error loading data: {e}")
+        return None
+
+
+def convert_value_to_millions(value_str):
+    """Convert value string (e.g., '€900k', '€70.00m') to float in millions"""
+    try:
+        value_str = str(value_str).replace('€', '')
+
+        if 'm' in value_str:
+            return float(value_str.replace('m', ''))
+        elif 'k' in value_str:
+            return float(value_str.replace('k', '')) / 1000
+        else:
+            return float(value_str) / 1000000
+    except Exception as e:
+        print(f"Error converting value: {value_str}, {str(e)}")
+        return 0.0
+
+
+def get_primary_position(pos_str):
+    """Extract primary position from position string"""
+    if pos_str is None or (isinstance(pos_str, float) and np.isnan(pos_str)) or not pos_str:
+        return 'NA'
+
+    first_pos = str(pos_str).split(',')[0].split('/')[0].strip().upper()
+
+
+    if 'GK' in first_pos:
+        return 'GK'
+    elif 'DF' in first_pos:
+        return 'DF'
+    elif 'MF' in first_pos:
+        return 'MF'
+    elif 'FW' in first_pos:
+        return 'FW'
+    return 'NA'
+
+
+def primary_positions(labels, codes):
+    """Primary position of every player from the 'pos_' categories and codes"""
+    # Code -1 (missing) picks the trailing 'NA'
+    return np.array([get_primary_position(label) for label in labels] + ['NA'])[codes]
+
+
+def _calculate_pca(X):
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+
+    with span('pca_fit'):
+        X_scaled = StandardScaler().fit_transform(X)
+        pca = PCA(n_components=1)
+        principal_components = pca.fit_transform(X_scaled)
+    return principal_components.flatten(), float(pca.explained_variance_ratio_[0])
+
+
+def smallest_code_dtype(n_categories):
+    return np.int8 if n_categories < 127 else np.int16 if n_categories < 32767 else np.int32
+
+
+class PlayerDataset:
+    """Typed, column-oriented player table with precomputed indexes"""
+
+    def __init__(self, meta, arrays):
+        self.version = meta['version']
+        self.players = meta['players']
+        self.metrics = meta['metrics']
+        self.categories = meta['categories']
+        self.scatter_variance = meta['scatter_variance']
+        self.source_bytes = meta.get('source_bytes')
+        # Cohort counts and PCA moments kept by ingestion.py between matchweek updates
+        self.running_totals = meta.get('running_totals')
+        # Layout it was built with (None before layouts were recorded) and stamp of its source file
+        self.layout = meta.get('layout')
+        self.source = meta.get('source')
+
+        self.matrix = arrays['matrix']                      # float32, metric x player
+        self.codes = arrays['codes']                        # column -> int codes
+        self.value_millions = arrays['value_millions']      # float64, parsed once
+        self.age = arrays['age']                            # int16
+        self.midfielder_rows = arrays['midfielder_rows']    # int32
+        self.midfielder_stats = arrays['midfielder_stats']  # float32, (min, max, mean) x metric
+        self.scatter_pca = arrays['scatter_pca']            # float32, (attacking, defensive) x midfielder
+
+        self.metric_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self._category_index = {
+            col: {label: code for code, label in enumerate(labels)}
+            for col, labels in self.categories.items()
+        }
+
+    @cached_property
+    def index(self):
+        """Id and name lookups, built on first use (ingestion builds datasets without ever resolving a player)"""
+        born = self.matrix[self.metric_index['born_']] if 'born_' in self.metric_index else None
+        return PlayerIndex(
+            (row, name, self.label('team', row), self.label('Season', row),
+             None if born is None or np.isnan(born[row]) else int(born[row]))
+            for row, name in enumerate(self.players)
+        )
+
+    @classmethod
+    def from_frame(cls, df, version='local'):
+        """Build the compact representation from the raw FBref frame"""
+        metrics = df.select_dtypes(include='number').columns.tolist()
+        matrix = np.ascontiguousarray(df[metrics].to_numpy(dtype=np.float32).T)
+
+        categories = {}
+        codes = {}
+        for col in CATEGORICAL_COLUMNS:
+            values = df[col].astype(object).where(df[col].notna(), None)
+            labels = sorted({v for v in values if v is not None})
+            lookup = {label: code for code, label in enumerate(labels)}
+            categories[col] = labels
+            codes[col] = np.array([lookup[v] if v is not None else -1 for v in values],
+                                  dtype=smallest_code_dtype(len(labels)))
+
+        value_millions = np.array([convert_value_to_millions(v) for v in df['Value']], dtype=np.float64)
+        with span('derived_metrics'):
+            derived, block = derived_rows(metrics, matrix, primary_positions(categories['pos_'], codes['pos_']),
+                                          value_millions)
+        metrics = metrics + derived
+        matrix = np.ascontiguousarray(np.vstack([matrix, block]))
+
+        midfielder_mask = df['pos_'].str.contains('MF', na=False).to_numpy()
+        mf_matrix = matrix[:, midfielder_mask]
+        with np.errstate(all='ignore'):
+            midfielder_stats = np.vstack([
+                np.nanmin(mf_matrix, axis=1),
+                np.nanmax(mf_matrix, axis=1),
+                np.nanmean(mf_matrix, axis=1)
+            ]).astype(np.float32)
+
+        scatter_variance = {}
+        scatter = []
+        midfielders = df[midfielder_mask]
+        for component, scatter_metrics in SCATTER_METRICS.items():
+            values, variance = _calculate_pca(midfielders[scatter_metrics].fillna(0))
+            scatter.append(values)
+            scatter_variance[component] = variance
+
+        meta = {
+            'version': version,
+            'layout': DATASET_LAYOUT,
+            'players': df['player'].astype(str).tolist(),
+            'metrics': metrics,
+            'categories': categories,
+            'scatter_variance': scatter_variance,
+            'source_bytes': int(df.memory_usage(deep=True).sum()),
+        }
+        arrays = {
+            'matrix': matrix,
+            'codes': codes,
+            'value_millions': value_millions,
+            'age': df['age_'].fillna(0).to_numpy(dtype=np.int16),
+            'midfielder_rows': np.flatnonzero(midfielder_mask).astype(np.int32),
+            'midfielder_stats': midfielder_stats,
+            'scatter_pca': np.vstack(scatter).astype(np.float32),
+        }
+        return cls(meta, arrays)
+
+    def save(self, path):
+        """Write every array as its own .npy so it can be memory-mapped"""
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        for col, col_codes in self.codes.items():
+            np.save(os.path.join(path, f'codes-{CATEGORICAL_COLUMNS.index(col)}.npy'), col_codes)
+
+        meta = {
+            'version': self.version,
+            'layout': self.layout,
+            'source': self.source,
+            'players': self.players,
+            'metrics': self.metrics,
+            'categories': self.categories,
+            'scatter_variance': self.scatter_variance,
+            'source_bytes': self.source_bytes,
+            'running_totals': self.running_totals,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        arrays = {name: load_array(name) for name in _ARRAYS}
+        arrays['codes'] = {col: load_array(f'codes-{i}')
+                           for i, col in enumerate(CATEGORICAL_COLUMNS)}
+        return cls(meta, arrays)
+
+    def memory_usage(self):
+        """
+        Bytes held per component, plus the original frame size for comparison.
+        The float32 matrix caps the reduction near 2x of the float64 frame, and
+        the derived metric rows (counted in 'matrix', and again as 'derived')
+        have no counterpart in the frame.
+        """
+        usage = {name: int(getattr(self, name).nbytes) for name in _ARRAYS}
+        usage['codes'] = int(sum(c.nbytes for c in self.codes.values()))
+        usage['labels'] = int(
+            sum(sys.getsizeof(name) for name in self.players) +
+            sum(sys.getsizeof(label) for labels in self.categories.values() for label in labels)
+        )
+        usage['total'] = sum(usage.values())
+        usage['derived'] = sum(name in DERIVED_METRICS for name in self.metrics) * self.matrix[:1].nbytes
+        if self.source_bytes:
+            usage['source_frame'] = self.source_bytes
+            usage['reduction'] = round(self.source_bytes / usage['total'], 2)
+        return usage
+
+    # Typed accessors
+
+    def __len__(self):
+        return len(self.players)
+
+    def row(self, player_key):
+        """Row of a player id (or, for compatibility, a player name); None if unknown"""
+        return self.index.resolve(player_key)
+
+    def player_id(self, row):
+        return self.index.id_of(row)
+
+    def has_metric(self, metric):
+        return metric in self.metric_index
+
+    def column(self, metric):
+        """float32 values of one metric for every player"""
+        return self.matrix[self.metric_index[metric]]
+
+    def metric(self, metric, row):
+        return float(self.matrix[self.metric_index[metric], row])
+
+    def label(self, column, row):
+        """Original string value of a categorical column"""
+        code = self.codes[column][row]
+        return self.categories[column][code] if code >= 0 else None
+
+    def rows_with(self, column, label):
+        """Rows whose categorical column equals label"""
+        code = self._category_index[column].get(label)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.codes[column] == code)
+
+    def primary_position(self, row):
+        return get_primary_position(self.label('pos_', row))
+
+    def cohort_stats(self, metric):
+        """(min, max, mean) of a metric over the midfielder cohort"""
+        i = self.metric_index[metric]
+        return tuple(float(v) for v in self.midfielder_stats[:, i])
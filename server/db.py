@@ -0,0 +1,168 @@
+"""
+Pooled PostgreSQL connections for app_postgresql.py.
+
+Connections come from a psycopg2 ThreadedConnectionPool. Callers wait (up to
+DB_POOL_TIMEOUT seconds) for a free connection instead of failing when the
+pool is exhausted, every cursor's execute() is timed as the db_query phase,
+and connections a request forgot to return are released when it ends
+(unless detached for a streamed response, which returns them itself).
+Inside a request with a deadline (admission.py) every query runs with
+statement_timeout set to the time left, so PostgreSQL cancels it when the
+deadline passes.
+"""
+import math
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import connection as base_connection, cursor as base_cursor
+from psycopg2.pool import ThreadedConnectionPool
+
+from flask import g, has_request_context
+
+from admission import DeadlineExceeded, remaining
+from instrumentation import register_collector, registry, span
+
+POOL_CONFIG = {
+    # psycopg2 keeps at most minconn idle connections open; extra ones are
+    # closed when returned, so size it for the usual concurrency
+    'minconn': int(os.getenv('DB_POOL_MIN', 4)),
+    'maxconn': int(os.getenv('DB_POOL_MAX', 10)),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),   # Seconds to wait for a free connection
+}
+
+_timed_factories = {}
+
+
+def _timed(cursor_factory):
+    """Subclass of cursor_factory whose execute() is timed"""
+    timed = _timed_factories.get(cursor_factory)
+    if timed is None:
+        def execute(self, query, vars=None):
+            left = remaining()
+            if left is not None:
+                if left <= 0:
+                    raise DeadlineExceeded("Deadline exceeded before the query ran")
+                # Scoped to the current transaction, which the pool rolls back on return. A named
+                # (server-side) cursor runs nothing but its own query, so a plain cursor sets it
+                timeout = ("SET LOCAL statement_timeout = %s", (math.ceil(left * 1000),))
+                if self.name is None:
+                    cursor_factory.execute(self, *timeout)
+                else:
+                    with base_cursor(self.connection) as cursor:
+                        cursor.execute(*timeout)
+            with span('db_query'):
+                return cursor_factory.execute(self, query, vars)
+
+        timed = type(f'Timed{cursor_factory.__name__}', (cursor_factory,), {'execute': execute})
+        _timed_factories[cursor_factory] = timed
+    return timed
+
+
+class InstrumentedConnection(base_connection):
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = _timed(kwargs.get('cursor_factory') or base_cursor)
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    def __init__(self, db_config, minconn=None, maxconn=None, timeout=None):
+        self.db_config = db_config
+        self.minconn = minconn or POOL_CONFIG['minconn']
+        self.maxconn = maxconn or POOL_CONFIG['maxconn']
+        self.timeout = POOL_CONFIG['timeout'] if timeout is None else timeout
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._detached = set()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        self.minconn, self.maxconn,
+                        connection_factory=InstrumentedConnection, **self.db_config
+                    )
+        return self._pool
+
+    def getconn(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise psycopg2.pool.PoolError(f"No database connection available after {self.timeout}s")
+        try:
+            connection = self._get_pool().getconn()
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self.errors += 1
+            raise
+        registry.observe('quantifico_db_pool_wait_seconds', time.perf_counter() - start)
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+        if has_request_context():
+            g.setdefault('db_connections', []).append(connection)
+        return connection
+
+    def detach(self, connection):
+        """Leave connection out of the request's automatic release; whoever streams from it returns it"""
+        held = g.get('db_connections', [])
+        if connection in held:
+            held.remove(connection)
+        with self._lock:
+            self._detached.add(connection)
+
+    def putconn(self, connection):
+        with self._lock:
+            detached = connection in self._detached
+            self._detached.discard(connection)
+        if has_request_context() and not detached:
+            held = g.get('db_connections', [])
+            if connection not in held:
+                return
+            held.remove(connection)
+        # Broken connections are closed rather than handed to the next request
+        self._get_pool().putconn(connection, close=bool(connection.closed))
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def release_request_connections(self):
+        """Return connections the current request did not release itself"""
+        for connection in list(g.get('db_connections', [])):
+            self.putconn(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.maxconn,
+                'in_use': self.in_use,
+                'idle': len(self._pool._pool) if self._pool is not None else 0,
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+            }
+
+
+def register_pool_metrics(pool):
+    def collect():
+        stats = pool.stats()
+        return [
+            ('quantifico_db_pool_size', 'gauge', 'Maximum pooled connections', [({}, stats['size'])]),
+            ('quantifico_db_pool_in_use', 'gauge', 'Connections checked out', [({}, stats['in_use'])]),
+            ('quantifico_db_pool_idle', 'gauge', 'Open connections waiting in the pool', [({}, stats['idle'])]),
+            ('quantifico_db_pool_acquired_total', 'counter', 'Connections handed out', [({}, stats['acquired'])]),
+            ('quantifico_db_pool_timeouts_total', 'counter', 'Waits for a connection that timed out',
+             [({}, stats['timeouts'])]),
+            ('quantifico_db_pool_errors_total', 'counter', 'Failed connection attempts', [({}, stats['errors'])]),
+        ]
+
+    register_collector(collect)
@@ -0,0 +1,181 @@
+"""
+Derived metrics, declared once and computed with the data.
+
+Per-90 rates, value for money ratios, position adjusted z-scores and
+composite indices were each computed ad hoc by the routes that needed them.
+Here every derived metric is a declaration: its inputs (FBref columns, the
+pseudo columns in INPUT_COLUMNS, or other derived metrics) and a vectorized
+function of them. DERIVED_ORDER sorts the declarations so every metric comes
+after its inputs, and an import with a cycle fails.
+
+PlayerDataset.from_frame evaluates them once per data version and appends
+them to the metric matrix, and ingestion.py recomputes them with every
+matchweek, so radar, parallel, leaderboard and filter requests read them
+like any other column, at no per-request cost. A declaration whose inputs
+a dataset lacks is skipped, together with everything that depends on it.
+"""
+import os
+import warnings
+
+import numpy as np
+
+DERIVED_CONFIG = {
+    # Players below this many minutes have no z-score (a few minutes make per-90 values meaningless)
+    'z_min_minutes': float(os.getenv('QUANTIFICO_DERIVED_MIN_MINUTES', 450)),
+}
+
+# Inputs that are not metric rows: the primary position label and the market value of every player
+INPUT_COLUMNS = ['primary_position', 'value_millions']
+
+
+class Derived:
+    def __init__(self, inputs, compute, description):
+        self.inputs = inputs
+        self.compute = compute
+        self.description = description
+
+
+def per90(column):
+    def compute(values, nineties):
+        with np.errstate(all='ignore'):
+            return np.where(nineties > 0, values / nineties, np.nan)
+    return Derived([column, 'Playing Time_90s'], compute, f'{column} per 90 minutes')
+
+
+def ratio(numerator, denominator, description):
+    def compute(top, bottom):
+        with np.errstate(all='ignore'):
+            return np.where(bottom > 0, top / bottom, np.nan)
+    return Derived([numerator, denominator], compute, description)
+
+
+def position_z(metric):
+    def compute(values, positions, minutes):
+        z = np.full(len(values), np.nan)
+        reference = np.isfinite(values) & (minutes >= DERIVED_CONFIG['z_min_minutes'])
+        for position in np.unique(positions):
+            group = positions == position
+            sample = values[group & reference]
+            std = sample.std() if len(sample) > 1 else 0.0
+            if std > 0:
+                scored = group & reference
+                z[scored] = (values[scored] - sample.mean()) / std
+        return z
+    return Derived([metric, 'primary_position', 'Playing Time_Min'], compute,
+                   f'{metric} as a z-score within the primary position, for players with enough minutes')
+
+
+def composite(metrics, description):
+    def compute(*values):
+        with warnings.catch_warnings():
+            # A player with none of the inputs gets NaN rather than a warning
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(np.vstack(values), axis=0)
+    return Derived(list(metrics), compute, description)
+
+
+DERIVED_METRICS = {
+    'Key Passes/90': per90('passing_KP_'),
+    'Prog. Passes/90': per90('passing_PrgP_'),
+    'Prog. Carries/90': per90('possession_Carries_PrgC'),
+    'Prog. Receptions/90': per90('possession_Receiving_PrgR'),
+    'Carries into Final Third/90': per90('possession_Carries_1/3'),
+    'Passes into Final Third/90': per90('passing_1/3_'),
+    'Touches in Att Pen/90': per90('possession_Touches_Att Pen'),
+    'Successful Take-Ons/90': per90('possession_Take-Ons_Succ'),
+    'Tkl+Int/90': per90('defensive_Tkl+Int_'),
+    'Recoveries/90': per90('misc_Performance_Recov'),
+    'Blocks/90': per90('defensive_Blocks_Blocks'),
+
+    'Value/G+A': ratio('value_millions', 'Performance_G+A', 'Market value (€m) per goal or assist'),
+    'Value/npxG+xAG': ratio('value_millions', 'Expected_npxG+xAG',
+                            'Market value (€m) per non-penalty expected goal or assist'),
+
+    'npxG/90 z': position_z('Per 90 Minutes_npxG'),
+    'xAG/90 z': position_z('Per 90 Minutes_xAG'),
+    'SCA/90 z': position_z('goal_shot_creation_SCA_SCA90'),
+    'Shots/90 z': position_z('shooting_Standard_Sh/90'),
+    'Key Passes/90 z': position_z('Key Passes/90'),
+    'Prog. Passes/90 z': position_z('Prog. Passes/90'),
+    'Prog. Carries/90 z': position_z('Prog. Carries/90'),
+    'Prog. Receptions/90 z': position_z('Prog. Receptions/90'),
+    'Touches in Att Pen/90 z': position_z('Touches in Att Pen/90'),
+    'Tkl+Int/90 z': position_z('Tkl+Int/90'),
+    'Recoveries/90 z': position_z('Recoveries/90'),
+    'Blocks/90 z': position_z('Blocks/90'),
+
+    'Goal Threat Index': composite(['npxG/90 z', 'Shots/90 z', 'Touches in Att Pen/90 z'],
+                                   'Mean position z-score of npxG, shots and penalty area touches per 90'),
+    'Creativity Index': composite(['xAG/90 z', 'SCA/90 z', 'Key Passes/90 z'],
+                                  'Mean position z-score of xAG, shot-creating actions and key passes per 90'),
+    'Progression Index': composite(['Prog. Passes/90 z', 'Prog. Carries/90 z', 'Prog. Receptions/90 z'],
+                                   'Mean position z-score of progressive passes, carries and receptions per 90'),
+    'Defensive Index': composite(['Tkl+Int/90 z', 'Recoveries/90 z', 'Blocks/90 z'],
+                                 'Mean position z-score of tackles + interceptions, recoveries and blocks per 90'),
+}
+
+
+def dependency_order(definitions):
+    """Derived metric names with every one after the derived metrics it uses; ValueError on a cycle"""
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Derived metrics depend on each other: {' -> '.join(path + [name])}")
+        state[name] = 'visiting'
+        for dependency in definitions[name].inputs:
+            if dependency in definitions:
+                visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in definitions:
+        visit(name, [])
+    return order
+
+
+DERIVED_ORDER = dependency_order(DERIVED_METRICS)
+
+
+def evaluate_derived(columns):
+    """
+    Derived metric name -> float64 values, in DERIVED_ORDER, from columns
+    (input name -> values for every player); metrics with a missing input are left out
+    """
+    values = dict(columns)
+    derived = {}
+    for name in DERIVED_ORDER:
+        definition = DERIVED_METRICS[name]
+        if all(dependency in values for dependency in definition.inputs):
+            derived[name] = values[name] = np.asarray(
+                definition.compute(*(values[dependency] for dependency in definition.inputs)), dtype=np.float64)
+    return derived
+
+
+def derived_rows(metrics, matrix, primary_position, value_millions):
+    """Names and a float32 metric x player block of the derived metrics of a metric matrix"""
+    columns = {metric: matrix[i].astype(np.float64) for i, metric in enumerate(metrics)
+               if metric not in DERIVED_METRICS}
+    columns['primary_position'] = primary_position
+    columns['value_millions'] = np.asarray(value_millions, dtype=np.float64)
+    derived = evaluate_derived(columns)
+    names = list(derived)
+    block = np.vstack([derived[name] for name in names]) if names else np.empty((0, matrix.shape[1]))
+    return names, block.astype(np.float32)
+
+
+def describe_derived(metrics):
+    """/api/available-metrics entries of the derived metrics among metrics"""
+    present = set(metrics)
+    return [
+        {
+            'value': name,
+            'label': name,
+            'derived': True,
+            'description': DERIVED_METRICS[name].description,
+            'depends_on': DERIVED_METRICS[name].inputs,
+        }
+        for name in DERIVED_ORDER if name in present
+    ]
@@ -0,0 +1,204 @@
+"""
+Bulk export of a filtered cohort as CSV or Parquet, streamed in chunks.
+
+/api/export takes the filters of /api/parallel/query (parse_filter_args) and
+its metric selection (?metrics={"name": "column"}), plus ?format=csv (the
+default) or parquet. The matching players are read chunk_rows at a time,
+from the dataset's column arrays (Excel backend) or a server-side cursor
+(PostgreSQL backend). Each chunk is encoded as CSV text or one Parquet row
+group and sent before the next is read, so memory stays at one chunk
+however large the cohort.
+
+A chunk is a list of columns, one sequence per exported column, in the
+order of the (name, kind) pairs describing them; kind is 'string' or
+'float'. Missing floats are written as empty CSV fields and Parquet nulls.
+Parquet needs pyarrow, which is optional.
+"""
+import csv
+import io
+import json
+import os
+
+import numpy as np
+
+from flask import Response, stream_with_context
+
+from admission import check_deadline, streamed
+from dataset import primary_positions
+from instrumentation import span
+
+EXPORT_CONFIG = {
+    'chunk_rows': int(os.getenv('QUANTIFICO_EXPORT_CHUNK_ROWS', 10000)),   # Rows per CSV chunk / Parquet row group
+}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),   # Flask adds the charset to text/ types
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parse_export_args(args):
+    """Export format of ?format=; ValueError if unknown or unavailable"""
+    export_format = args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == 'parquet' and not parquet_available():
+        raise ValueError("Parquet export needs pyarrow on the server; use format=csv")
+    return export_format
+
+
+def parse_export_metrics(args, default):
+    """Exported metrics ({label: column}) of ?metrics=, or default; ValueError unless it is such an object"""
+    metrics_param = args.get('metrics')
+    if not metrics_param:
+        return default
+    try:
+        metrics = json.loads(metrics_param)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"metrics is not valid JSON: {e}")
+    if not isinstance(metrics, dict) or not all(isinstance(column, str) for column in metrics.values()):
+        raise ValueError('metrics must map labels to column names, e.g. {"Minutes": "Playing Time_Min"}')
+    return metrics
+
+
+def _floats(values):
+    return values if isinstance(values, np.ndarray) and values.dtype.kind == 'f' else np.asarray(values, dtype=np.float64)
+
+
+def csv_chunks(columns, chunks):
+    """CSV bytes: the header, then one piece per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue().encode('utf-8')
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        with span('export_encode'):
+            cells = []
+            for (_, kind), values in zip(columns, chunk):
+                if kind == 'float':
+                    # str() of a float32 array keeps the shortest float32 repr instead of float64 noise
+                    values = _floats(values).astype(str)
+                    values[values == 'nan'] = ''
+                    cells.append(values.tolist())
+                else:
+                    cells.append(['' if v is None else v for v in values])
+            writer.writerows(zip(*cells))
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _Drain:
+    """Write-only file collecting what the Parquet writer produced since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_chunks(columns, chunks):
+    """Parquet bytes: one row group per chunk, then the footer"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.float64() if kind == 'float' else pa.string()) for name, kind in columns])
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            with span('export_encode'):
+                arrays = [
+                    pa.array(_floats(values), type=pa.float64(), from_pandas=True) if kind == 'float'
+                    else pa.array(list(values), type=pa.string())
+                    for (_, kind), values in zip(columns, chunk)
+                ]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_response(export_format, columns, chunks, name='players', on_close=None):
+    """
+    Streamed response of chunks in export_format, downloaded as name.<extension>.
+    The request's admission slot is held, and on_close() called, once it has
+    been sent or the client went away.
+    """
+    def checked():
+        for chunk in chunks:
+            yield chunk
+            check_deadline()
+
+    encode = parquet_chunks if export_format == 'parquet' else csv_chunks
+    body, release = streamed(encode(columns, checked()), on_close)
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    response = Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{name}.{extension}"',
+                 'X-Accel-Buffering': 'no'},
+    )
+    response.call_on_close(release)
+    return response
+
+
+def dataset_columns(dataset, metrics):
+    """(name, kind) of an export of dataset, for metrics ({name: column}); ValueError on unknown columns"""
+    unknown = [column for name, column in metrics.items()
+               if name not in ('Position', 'Value') and not dataset.has_metric(column) and column not in dataset.codes]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    kinds = [('id', 'string'), ('player', 'string')]
+    for name, column in metrics.items():
+        string = name == 'Position' or (name != 'Value' and not dataset.has_metric(column))
+        kinds.append((name, 'string' if string else 'float'))
+    return kinds
+
+
+def dataset_chunks(dataset, rows, metrics, chunk_rows=None):
+    """Chunks of the dataset_columns() columns for rows, read straight from the column arrays"""
+    chunk_rows = chunk_rows or EXPORT_CONFIG['chunk_rows']
+    for start in range(0, len(rows), chunk_rows):
+        chunk = np.asarray(rows[start:start + chunk_rows])
+        with span('export_read'):
+            columns = [[dataset.player_id(int(row)) for row in chunk], [dataset.players[row] for row in chunk]]
+            for name, column in metrics.items():
+                if name == 'Position':
+                    columns.append(primary_positions(dataset.categories['pos_'], dataset.codes['pos_'][chunk]).tolist())
+                elif name == 'Value':
+                    columns.append(dataset.value_millions[chunk])
+                elif dataset.has_metric(column):
+                    columns.append(dataset.matrix[dataset.metric_index[column], chunk])
+                else:
+                    labels = np.array(dataset.categories[column] + [None], dtype=object)
+                    columns.append(labels[dataset.codes[column][chunk]].tolist())
+        yield columns
@@ -0,0 +1,223 @@
+"""
+Server-side filtering and brushing for league-wide parallel coordinates.
+
+A FilterIndex answers "which players match these ranges and categories"
+over one data version without scanning rows in Python:
+
+- categorical filters (team, nation, primary position) use precomputed
+  bitmaps, one np.packbits bitmap per label, OR-ed within a filter and
+  AND-ed across filters a byte (eight players) at a time
+- range predicates on any metric use a sorted copy of that column built on
+  first use: two searchsorted calls find the matching slice, whose rows are
+  set in a bitmap
+
+Results are a row array plus an evenly spaced sample of the matches, so a
+brush over thousands of players ships their ids but only a few hundred
+full rows.
+"""
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from cache import ResultCache
+from dataset import primary_positions
+from instrumentation import span
+
+
+FILTER_CONFIG = {
+    'sample': 200,                                             # Default rows returned with values
+    'max_sample': int(os.getenv('QUANTIFICO_FILTER_MAX_SAMPLE', 2000)),
+    'sorted_columns': int(os.getenv('QUANTIFICO_FILTER_SORTED_COLUMNS', 64)),   # Sorted copies kept per index
+}
+
+# Query parameter -> categorical column
+CATEGORY_FILTERS = {'team': 'team', 'nation': 'nation_', 'position': 'position'}
+
+# Range keys that are not metric columns
+VIRTUAL_RANGES = {'Value': 'value_millions'}
+
+
+def parse_filter_args(args):
+    """(ranges, categories) from query parameters; ValueError on bad input"""
+    ranges = {}
+    ranges_param = args.get('ranges')
+    if ranges_param:
+        try:
+            parsed = json.loads(ranges_param)   # {"column": [low, high]}, null for open ends
+        except json.JSONDecodeError as e:
+            raise ValueError(f"ranges is not valid JSON: {e}")
+        if not isinstance(parsed, dict):
+            raise ValueError('ranges must map columns to [low, high]')
+        for column, bounds in parsed.items():
+            if not isinstance(bounds, (list, tuple)) or len(bounds) != 2:
+                raise ValueError(f"Range for {column} must be [low, high]")
+            ranges[column] = tuple(None if b is None else float(b) for b in bounds)
+
+    # Age band shorthand
+    for name, side in (('min_age', 0), ('max_age', 1)):
+        if args.get(name):
+            low, high = ranges.get('age_', (None, None))
+            bound = float(args[name])
+            ranges['age_'] = (bound, high) if side == 0 else (low, bound)
+
+    return ranges, parse_category_args(args)
+
+
+def parse_category_args(args):
+    """Categorical column -> sorted labels from ?team=, ?nation= and ?position= (upper-cased, like the data)"""
+    categories = {}
+    for param, column in CATEGORY_FILTERS.items():
+        labels = {label.strip() for value in args.getlist(param) for label in value.split(',') if label.strip()}
+        if labels:
+            categories[column] = sorted({label.upper() for label in labels} if param == 'position' else labels)
+    return categories
+
+
+def parse_sample_size(args):
+    return min(max(int(args.get('sample', FILTER_CONFIG['sample'])), 0), FILTER_CONFIG['max_sample'])
+
+
+def sample_rows(rows, size):
+    """Evenly spaced subset of rows, so repeated brushes show stable samples"""
+    rows = np.asarray(rows)
+    if size >= len(rows):
+        return rows
+    if size == 0:
+        return rows[:0]
+    return rows[np.linspace(0, len(rows) - 1, size).astype(np.int64)]
+
+
+class FilterIndex:
+    """Bitmap and sorted-column indexes over one PlayerDataset"""
+
+    def __init__(self, dataset):
+        # Weak, so a cached index does not keep an evicted partition mapped
+        self._dataset = weakref.ref(dataset)
+        self.size = len(dataset)
+        self._sorted = OrderedDict()   # (column, per90) -> (order, sorted values, finite count), LRU
+        self._lock = threading.Lock()
+
+        self.bitmaps = {}   # column -> {label: packed bitmap}
+        for column in ('team', 'nation_'):
+            codes = dataset.codes[column]
+            self.bitmaps[column] = {
+                label: np.packbits(codes == code) for code, label in enumerate(dataset.categories[column])
+            }
+        positions = primary_positions(dataset.categories['pos_'], dataset.codes['pos_'])
+        self.bitmaps['position'] = {label: np.packbits(positions == label) for label in np.unique(positions)}
+
+    def bind(self, dataset):
+        """Point at a reloaded copy of the same data version"""
+        if self._dataset() is not dataset:
+            self._dataset = weakref.ref(dataset)
+
+    def _values(self, column, per90=False):
+        dataset = self._dataset()
+        if column in VIRTUAL_RANGES:
+            return getattr(dataset, VIRTUAL_RANGES[column])
+        if not dataset.has_metric(column):
+            raise ValueError(f"Unknown column: {column}")
+        values = dataset.column(column)
+        if per90:
+            nineties = dataset.column('Playing Time_90s')
+            with np.errstate(all='ignore'):
+                values = np.where(nineties > 0, values / nineties, np.nan).astype(np.float32)
+        return values
+
+    def sorted_column(self, column, per90=False):
+        """(row order, sorted values, number of non-NaN values), built on first use"""
+        key = (column, per90)
+        with self._lock:
+            entry = self._sorted.get(key)
+            if entry is not None:
+                self._sorted.move_to_end(key)
+                return entry
+
+        values = np.asarray(self._values(column, per90))
+        with span('filter_sort'):
+            order = np.argsort(values, kind='stable').astype(np.int32)   # NaN sorts last
+            ordered = values[order]
+            finite = len(ordered) - int(np.isnan(ordered).sum()) if ordered.dtype.kind == 'f' else len(ordered)
+        entry = (order, ordered, finite)
+        with self._lock:
+            self._sorted[key] = entry
+            while len(self._sorted) > FILTER_CONFIG['sorted_columns']:
+                self._sorted.popitem(last=False)
+        return entry
+
+    def range_bitmap(self, column, low=None, high=None):
+        order, ordered, finite = self.sorted_column(column)
+        start = 0 if low is None else int(np.searchsorted(ordered[:finite], low, side='left'))
+        stop = finite if high is None else int(np.searchsorted(ordered[:finite], high, side='right'))
+        mask = np.zeros(self.size, dtype=bool)
+        mask[order[start:stop]] = True
+        return np.packbits(mask)
+
+    def category_bitmap(self, column, labels):
+        bitmaps = self.bitmaps[column]
+        result = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for label in labels:
+            bitmap = bitmaps.get(label)
+            if bitmap is not None:
+                result |= bitmap
+        return result
+
+    def mask(self, ranges=None, categories=None):
+        """Boolean mask of the rows matching every range (inclusive) and, per category, any of its labels"""
+        bitmap = None
+        predicates = [self.category_bitmap(column, labels) for column, labels in (categories or {}).items()]
+        predicates += [self.range_bitmap(column, low, high) for column, (low, high) in (ranges or {}).items()]
+        for predicate in predicates:
+            bitmap = predicate if bitmap is None else bitmap & predicate
+        if bitmap is None:
+            return np.ones(self.size, dtype=bool)
+        return np.unpackbits(bitmap, count=self.size).view(bool)
+
+    def row_test(self, ranges=None, categories=None):
+        """
+        Function testing given rows against the same predicates as mask(),
+        for callers that visit rows in some order and stop early
+        """
+        bitmaps = [self.category_bitmap(column, labels) for column, labels in (categories or {}).items()]
+        columns = [(self._values(column), low, high) for column, (low, high) in (ranges or {}).items()]
+
+        def test(rows):
+            keep = np.ones(len(rows), dtype=bool)
+            for bitmap in bitmaps:
+                # np.packbits is big-endian within each byte
+                keep &= ((bitmap[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+            for values, low, high in columns:
+                row_values = values[rows]
+                if low is not None:
+                    keep &= row_values >= low
+                if high is not None:
+                    keep &= row_values <= high
+            return keep
+
+        return test
+
+    def query(self, ranges=None, categories=None):
+        """Rows passing mask()"""
+        return np.flatnonzero(self.mask(ranges, categories))
+
+
+filter_indexes = ResultCache('filter_index', max_entries=16)
+_index_lock = threading.Lock()
+
+
+def get_filter_index(dataset):
+    """FilterIndex for a dataset, built once per data version"""
+    index = filter_indexes.get(dataset.version)
+    if index is None:
+        with _index_lock:
+            index = filter_indexes.get(dataset.version)
+            if index is None:
+                with span('filter_index'):
+                    index = FilterIndex(dataset)
+                filter_indexes.set(dataset.version, index)
+    index.bind(dataset)
+    return index
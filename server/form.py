@@ -0,0 +1,416 @@
+"""
+Per-match player stats from Sofascore and rolling form over them.
+
+Season totals cannot show trends, so every match the heatmap code iterates
+over (see heatmap.iter_match_heatmaps) is also queued here: a background
+thread scrapes the match's player stats once and appends them to the
+season's FormStore. The store is columnar, a few numpy arrays sorted by
+(player, kickoff), saved as one .npz file per league-season under
+data/form/. A player's matches are one contiguous slice found through
+per-player offsets, and rolling windows of any size come from differences
+of cumulative sums over that slice, so an /api/form request costs
+O(matches) whatever the windows.
+
+Workers reload the file when it changes on disk and merge before writing,
+so they share one store; a match lost to two workers writing at once is
+simply ingested again the next time it is iterated.
+
+    python form.py ingest YEAR LEAGUE [--team TEAM]
+"""
+import argparse
+import datetime
+import os
+import queue
+import threading
+
+import numpy as np
+
+from heatmap import match_start_time, register_match_observer, sofascore_flights
+from instrumentation import span
+from jobs import job_manager
+from player_ids import normalize_player_name
+
+
+FORM_CONFIG = {
+    'directory': os.getenv('QUANTIFICO_FORM_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'form')),
+    'from_heatmaps': os.getenv('QUANTIFICO_FORM_FROM_HEATMAPS', '1').lower() not in ('0', 'false', 'no'),
+    'window': 5,          # Default rolling window, in matches
+    'max_window': 60,
+    'max_windows': 4,     # Windows per request
+}
+
+# Metric -> (Sofascore player statistic, aggregation). 'sum' metrics are totals
+# (or per 90 over the window's minutes); 'mean' metrics average over matches.
+FORM_METRICS = {
+    'Goals': ('goals', 'sum'),
+    'Assists': ('goalAssist', 'sum'),
+    'xG': ('expectedGoals', 'sum'),
+    'xA': ('expectedAssists', 'sum'),
+    'Shots on Target': ('onTargetScoringAttempt', 'sum'),
+    'Key Passes': ('keyPass', 'sum'),
+    'Touches': ('touches', 'sum'),
+    'Passes': ('totalPass', 'sum'),
+    'Accurate Passes': ('accuratePass', 'sum'),
+    'Successful Dribbles': ('wonContest', 'sum'),
+    'Tackles': ('totalTackle', 'sum'),
+    'Interceptions': ('interceptionWon', 'sum'),
+    'Rating': ('rating', 'mean'),
+}
+
+DEFAULT_FORM_METRICS = ['xG', 'xA', 'Key Passes', 'Rating']
+
+
+class FormStore:
+    """Per-match rows of one league-season, sorted by (player, kickoff, match)"""
+
+    def __init__(self, path, arrays=None):
+        self.path = path
+        self.mtime = None
+        self._lock = threading.RLock()
+        self._set(arrays or {
+            'names': np.array([], dtype=str),
+            'teams': np.array([], dtype=str),
+            'player': np.array([], dtype=np.int32),
+            'match_id': np.array([], dtype=np.int64),
+            'timestamp': np.array([], dtype=np.int64),
+            'minutes': np.array([], dtype=np.float32),
+            'values': np.zeros((len(FORM_METRICS), 0), dtype=np.float32),
+        })
+
+    def _set(self, arrays):
+        self.arrays = arrays
+        self.names = [str(name) for name in arrays['names']]
+        self._lookup = {normalize_player_name(name): code for code, name in enumerate(self.names)}
+        # Row offsets of each player's slice
+        self.starts = np.searchsorted(arrays['player'], np.arange(len(self.names) + 1))
+        self.match_ids = set(int(m) for m in np.unique(arrays['match_id']))
+
+    @classmethod
+    def load(cls, path):
+        store = cls(path)
+        store.reload()
+        return store
+
+    def reload(self):
+        """Re-read the file if another process has written it"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        with self._lock:
+            if mtime != self.mtime:
+                self._read(mtime)
+
+    def _read(self, mtime):
+        with np.load(self.path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files if name != 'metrics'}
+            stored_metrics = [str(m) for m in data['metrics']]
+        if stored_metrics != list(FORM_METRICS):
+            # Metrics were added or reordered since the file was written; realign, missing ones are NaN
+            values = np.full((len(FORM_METRICS), len(arrays['player'])), np.nan, dtype=np.float32)
+            for i, metric in enumerate(FORM_METRICS):
+                if metric in stored_metrics:
+                    values[i] = arrays['values'][stored_metrics.index(metric)]
+            arrays['values'] = values
+        self._set(arrays)
+        self.mtime = mtime
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, metrics=np.array(list(FORM_METRICS)), **self.arrays)
+        os.replace(tmp, self.path)
+        self.mtime = os.path.getmtime(self.path)
+
+    def __len__(self):
+        return len(self.arrays['player'])
+
+    def add_match(self, match_id, timestamp, rows):
+        """Store one match's rows [(name, team, minutes, {metric: value})], replacing earlier copies"""
+        with self._lock:
+            self.reload()
+            old = self.arrays
+            keep = old['match_id'] != match_id
+            names = [self.names[code] for code in old['player'][keep]] + [row[0] for row in rows]
+            teams = list(old['teams'][keep]) + [row[1] for row in rows]
+            new_values = np.array([[row[3].get(metric, np.nan) for row in rows] for metric in FORM_METRICS],
+                                  dtype=np.float32).reshape(len(FORM_METRICS), len(rows))
+
+            unique_names, codes = np.unique(np.array(names, dtype=str), return_inverse=True)
+            match_ids = np.concatenate([old['match_id'][keep], np.full(len(rows), match_id, dtype=np.int64)])
+            timestamps = np.concatenate([old['timestamp'][keep], np.full(len(rows), timestamp or 0, dtype=np.int64)])
+            order = np.lexsort((match_ids, timestamps, codes))
+            self._set({
+                'names': unique_names,
+                'teams': np.array(teams, dtype=str)[order],
+                'player': codes.astype(np.int32)[order],
+                'match_id': match_ids[order],
+                'timestamp': timestamps[order],
+                'minutes': np.concatenate([old['minutes'][keep],
+                                           np.array([row[2] for row in rows], dtype=np.float32)])[order],
+                'values': np.concatenate([old['values'][:, keep], new_values], axis=1)[:, order],
+            })
+            self._save()
+
+    def find_player(self, player_name):
+        """Player code for a name: exact up to case and accents, else the only name containing it"""
+        key = normalize_player_name(player_name)
+        code = self._lookup.get(key)
+        if code is None:
+            candidates = [c for name, c in self._lookup.items() if key in name]
+            code = candidates[0] if len(candidates) == 1 else None
+        return code
+
+    def player_rows(self, player_name):
+        """(arrays, stored name or None, row slice) of a player, consistent with each other"""
+        self.reload()
+        with self._lock:
+            code = self.find_player(player_name)
+            if code is None:
+                return self.arrays, None, slice(0, 0)
+            return self.arrays, self.names[code], slice(int(self.starts[code]), int(self.starts[code + 1]))
+
+
+def _rolling(values, window):
+    """Sums over the last `window` entries ending at each position (shorter at the start)"""
+    totals = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+    np.cumsum(values, axis=-1, out=totals[..., 1:])
+    ends = np.arange(1, values.shape[-1] + 1)
+    return totals[..., ends] - totals[..., np.maximum(ends - window, 0)]
+
+
+def _json_values(array):
+    return [None if np.isnan(v) else round(float(v), 4) for v in array]
+
+
+def parse_form_args(args):
+    """(windows, metrics, per90) from query parameters; ValueError on bad input"""
+    windows = []
+    for value in (args.get('window') or str(FORM_CONFIG['window'])).split(','):
+        try:
+            window = int(value)
+        except ValueError:
+            raise ValueError(f"window must be an integer, not {value!r}")
+        if not 1 <= window <= FORM_CONFIG['max_window']:
+            raise ValueError(f"window must be between 1 and {FORM_CONFIG['max_window']}")
+        windows.append(window)
+    windows = list(dict.fromkeys(windows))
+    if len(windows) > FORM_CONFIG['max_windows']:
+        raise ValueError(f"At most {FORM_CONFIG['max_windows']} windows can be requested")
+
+    metrics = [m.strip() for m in args.get('metrics', '').split(',') if m.strip()] or DEFAULT_FORM_METRICS
+    unknown = [m for m in metrics if m not in FORM_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown form metrics: {', '.join(unknown)}")
+    per90 = args.get('per90', '1').lower() not in ('0', 'false', 'no')
+    return windows, metrics, per90
+
+
+def form_payload(year, league, player_name, windows, metrics, per90=True):
+    """A player's matches in order with rolling-window values of the metrics"""
+    store = get_form_store(year, league)
+    arrays, stored_name, rows = store.player_rows(player_name)
+
+    metric_rows = [list(FORM_METRICS).index(m) for m in metrics]
+    values = arrays['values'][metric_rows, rows].astype(np.float64)
+    minutes = arrays['minutes'][rows].astype(np.float64)
+    present = ~np.isnan(values)
+    summed = np.where(present, values, 0.0)
+
+    rolling = {}
+    with span('form_rolling'):
+        for window in windows:
+            totals = _rolling(summed, window)
+            counts = _rolling(present.astype(np.float64), window)
+            window_minutes = _rolling(minutes, window)
+            series = {}
+            for i, metric in enumerate(metrics):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    if FORM_METRICS[metric][1] == 'mean':
+                        result = totals[i] / counts[i]
+                    elif per90:
+                        result = np.where(window_minutes > 0, totals[i] / window_minutes * 90, np.nan)
+                    else:
+                        result = np.where(counts[i] > 0, totals[i], np.nan)
+                series[metric] = _json_values(result)
+            rolling[str(window)] = series
+
+    matches = []
+    for j, (match_id, timestamp) in enumerate(zip(arrays['match_id'][rows], arrays['timestamp'][rows])):
+        matches.append({
+            'match_id': int(match_id),
+            'date': datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc).date().isoformat()
+                    if timestamp else None,
+            'team': str(arrays['teams'][rows][j]),
+            'minutes': float(minutes[j]),
+            'values': dict(zip(metrics, _json_values(values[:, j]))),
+        })
+
+    return {
+        'player': stored_name or player_name,
+        'season': year,
+        'league': league,
+        'metrics': metrics,
+        'per90': per90,
+        'windows': windows,
+        'matches': matches,
+        'rolling': rolling,
+        'ingested_matches': len(store.match_ids),
+    }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_path(year, league):
+    return os.path.join(FORM_CONFIG['directory'], f"{league}-{year.replace('/', '')}.npz")
+
+
+def get_form_store(year, league):
+    with _stores_lock:
+        store = _stores.get((year, league))
+        if store is None:
+            store = _stores[(year, league)] = FormStore.load(store_path(year, league))
+        return store
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def player_stat_rows(raw):
+    """[(name, team, minutes, {metric: value})] of the players who played, from scrape_player_match_stats()"""
+    records = raw.to_dict('records') if hasattr(raw, 'to_dict') else list(raw or [])
+    rows = []
+    for record in records:
+        player = record.get('player')
+        name = record.get('name') or (player.get('name') if isinstance(player, dict) else None)
+        statistics = record.get('statistics') if isinstance(record.get('statistics'), dict) else record
+        minutes = _number(statistics.get('minutesPlayed'))
+        if not name or not minutes > 0:
+            continue
+        team = record.get('teamName') or record.get('team') or ''
+        values = {metric: _number(statistics.get(key)) for metric, (key, _) in FORM_METRICS.items()}
+        # Counting stats Sofascore leaves out of a player's line are zero
+        for metric, (_, aggregation) in FORM_METRICS.items():
+            if aggregation == 'sum' and np.isnan(values[metric]):
+                values[metric] = 0.0
+        rows.append((str(name), str(team), minutes, values))
+    return rows
+
+
+def record_match(ss, year, league, match_id, timestamp=None):
+    """Scrape one match's player stats into the season's store, unless it is already there"""
+    store = get_form_store(year, league)
+    store.reload()
+    if match_id in store.match_ids:
+        return False
+    if timestamp is None:
+        timestamp = match_start_time(match_id)
+    if timestamp is None and hasattr(ss, 'get_match_dict'):
+        timestamp = ss.get_match_dict(match_id).get('startTimestamp')
+
+    def scrape():
+        with span('scrape_match_stats'):
+            return ss.scrape_player_match_stats(match_id)
+
+    raw = sofascore_flights.do(('match_stats', match_id), scrape, group='match_stats')
+    store.add_match(match_id, timestamp, player_stat_rows(raw))
+    return True
+
+
+class FormIngester:
+    """Background thread that records the matches the heatmap code iterates over"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def observe(self, year, league, match_id):
+        if match_id in get_form_store(year, league).match_ids:
+            return
+        with self._lock:
+            if (year, league, match_id) in self._pending:
+                return
+            self._pending.add((year, league, match_id))
+            # Started per process, so a forked worker gets its own thread
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='quantifico-form', daemon=True)
+                self._thread.start()
+        self._queue.put((year, league, match_id))
+
+    def _run(self):
+        from ScraperFC import Sofascore
+        ss = Sofascore()
+        while True:
+            item = self._queue.get()
+            try:
+                record_match(ss, *item)
+            except Exception as e:
+                print(f"Error recording match stats for {item[2]}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(item)
+
+
+ingester = FormIngester()
+if FORM_CONFIG['from_heatmaps']:
+    register_match_observer(ingester.observe)
+
+
+def ingest_season(year, league, team_name=None, progress=None):
+    """Record every match of a season (or of one team's season) in the store"""
+    from ScraperFC import Sofascore
+    ss = Sofascore()
+    matches = ss.get_match_dicts(year, league)
+    if team_name:
+        matches = [
+            match for match in matches
+            if team_name in match['homeTeam']['name'] or team_name in match['awayTeam']['name']
+        ]
+    recorded = 0
+    for completed, match in enumerate(matches, start=1):
+        try:
+            recorded += record_match(ss, year, league, match['id'], match.get('startTimestamp'))
+        except Exception as e:
+            print(f"Skipped match {match['id']} due to error: {e}")
+        if progress:
+            progress(completed, len(matches), f"Recorded match {match['id']}")
+    return {'matches': len(matches), 'recorded': recorded}
+
+
+def _ingest_job(job, year, league, team_name):
+    return ingest_season(year, league, team_name, progress=job.update_progress)
+
+
+def request_form_ingest(year, league, team_name, result_url=None):
+    """Background job recording a team's season, shared by concurrent requests"""
+    return job_manager.submit(('form', year, league, team_name), _ingest_job, year, league, team_name,
+                              result_url=result_url)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record per-match player stats from Sofascore')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest')
+    ingest_parser.add_argument('year', help='Sofascore season, e.g. 23/24')
+    ingest_parser.add_argument('league', help='Sofascore league, e.g. EPL')
+    ingest_parser.add_argument('--team', help='Only this team\'s matches')
+    args = parser.parse_args(argv)
+
+    summary = ingest_season(args.year, args.league, args.team,
+                            progress=lambda done, total, message: print(f"{done}/{total} {message}"))
+    print(f"Recorded {summary['recorded']} of {summary['matches']} matches in {store_path(args.year, args.league)}")
+
+
+if __name__ == '__main__':
+    main()
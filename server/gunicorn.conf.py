@@ -0,0 +1,34 @@
+# Gunicorn settings for the Excel backend: gunicorn -c gunicorn.conf.py app:app
+import os
+
+from partitions import get_partition_store
+from startup import prewarm_in_background
+
+bind = os.getenv('QUANTIFICO_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('QUANTIFICO_WORKERS', 4))
+
+# Partitions published by the master before forking, e.g. "EPL:23/24,LALIGA:23/24".
+# Everything else is loaded lazily on first use.
+preload_partitions = os.getenv('QUANTIFICO_PRELOAD_PARTITIONS', '')
+
+
+def on_starting(server):
+    # Publish datasets once in the master so forked workers attach to them
+    # read-only instead of each loading their own copy
+    store = get_partition_store()
+    keys = [entry.split(':', 1) for entry in preload_partitions.split(',') if entry]
+    for league, season in keys or [store.default]:
+        store.publish(league, season)
+
+
+def on_reload(server):
+    # SIGHUP: publish new versions; workers switch over on their next request
+    on_starting(server)
+
+
+def post_fork(server, worker):
+    # QUANTIFICO_PREWARM=all (or e.g. "pandas,sklearn") imports the lazily loaded
+    # dependencies in the background so the first scatter/heatmap request is fast
+    groups = os.getenv('QUANTIFICO_PREWARM')
+    if groups:
+        prewarm_in_background(groups)
@@ -0,0 +1,505 @@
+"""
+Season heatmaps built from Sofascore match data, shared by both backends.
+
+Scrapes are slow (one request per match of the season), so routes never run
+them on a request thread: request_heatmap() answers from the heatmap cache or
+enqueues a background job (see jobs.py) whose result lands in the cache.
+stream_heatmap() is the streaming alternative, emitting each match as NDJSON
+as soon as it has been read from the per-match cache or scraped.
+
+Every finished season is also binned into a fixed-resolution occupancy grid
+per player. aggregate_heatmap() sums the grids of a cohort (a team, a
+position, any filtered set of players) in one vectorized step, so cohort
+heatmaps never touch raw points or Sofascore once the players' grids exist.
+"""
+import json
+import os
+
+import numpy as np
+
+from admission import check_deadline
+from cache import ResultCache
+from instrumentation import span
+from jobs import job_manager
+from single_flight import SingleFlight
+
+
+HEATMAP_PARAMS = {
+    'bw_adjust': 0.7,     # ADJUST THIS: Lower (0.5-0.8) for more distinct spots, Higher for more blur
+    'levels': 90,        # ADJUST THIS: Lower (20-50) for more distinct levels, Higher for smoother gradient
+    'thresh': 0.08,       # ADJUST THIS: Higher (0.1-0.2) for less spread, Lower for more spread
+}
+
+# Coordinate scaling and positioning
+SCALING = {
+    'x_scale': 1.29,      # ADJUST THIS: Changes horizontal stretch/compression
+    'y_scale': 0.9,       # ADJUST THIS: Changes vertical stretch/compression
+    'x_offset': 0,        # ADJUST THIS: Shifts entire heatmap left (-) or right (+)
+    'y_offset': 0         # ADJUST THIS: Shifts entire heatmap up (+) or down (-)
+}
+
+def _pyplot():
+    # Plotting libraries are imported on first use; only the matplotlib
+    # rendering helpers below need them
+    import matplotlib
+    matplotlib.use('Agg')  # Required for headless mode
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def create_soccer_field(ax):
+    from matplotlib.patches import Arc
+    plt = _pyplot()
+
+    # White background
+    ax.set_facecolor('white')
+    
+    # Black lines for the pitch
+    line_color = 'black'
+    line_width = 1
+    
+    # Pitch outline and center line
+    plt.plot([0, 0], [0, 90], color=line_color, linewidth=line_width)
+    plt.plot([0, 130], [90, 90], color=line_color, linewidth=line_width)
+    plt.plot([130, 130], [90, 0], color=line_color, linewidth=line_width)
+    plt.plot([130, 0], [0, 0], color=line_color, linewidth=line_width)
+    plt.plot([65, 65], [0, 90], color=line_color, linewidth=line_width)
+
+    # Left penalty area
+    plt.plot([16.5, 16.5], [65, 25], color=line_color, linewidth=line_width)
+    plt.plot([0, 16.5], [65, 65], color=line_color, linewidth=line_width)
+    plt.plot([16.5, 0], [25, 25], color=line_color, linewidth=line_width)
+
+    # Right penalty area
+    plt.plot([130, 113.5], [65, 65], color=line_color, linewidth=line_width)
+    plt.plot([113.5, 113.5], [65, 25], color=line_color, linewidth=line_width)
+    plt.plot([113.5, 130], [25, 25], color=line_color, linewidth=line_width)
+
+    # Left 6-yard box
+    plt.plot([0, 5.5], [54, 54], color=line_color, linewidth=line_width)
+    plt.plot([5.5, 5.5], [54, 36], color=line_color, linewidth=line_width)
+    plt.plot([5.5, 0], [36, 36], color=line_color, linewidth=line_width)
+
+    # Right 6-yard box
+    plt.plot([130, 124.5], [54, 54], color=line_color, linewidth=line_width)
+    plt.plot([124.5, 124.5], [54, 36], color=line_color, linewidth=line_width)
+    plt.plot([124.5, 130], [36, 36], color=line_color, linewidth=line_width)
+
+    # Center circle
+    center_circle = plt.Circle((65, 45), 9.15, color=line_color, fill=False, linewidth=line_width)
+    ax.add_patch(center_circle)
+    
+    # Penalty spots and center spot
+    plt.scatter([11, 65, 119], [45, 45, 45], color=line_color, s=20)
+
+    # Penalty arcs
+    left_arc = Arc((11, 45), height=18.3, width=18.3, angle=0, theta1=310, theta2=50, 
+                   color=line_color, linewidth=line_width)
+    right_arc = Arc((119, 45), height=18.3, width=18.3, angle=0, theta1=130, theta2=230, 
+                    color=line_color, linewidth=line_width)
+    ax.add_patch(left_arc)
+    ax.add_patch(right_arc)
+
+def _team_match_ids(ss, year, league, team_name):
+    """Ids of a team's matches in a season, from the match list cache when possible"""
+    key = (year, league, team_name)
+    match_ids = match_list_cache.get(key)
+    if match_ids is None:
+        def fetch():
+            print(f"Fetching {league} matches for {year} season...")
+            with span('scrape_match_list'):
+                matches = ss.get_match_dicts(year, league)
+            match_ids = []
+            for match in matches:
+                if team_name in match['homeTeam']['name'] or team_name in match['awayTeam']['name']:
+                    match_ids.append(match['id'])
+                    match_start_cache.set(match['id'], match.get('startTimestamp'))
+            match_list_cache.set(key, match_ids)
+            return match_ids
+
+        match_ids = sofascore_flights.do(('matches',) + key, fetch, group='match_list')
+    return match_ids
+
+
+def register_match_observer(observer):
+    """Have observer(year, league, match_id) called for each match a heatmap iterates over"""
+    _match_observers.append(observer)
+
+
+def match_start_time(match_id):
+    """Kick-off timestamp of a match seen in a match list, or None"""
+    return match_start_cache.get(match_id)
+
+
+def _scrape_match(ss, match_id, player_name):
+    key = (match_id, player_name.lower())
+    # Another flight may have filled the cache since the caller's lookup
+    if key in match_heatmap_cache:
+        return match_heatmap_cache.get(key)
+
+    with span('scrape_match'):
+        heatmap_data = ss.scrape_heatmaps(match_id)
+
+    # Find player data
+    player_data = None
+    for player_id, data in heatmap_data.items():
+        if player_name.lower() in player_id.lower():
+            player_data = data
+            break
+
+    coordinates = player_data['heatmap'] if player_data and player_data['heatmap'] else []
+    match_heatmap_cache.set(key, coordinates)
+    return coordinates
+
+
+def iter_match_heatmaps(year, league, player_name, team_name):
+    """
+    Yield (completed, total, match_id, coordinates) for each of the team's
+    matches as soon as it is available. Per-match coordinates come from the
+    match heatmap cache before falling back to Sofascore, and concurrent
+    scrapes of a match are coalesced; coordinates is None for matches that
+    could not be scraped.
+    """
+    from ScraperFC import Sofascore
+    from tqdm import tqdm  # For progress bar
+
+    ss = Sofascore()
+    match_ids = _team_match_ids(ss, year, league, team_name)
+    total = len(match_ids)
+    print(f"Found {total} matches for {team_name}")
+
+    for completed, match_id in enumerate(tqdm(match_ids, desc="Processing matches"), start=1):
+        # Streamed requests stop scraping at their deadline; background jobs have none
+        check_deadline()
+        for observer in _match_observers:
+            try:
+                observer(year, league, match_id)
+            except Exception as e:
+                print(f"Match observer failed for {match_id}: {e}")
+        key = (match_id, player_name.lower())
+        coordinates = match_heatmap_cache.get(key)
+        if coordinates is None:
+            try:
+                # Concurrent scrapes of the same match share one Sofascore request
+                coordinates = sofascore_flights.do(
+                    ('match',) + key, lambda: _scrape_match(ss, match_id, player_name), group='match_heatmap'
+                )
+            except Exception as e:
+                print(f"Skipped match {match_id} due to error: {str(e)}")
+        yield completed, total, match_id, coordinates
+
+
+def get_season_heatmap_data(year="2023/2024", league="EPL", player_name="Bruno Fernandes", team_name="Manchester United", progress=None):
+    """
+    Collect heatmap data from all matches in a season for a specific player.
+    progress(completed, total, message) is called after every match.
+    """
+    # Collect coordinates from all matches
+    all_coordinates = []
+    skipped_matches = 0
+    total = 0
+
+    for completed, total, match_id, coordinates in iter_match_heatmaps(year, league, player_name, team_name):
+        if coordinates is None:
+            skipped_matches += 1
+        else:
+            all_coordinates.extend(coordinates)
+        if progress:
+            progress(completed, total, f"Processed match {match_id}")
+    
+    print(f"Processed {total - skipped_matches} matches successfully")
+    print(f"Total coordinates collected: {len(all_coordinates)}")
+    
+    return all_coordinates
+
+
+def create_season_heatmap(year="2023/2024", league="EPL", player_name="Bruno Fernandes", team_name="Manchester United"):
+    """Create a heatmap visualization for an entire season"""
+    import pandas as pd
+    import seaborn as sns
+    plt = _pyplot()
+
+    # Get the combined coordinates
+    coordinates = get_season_heatmap_data(year, league, player_name, team_name)
+    
+    if not coordinates:
+        raise ValueError("No heatmap data found for the specified parameters")
+    
+    # Convert to DataFrame
+    coords_df = pd.DataFrame(coordinates, columns=['x', 'y'])
+    
+    # Apply scaling
+    coords_df['x'] = coords_df['x'] * SCALING['x_scale'] + SCALING['x_offset']
+    coords_df['y'] = coords_df['y'] * SCALING['y_scale'] + SCALING['y_offset']
+    
+    # Create figure
+    plt.figure(figsize=(13, 8))
+    ax = plt.gca()
+    
+    # Create pitch
+    create_soccer_field(ax)
+    
+    # Create heatmap
+    sns.kdeplot(
+        data=coords_df, 
+        x='x', 
+        y='y', 
+        cmap='YlOrRd',
+        fill=True,
+        alpha=1.0,
+        levels=HEATMAP_PARAMS['levels'],
+        bw_adjust=HEATMAP_PARAMS['bw_adjust'],
+        clip=((0, 130), (0, 90)),
+        thresh=HEATMAP_PARAMS['thresh']
+    )
+    
+    # Styling
+    plt.title(f"{player_name} - {year} Season Heatmap", pad=20, color='black')
+    plt.axis('off')
+    
+    # Set figure background to white
+    fig = plt.gcf()
+    fig.patch.set_facecolor('white')
+    
+    return fig
+
+
+PITCH_DIMENSIONS = {
+    'width': 130,
+    'height': 90
+}
+
+# Finished season heatmaps, keyed by (year, league, player, team)
+heatmap_cache = ResultCache(
+    'heatmap',
+    max_entries=int(os.getenv('HEATMAP_CACHE_SIZE', 512)),
+    ttl=int(os.getenv('HEATMAP_CACHE_TTL', 6 * 3600))
+)
+
+# Occupancy grids: counts of points per cell over the scaled pitch, rows are y
+GRID_CONFIG = {
+    'bins_x': int(os.getenv('QUANTIFICO_HEATMAP_GRID_X', 65)),   # 2 m cells on a 130 x 90 pitch
+    'bins_y': int(os.getenv('QUANTIFICO_HEATMAP_GRID_Y', 45)),
+    'max_players': int(os.getenv('QUANTIFICO_AGGREGATE_HEATMAP_MAX_PLAYERS', 1000)),
+    'max_scrapes': int(os.getenv('QUANTIFICO_AGGREGATE_HEATMAP_MAX_SCRAPES', 50)),   # Jobs per ?scrape=1 request
+}
+
+# How each player's grid counts towards a cohort: raw points, one unit per player, or minutes played
+AGGREGATE_WEIGHTS = ('points', 'equal', 'minutes')
+# none: weighted counts; max: the busiest cell is 1; sum: cells sum to 1
+AGGREGATE_NORMALIZATIONS = ('none', 'max', 'sum')
+
+# Season occupancy grids, keyed like heatmap_cache
+grid_cache = ResultCache(
+    'heatmap_grid',
+    max_entries=int(os.getenv('HEATMAP_GRID_CACHE_SIZE', 4096)),
+    ttl=int(os.getenv('HEATMAP_CACHE_TTL', 6 * 3600))
+)
+
+# Raw per-match coordinates keyed by (match id, player), shared by the
+# background jobs and the streaming endpoint
+match_heatmap_cache = ResultCache(
+    'match_heatmap',
+    max_entries=int(os.getenv('MATCH_HEATMAP_CACHE_SIZE', 8192)),
+    ttl=int(os.getenv('HEATMAP_CACHE_TTL', 6 * 3600))
+)
+
+# Team match ids keyed by (year, league, team); fixtures change rarely
+match_list_cache = ResultCache('match_list', max_entries=128, ttl=3600)
+
+# Kick-off timestamps of listed matches, keyed by match id
+match_start_cache = ResultCache('match_start', max_entries=16384)
+
+# Called with (year, league, match_id) for every match iter_match_heatmaps() reaches
+_match_observers = []
+
+sofascore_flights = SingleFlight('sofascore')
+
+
+def scale_coordinates(coordinates):
+    return [
+        {
+            'x': coord[0] * SCALING['x_scale'] + SCALING['x_offset'],
+            'y': coord[1] * SCALING['y_scale'] + SCALING['y_offset']
+        }
+        for coord in coordinates
+    ]
+
+
+def occupancy_grid(coordinates, scaled=False):
+    """
+    float32 (bins_y, bins_x) counts of raw Sofascore [x, y] points, or of
+    scaled {'x', 'y'} points as in heatmap payloads. Points off the pitch
+    count towards the nearest edge cell.
+    """
+    bins_x, bins_y = GRID_CONFIG['bins_x'], GRID_CONFIG['bins_y']
+    if scaled:
+        xs = np.fromiter((point['x'] for point in coordinates), dtype=np.float64, count=len(coordinates))
+        ys = np.fromiter((point['y'] for point in coordinates), dtype=np.float64, count=len(coordinates))
+    else:
+        points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        xs = points[:, 0] * SCALING['x_scale'] + SCALING['x_offset']
+        ys = points[:, 1] * SCALING['y_scale'] + SCALING['y_offset']
+    columns = np.clip((xs * (bins_x / PITCH_DIMENSIONS['width'])).astype(np.int64), 0, bins_x - 1)
+    rows = np.clip((ys * (bins_y / PITCH_DIMENSIONS['height'])).astype(np.int64), 0, bins_y - 1)
+    counts = np.bincount(rows * bins_x + columns, minlength=bins_x * bins_y)
+    return counts.reshape(bins_y, bins_x).astype(np.float32)
+
+
+def season_grid(year, league, player_name, team_name):
+    """A player's season occupancy grid, from the grid or heatmap cache; None if not scraped yet"""
+    key = (year, league, player_name.lower(), team_name)
+    grid = grid_cache.get(key)
+    if grid is None:
+        payload = heatmap_cache.get(key)
+        if payload is not None:
+            grid = occupancy_grid(payload['coordinates'], scaled=True)
+            grid_cache.set(key, grid)
+    return grid
+
+
+def parse_aggregate_args(args):
+    """(players, weight, normalize, scrape) from query parameters; ValueError on bad input"""
+    players = [p.strip() for value in args.getlist('players') for p in value.split(',') if p.strip()]
+    weight = args.get('weight', 'points')
+    if weight not in AGGREGATE_WEIGHTS:
+        raise ValueError(f"weight must be one of {', '.join(AGGREGATE_WEIGHTS)}")
+    normalize = args.get('normalize', 'none')
+    if normalize not in AGGREGATE_NORMALIZATIONS:
+        raise ValueError(f"normalize must be one of {', '.join(AGGREGATE_NORMALIZATIONS)}")
+    scrape = args.get('scrape', '').lower() in ('1', 'true', 'yes')
+    return list(dict.fromkeys(players)), weight, normalize, scrape
+
+
+def aggregate_heatmap(year, league, members, weight='points', normalize='none', scrape=False):
+    """
+    Summed occupancy grid of a cohort. members are (id, player_name,
+    team_name, minutes) tuples; players without a season grid yet are
+    listed as missing, and with scrape=True their season scrapes are queued
+    as background jobs (at most GRID_CONFIG['max_scrapes'] per call).
+    """
+    if len(members) > GRID_CONFIG['max_players']:
+        raise ValueError(f"The cohort has {len(members)} players; narrow it to at most {GRID_CONFIG['max_players']}")
+
+    grids, minutes, included, missing = [], [], [], []
+    for member in members:
+        player_id, player_name, team_name, played = member
+        grid = season_grid(year, league, player_name, team_name)
+        if grid is None:
+            missing.append(member)
+        else:
+            grids.append(grid)
+            minutes.append(played if played is not None else 0)
+            included.append(player_id)
+
+    bins_x, bins_y = GRID_CONFIG['bins_x'], GRID_CONFIG['bins_y']
+    with span('aggregate_heatmap'):
+        if grids:
+            stack = np.stack(grids)
+            points = stack.sum(axis=(1, 2), dtype=np.float64)
+            # What each player contributes in total, spread over the cells in proportion to their points
+            units = {'points': points, 'equal': np.ones(len(grids)),
+                     'minutes': np.nan_to_num(np.asarray(minutes, dtype=np.float64))}[weight]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights = np.where(points > 0, units / points, 0.0)
+            total = np.tensordot(weights, stack, axes=1)
+            scale = {'max': total.max(), 'sum': total.sum()}.get(normalize, 0)
+            if scale > 0:
+                total = total / scale
+        else:
+            total = np.zeros((bins_y, bins_x))
+
+    jobs = []
+    if scrape:
+        for player_id, player_name, team_name, _ in missing[:GRID_CONFIG['max_scrapes']]:
+            _, job = request_heatmap(year, league, player_name, team_name)
+            if job is not None:
+                jobs.append(job.to_dict())
+
+    return {
+        'pitch_dimensions': PITCH_DIMENSIONS,
+        'bins': {'x': bins_x, 'y': bins_y},
+        'weight': weight,
+        'normalize': normalize,
+        'players': len(members),
+        'included': included,
+        'missing': [player_id for player_id, _, _, _ in missing],
+        'jobs': jobs,
+        'grid': np.round(total, 6).tolist(),
+    }
+
+
+def _ndjson(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def stream_heatmap(year, league, player_name, team_name):
+    """
+    NDJSON lines for a season heatmap: a 'meta' line, one 'match' line of
+    scaled coordinates per match as it is processed, then a 'done' line.
+    A cached season heatmap is sent as a single 'season' line instead.
+    Only one match's coordinates are held at a time.
+    """
+    key = (year, league, player_name.lower(), team_name)
+    yield _ndjson({'type': 'meta', 'pitch_dimensions': PITCH_DIMENSIONS})
+
+    payload = heatmap_cache.get(key)
+    if payload is not None:
+        yield _ndjson({'type': 'season', 'coordinates': payload['coordinates']})
+        yield _ndjson({'type': 'done', 'cached': True, 'coordinates': len(payload['coordinates'])})
+        return
+
+    skipped = 0
+    count = 0
+    grid = occupancy_grid([])
+    try:
+        for completed, total, match_id, coordinates in iter_match_heatmaps(year, league, player_name, team_name):
+            if coordinates is None:
+                skipped += 1
+                coordinates = []
+            count += len(coordinates)
+            grid += occupancy_grid(coordinates)
+            yield _ndjson({
+                'type': 'match',
+                'match_id': match_id,
+                'completed': completed,
+                'total': total,
+                'coordinates': scale_coordinates(coordinates)
+            })
+    except Exception as e:
+        print(f"Error streaming heatmap data: {e}")
+        yield _ndjson({'type': 'error', 'error': str(e)})
+        return
+    grid_cache.set(key, grid)
+    yield _ndjson({'type': 'done', 'cached': False, 'skipped': skipped, 'coordinates': count})
+
+
+def _heatmap_job(job, key, year, league, player_name, team_name):
+    coordinates = get_season_heatmap_data(
+        year=year,
+        league=league,
+        player_name=player_name,
+        team_name=team_name,
+        progress=job.update_progress
+    )
+    payload = {
+        'coordinates': scale_coordinates(coordinates),
+        'pitch_dimensions': PITCH_DIMENSIONS
+    }
+    heatmap_cache.set(key, payload)
+    grid_cache.set(key, occupancy_grid(coordinates))
+    return payload
+
+
+def request_heatmap(year, league, player_name, team_name, result_url=None):
+    """
+    Return (payload, None) when the season heatmap is cached, otherwise
+    (None, job) for the background job that is computing it.
+    """
+    key = (year, league, player_name.lower(), team_name)
+    payload = heatmap_cache.get(key)
+    if payload is not None:
+        return payload, None
+    job = job_manager.submit(key, _heatmap_job, key, year, league, player_name, team_name,
+                             result_url=result_url)
+    return None, job
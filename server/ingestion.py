@@ -0,0 +1,637 @@
+"""
+Incremental matchweek ingestion.
+
+Per-match stat rows are the source of truth. Every ingested matchweek is
+kept as matches/<league>-<season>/matchweek-NN.csv next to the manifest, in
+the FBref column layout with one row per player and match (plus optional
+match_id / date / matchweek columns). The aggregates in the partition's
+source file are the season totals before the first ingested matchweek; for
+a new season it can hold just the header.
+
+An update never re-sums the history. It:
+
+- sums the matchweek per (player, team), minus the stored copy of that
+  matchweek when it is re-ingested with corrections, giving a delta
+- adds the delta to the counting columns of the affected players and
+  recomputes only their 90s, per-90 and rate columns
+- updates the midfielder cohort min/max/mean from the changed values; a
+  metric is rescanned only when a player who held its min or max moved inward
+- updates the running sums and cross-products of the scatter PCA inputs, so
+  the components come from a small covariance matrix instead of a refit
+- publishes the result as a new data version of that partition only, so
+  caches keyed on other partitions' versions stay warm
+
+The new aggregates are also written as a snapshot (the PlayerDataset .npy
+files) that the partition store loads instead of the source file, so an
+update costs the size of the matchweek plus one copy of the partition's
+arrays, however many matchweeks came before. rebuild recomputes a partition
+from the source file and every stored matchweek, to check or repair the
+incremental state: like an update, it recomputes the 90s, per-90 and rate
+columns only of players with match rows, and the others keep the source
+file's (rounded) values, so both paths give the same dataset.
+
+    python ingestion.py ingest LEAGUE SEASON matchweek.csv [--matchweek N]
+    python ingestion.py rebuild LEAGUE SEASON
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+
+from dataset import (CATEGORICAL_COLUMNS, SCATTER_METRICS, PlayerDataset, convert_value_to_millions,
+                     primary_positions, read_player_excel, smallest_code_dtype)
+from derived import DERIVED_METRICS, derived_rows
+from instrumentation import span
+from partitions import MANIFEST_FILE, PartitionStore
+from player_ids import normalize_player_name
+from shared_dataset import new_version, publish_dataset
+
+
+# Minutes played / 90, repeated once per FBref table
+NINETIES_COLUMNS = [
+    'Playing Time_90s', 'misc_90s_', 'shooting_90s_', 'defensive_90s_', 'goal_shot_creation_90s_',
+    'possession_90s_', 'passing_90s_', 'pass_types_90s_',
+]
+
+# Rate column -> (numerator columns, denominator columns, scale); no denominator means per 90
+RATE_COLUMNS = {
+    'Per 90 Minutes_Gls': (['Performance_Gls'], None, 1),
+    'Per 90 Minutes_Ast': (['Performance_Ast'], None, 1),
+    'Per 90 Minutes_G+A': (['Performance_Gls', 'Performance_Ast'], None, 1),
+    'Per 90 Minutes_G-PK': (['Performance_G-PK'], None, 1),
+    'Per 90 Minutes_G+A-PK': (['Performance_G-PK', 'Performance_Ast'], None, 1),
+    'Per 90 Minutes_xG': (['Expected_xG'], None, 1),
+    'Per 90 Minutes_xAG': (['Expected_xAG'], None, 1),
+    'Per 90 Minutes_xG+xAG': (['Expected_xG', 'Expected_xAG'], None, 1),
+    'Per 90 Minutes_npxG': (['Expected_npxG'], None, 1),
+    'Per 90 Minutes_npxG+xAG': (['Expected_npxG', 'Expected_xAG'], None, 1),
+    'shooting_Standard_Sh/90': (['shooting_Standard_Sh'], None, 1),
+    'shooting_Standard_SoT/90': (['shooting_Standard_SoT'], None, 1),
+    'goal_shot_creation_SCA_SCA90': (['goal_shot_creation_SCA_SCA'], None, 1),
+    'goal_shot_creation_GCA_GCA90': (['goal_shot_creation_GCA_GCA'], None, 1),
+    'misc_Aerial Duels_Won%': (['misc_Aerial Duels_Won'], ['misc_Aerial Duels_Won', 'misc_Aerial Duels_Lost'], 100),
+    'shooting_Standard_SoT%': (['shooting_Standard_SoT'], ['shooting_Standard_Sh'], 100),
+    # FBref leaves penalty goals out of goals per shot
+    'shooting_Standard_G/Sh': (['Performance_G-PK'], ['shooting_Standard_Sh'], 1),
+    'shooting_Standard_G/SoT': (['Performance_G-PK'], ['shooting_Standard_SoT'], 1),
+    'shooting_Expected_npxG/Sh': (['shooting_Expected_npxG'], ['shooting_Standard_Sh'], 1),
+    'defensive_Challenges_Tkl%': (['defensive_Challenges_Tkl'], ['defensive_Challenges_Att'], 100),
+    'possession_Take-Ons_Succ%': (['possession_Take-Ons_Succ'], ['possession_Take-Ons_Att'], 100),
+    'possession_Take-Ons_Tkld%': (['possession_Take-Ons_Tkld'], ['possession_Take-Ons_Att'], 100),
+    'passing_Total_Cmp%': (['passing_Total_Cmp'], ['passing_Total_Att'], 100),
+    'passing_Short_Cmp%': (['passing_Short_Cmp'], ['passing_Short_Att'], 100),
+    'passing_Medium_Cmp%': (['passing_Medium_Cmp'], ['passing_Medium_Att'], 100),
+    'passing_Long_Cmp%': (['passing_Long_Cmp'], ['passing_Long_Att'], 100),
+}
+
+# Averages over events, weighted by the event count
+WEIGHTED_COLUMNS = {'shooting_Standard_Dist': 'shooting_Standard_Sh'}
+
+# Latest value wins instead of summing
+STATIC_COLUMNS = ['age_', 'born_']
+
+# Match identification, kept in the stored rows but not aggregated
+MATCH_COLUMNS = ['match_id', 'date', 'matchweek']
+
+KEY_COLUMNS = ['player', 'team']
+
+
+def counting_columns(metrics):
+    """Numeric columns that add up across matches"""
+    derived = (set(NINETIES_COLUMNS) | set(RATE_COLUMNS) | set(WEIGHTED_COLUMNS) | set(STATIC_COLUMNS) |
+               set(DERIVED_METRICS))
+    return [m for m in metrics if m not in derived and m not in MATCH_COLUMNS]
+
+
+def derive_columns(block, metric_index):
+    """Recompute the 90s, per-90 and rate rows of a metric x player float64 block in place"""
+    nineties = block[metric_index['Playing Time_Min']] / 90
+    for column in NINETIES_COLUMNS:
+        if column in metric_index:
+            block[metric_index[column]] = nineties
+
+    with np.errstate(all='ignore'):
+        for column, (numerators, denominators, scale) in RATE_COLUMNS.items():
+            inputs = numerators + (denominators or [])
+            if column not in metric_index or any(c not in metric_index for c in inputs):
+                continue
+            numerator = sum(block[metric_index[c]] for c in numerators)
+            denominator = nineties if denominators is None else sum(block[metric_index[c]] for c in denominators)
+            block[metric_index[column]] = np.where(denominator > 0, numerator / denominator * scale, np.nan)
+
+
+class MatchStore:
+    """Stored per-match rows of one partition, one CSV per matchweek"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, matchweek):
+        return os.path.join(self.directory, f'matchweek-{int(matchweek):02d}.csv')
+
+    def matchweeks(self):
+        found = (re.match(r'matchweek-(\d+)\.csv$', os.path.basename(p))
+                 for p in glob.glob(os.path.join(self.directory, 'matchweek-*.csv')))
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def read(self, matchweek):
+        """Rows of a stored matchweek, or None"""
+        import pandas as pd
+
+        path = self.path(matchweek)
+        return pd.read_csv(path) if os.path.exists(path) else None
+
+    def write(self, matchweek, frame):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(matchweek) + f'.{os.getpid()}.tmp'
+        frame.to_csv(tmp, index=False)
+        os.replace(tmp, self.path(matchweek))
+
+    def rows(self, matchweeks=None):
+        """Every stored match row (or those of some matchweeks) in matchweek order"""
+        import pandas as pd
+
+        matchweeks = self.matchweeks() if matchweeks is None else matchweeks
+        frames = [(mw, self.read(mw)) for mw in matchweeks]
+        frames = [frame.assign(matchweek=mw) for mw, frame in frames if frame is not None]
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def check_match_rows(frame, metrics):
+    """ValueError unless frame has the key columns and only known numeric columns"""
+    missing = [c for c in KEY_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Match rows need the columns {', '.join(missing)}")
+    known = set(metrics) | set(CATEGORICAL_COLUMNS) | set(MATCH_COLUMNS) | set(KEY_COLUMNS)
+    unknown = [c for c in frame.columns if c not in known]
+    if unknown:
+        raise ValueError(f"Unknown columns in match rows: {', '.join(unknown[:10])}")
+    if frame[KEY_COLUMNS].isna().any().any():
+        raise ValueError("Every match row needs a player and a team")
+
+
+def aggregate_matches(frame, metrics):
+    """
+    Per (player, team) totals of match rows: counting column sums, event
+    weighted sums ('<column>*<weight>') and the latest labels and static values
+    """
+    import pandas as pd
+
+    counting = [c for c in counting_columns(metrics) if c in frame.columns]
+    sums = frame[counting].apply(pd.to_numeric, errors='coerce')
+    for column, weight in WEIGHTED_COLUMNS.items():
+        if column in frame.columns and weight in frame.columns:
+            sums[f'{column}*{weight}'] = (pd.to_numeric(frame[column], errors='coerce') *
+                                          pd.to_numeric(frame[weight], errors='coerce'))
+    keys = [frame[c].astype(str) for c in KEY_COLUMNS]
+    # A column a player has no values for stays missing rather than 0
+    totals = sums.groupby(keys, sort=False).sum(min_count=1)
+
+    labels = [c for c in CATEGORICAL_COLUMNS + STATIC_COLUMNS if c in frame.columns and c not in KEY_COLUMNS]
+    if labels:
+        totals = totals.join(frame[labels].groupby(keys, sort=False).last())
+    return totals
+
+
+def matchweek_delta(frame, previous, metrics):
+    """Totals of frame minus those of the previously stored version of the same matchweek"""
+    delta = aggregate_matches(frame, metrics)
+    if previous is None:
+        return delta
+    before = aggregate_matches(previous, metrics)
+    index = delta.index.union(before.index, sort=False)
+    numeric = [c for c in delta.columns.union(before.columns, sort=False)
+               if c not in CATEGORICAL_COLUMNS and c not in STATIC_COLUMNS]
+    result = (delta.reindex(index)[[c for c in numeric if c in delta.columns]]
+              .sub(before.reindex(index)[[c for c in numeric if c in before.columns]], fill_value=0))
+    labels = [c for c in delta.columns if c not in numeric]
+    if labels:
+        # Players dropped by the correction keep the labels they had
+        result = result.join(delta.reindex(index)[labels].combine_first(before.reindex(index)[labels]))
+    return result
+
+
+def _running_totals(dataset):
+    """Cohort counts and PCA moments carried by the dataset, computed from scratch on first use"""
+    if dataset.running_totals is not None:
+        return dataset.running_totals
+    with span('ingest_running_totals'):
+        cohort = np.asarray(dataset.matrix)[:, dataset.midfielder_rows]
+        totals = {'midfielder_counts': np.isfinite(cohort).sum(axis=1).tolist(), 'scatter': {}}
+        for component, scatter_metrics in SCATTER_METRICS.items():
+            x = np.nan_to_num(cohort[[dataset.metric_index[m] for m in scatter_metrics]].astype(np.float64)).T
+            totals['scatter'][component] = {'n': len(x), 'sum': x.sum(axis=0).tolist(),
+                                            'products': (x.T @ x).tolist()}
+    return totals
+
+
+def _sorted_codes(labels, codes, updates):
+    """Categories and codes with updates ({row: label}) applied, pruned and sorted like from_frame"""
+    codes = codes.astype(np.int64)
+    extra = sorted({label for label in updates.values() if label is not None} - set(labels))
+    labels = list(labels) + extra
+    lookup = {label: code for code, label in enumerate(labels)}
+    for row, label in updates.items():
+        codes[row] = lookup[label] if label is not None else -1
+
+    used = np.unique(codes[codes >= 0])
+    ordered = sorted(labels[code] for code in used)
+    position = {label: i for i, label in enumerate(ordered)}
+    remap = np.full(len(labels), -1, dtype=np.int64)
+    remap[used] = [position[labels[code]] for code in used]
+    codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+    return ordered, codes.astype(smallest_code_dtype(len(ordered)))
+
+
+def apply_delta(dataset, delta, version, league=None, season=None):
+    """New PlayerDataset with a matchweek delta (from matchweek_delta) added to dataset"""
+    metrics = dataset.metrics
+    metric_index = dataset.metric_index
+    teams = dataset.categories['team']
+    team_codes = np.asarray(dataset.codes['team'])
+    existing = {(name, teams[code] if code >= 0 else None): row
+                for row, (name, code) in enumerate(zip(dataset.players, team_codes.tolist()))}
+
+    keys = list(delta.index)
+    new_keys = [key for key in keys if key not in existing]
+    n_old, n = len(dataset), len(dataset) + len(new_keys)
+    appended = {key: n_old + i for i, key in enumerate(new_keys)}
+    rows = np.array([existing[key] if key in existing else appended[key] for key in keys], dtype=np.int64)
+
+    with span('ingest_apply'):
+        matrix = np.empty((len(metrics), n), dtype=np.float32)
+        matrix[:, :n_old] = dataset.matrix
+        matrix[:, n_old:] = np.nan
+
+        before = matrix[:, rows].astype(np.float64)
+        block = before.copy()
+
+        counting = [c for c in counting_columns(metrics) if c in delta.columns]
+        count_rows = [metric_index[c] for c in counting]
+        weighted_totals = {
+            column: block[metric_index[column]] * block[metric_index[weight]]
+            for column, weight in WEIGHTED_COLUMNS.items() if column in metric_index and weight in metric_index
+        }
+        changes = delta[counting].to_numpy(dtype=np.float64).T
+        block[count_rows] = np.where(np.isnan(changes), block[count_rows], np.nan_to_num(block[count_rows]) + changes)
+        for column, total in weighted_totals.items():
+            weight = WEIGHTED_COLUMNS[column]
+            if f'{column}*{weight}' in delta.columns:
+                change = delta[f'{column}*{weight}'].to_numpy(dtype=np.float64)
+                total = np.where(np.isnan(change), total, np.nan_to_num(total) + change)
+            shots = block[metric_index[weight]]
+            with np.errstate(all='ignore'):
+                block[metric_index[column]] = np.where(shots > 0, total / shots, np.nan)
+        derive_columns(block, metric_index)
+
+        for column in STATIC_COLUMNS:
+            if column in delta.columns and column in metric_index:
+                values = delta[column].to_numpy(dtype=np.float64)
+                block[metric_index[column]] = np.where(np.isnan(values), block[metric_index[column]], values)
+        matrix[:, rows] = block.astype(np.float32)
+        after = matrix[:, rows].astype(np.float64)
+
+        # Labels: new players take theirs from the match rows, existing ones only update their market value
+        defaults = {'Season': season, 'league': league}
+        categories, codes = {}, {}
+        for column in CATEGORICAL_COLUMNS:
+            values = delta[column] if column in delta.columns else None
+            updates = {}
+            for i, key in enumerate(keys):
+                row = int(rows[i])
+                value = values.iloc[i] if values is not None else None
+                value = None if value is None or (isinstance(value, float) and np.isnan(value)) else value
+                if column == 'team':
+                    updates[row] = key[1]
+                elif row >= n_old:
+                    updates[row] = value if value is not None else defaults.get(column)
+                elif column == 'Value' and value is not None:
+                    updates[row] = value
+            old_codes = np.full(n, -1, dtype=np.int64)
+            old_codes[:n_old] = dataset.codes[column]
+            categories[column], codes[column] = _sorted_codes(dataset.categories[column], old_codes, updates)
+
+        value_millions = np.empty(n, dtype=np.float64)
+        value_millions[:n_old] = dataset.value_millions
+        value_labels = categories['Value']
+        for row in rows:
+            code = codes['Value'][row]
+            # Like from_frame, a player without a market value label has none (NaN)
+            value_millions[row] = convert_value_to_millions(value_labels[code]) if code >= 0 else np.nan
+
+        # Position z-scores move with every player's values, so the derived rows are recomputed whole
+        with span('derived_metrics'):
+            derived, derived_block = derived_rows(
+                metrics, matrix, primary_positions(categories['pos_'], codes['pos_']), value_millions)
+            present = [i for i, name in enumerate(derived) if name in metric_index]
+            derived_index = [metric_index[derived[i]] for i in present]
+            matrix[derived_index] = derived_block[present]
+
+        age = np.zeros(n, dtype=np.int16)
+        age[:n_old] = dataset.age
+        if 'age_' in metric_index:
+            age[rows] = np.nan_to_num(after[metric_index['age_']]).astype(np.int16)
+
+    positions = categories['pos_']
+    new_midfielders = [row for row in range(n_old, n)
+                       if codes['pos_'][row] >= 0 and 'MF' in positions[codes['pos_'][row]]]
+    midfielder_rows = np.concatenate([dataset.midfielder_rows, new_midfielders]).astype(np.int32)
+    midfielder_stats, running_totals, scatter_pca, scatter_variance = _update_cohort(
+        dataset, matrix, midfielder_rows, rows, before, after, n_old)
+    if derived_index:
+        # Their changes are not limited to the delta's rows: rescan the cohort instead
+        cohort = matrix[derived_index][:, midfielder_rows]
+        with np.errstate(all='ignore'):
+            midfielder_stats[:, derived_index] = np.vstack([
+                np.nanmin(cohort, axis=1), np.nanmax(cohort, axis=1), np.nanmean(cohort, axis=1)])
+        counts = running_totals['midfielder_counts']
+        for i, count in zip(derived_index, np.isfinite(cohort).sum(axis=1).tolist()):
+            counts[i] = count
+
+    meta = {
+        'version': version,
+        'layout': dataset.layout,
+        'players': list(dataset.players) + [key[0] for key in new_keys],
+        'metrics': metrics,
+        'categories': categories,
+        'scatter_variance': scatter_variance,
+        'source_bytes': dataset.source_bytes,
+        'running_totals': running_totals,
+    }
+    arrays = {
+        'matrix': matrix,
+        'codes': codes,
+        'value_millions': value_millions,
+        'age': age,
+        'midfielder_rows': midfielder_rows,
+        'midfielder_stats': midfielder_stats,
+        'scatter_pca': scatter_pca,
+    }
+    return PlayerDataset(meta, arrays)
+
+
+def _update_cohort(dataset, matrix, midfielder_rows, rows, before, after, n_old):
+    """Midfielder (min, max, mean), running totals and scatter PCA after rows changed"""
+    totals = _running_totals(dataset)
+    is_midfielder = np.isin(rows, midfielder_rows)
+    was_midfielder = is_midfielder & (rows < n_old)
+    old = np.where(was_midfielder, before, np.nan)[:, is_midfielder]
+    new = after[:, is_midfielder]
+
+    with span('ingest_cohort'), np.errstate(all='ignore'):
+        minimum, maximum, mean = (dataset.midfielder_stats[i].astype(np.float64) for i in range(3))
+        counts = np.asarray(totals['midfielder_counts'], dtype=np.float64)
+        sums = np.where(counts > 0, mean, 0) * counts
+        counts = counts + np.isfinite(new).sum(axis=1) - np.isfinite(old).sum(axis=1)
+        sums = sums + np.nansum(new, axis=1) - np.nansum(old, axis=1)
+        mean = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+        # A player who held the min or max and moved inward (or lost the value) forces a rescan of that metric
+        rescan_min = ((old == minimum[:, None]) & ~(new <= old)).any(axis=1)
+        rescan_max = ((old == maximum[:, None]) & ~(new >= old)).any(axis=1)
+        if new.shape[1]:
+            minimum = np.fmin(minimum, np.nanmin(np.where(np.isfinite(new), new, np.inf), axis=1))
+            maximum = np.fmax(maximum, np.nanmax(np.where(np.isfinite(new), new, -np.inf), axis=1))
+        minimum[np.isinf(minimum)] = np.nan
+        maximum[np.isinf(maximum)] = np.nan
+        for i in np.flatnonzero(rescan_min | rescan_max):
+            values = matrix[i, midfielder_rows]
+            minimum[i] = np.nanmin(values) if np.isfinite(values).any() else np.nan
+            maximum[i] = np.nanmax(values) if np.isfinite(values).any() else np.nan
+        midfielder_stats = np.vstack([minimum, maximum, mean]).astype(np.float32)
+
+    running = {'midfielder_counts': counts.astype(np.int64).tolist(), 'scatter': {}}
+    scatter, variance = [], {}
+    with span('ingest_pca'):
+        for c, (component, scatter_metrics) in enumerate(SCATTER_METRICS.items()):
+            index = [dataset.metric_index[m] for m in scatter_metrics]
+            moments = totals['scatter'][component]
+            x_old = np.nan_to_num(old[index]).T[was_midfielder[is_midfielder]]
+            x_new = np.nan_to_num(new[index]).T
+            count = moments['n'] + len(x_new) - len(x_old)
+            total = np.asarray(moments['sum']) + x_new.sum(axis=0) - x_old.sum(axis=0)
+            products = np.asarray(moments['products']) + x_new.T @ x_new - x_old.T @ x_old
+            running['scatter'][component] = {'n': int(count), 'sum': total.tolist(), 'products': products.tolist()}
+
+            # PCA of the standardized inputs (StandardScaler + PCA(1)) from the moments
+            centre = total / count
+            covariance = products / count - np.outer(centre, centre)
+            std = np.sqrt(np.clip(np.diag(covariance), 0, None))
+            scale = np.where(std > 1e-12, std, 1.0)
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance / np.outer(scale, scale))
+            component_vector = eigenvectors[:, -1]
+            x = np.nan_to_num(matrix[index][:, midfielder_rows].astype(np.float64)).T
+            projection = (x - centre) / scale @ component_vector
+
+            # Keep the axis pointing the same way as the previous version
+            previous = np.asarray(dataset.scatter_pca[c], dtype=np.float64)
+            if previous.size and projection[:len(previous)] @ previous < 0:
+                projection = -projection
+            scatter.append(projection)
+            total_variance = np.clip(eigenvalues, 0, None).sum()
+            variance[component] = float(eigenvalues[-1] / total_variance) if total_variance > 0 else 0.0
+
+    return midfielder_stats, running, np.vstack(scatter).astype(np.float32), variance
+
+
+def write_snapshot(dataset, directory):
+    """Replace the partition's snapshot with dataset"""
+    staging = directory + f'.{os.getpid()}.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    dataset.save(staging)
+    if os.path.exists(directory):
+        retired = directory + f'.{os.getpid()}.old'
+        os.rename(directory, retired)
+        os.rename(staging, directory)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        os.rename(staging, directory)
+
+
+def _update_manifest_players(store, key, names):
+    """Add new player names to the partition's manifest entry"""
+    with open(store.manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    for partition in manifest['partitions']:
+        if (str(partition['league']).upper(), str(partition['season'])) == key:
+            known = set(partition.get('players', []))
+            added = {normalize_player_name(name) for name in names} - known
+            if not added:
+                return
+            partition['players'] = sorted(known | added)
+    tmp = store.manifest_path + f'.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    os.replace(tmp, store.manifest_path)
+
+
+def _current_dataset(store, key):
+    """Latest aggregates of a partition, or None if there are none yet"""
+    data = store.read_partition(key)
+    if data is None or isinstance(data, PlayerDataset):
+        return data
+    if len(data) == 0:
+        return None
+    return PlayerDataset.from_frame(data, new_version())
+
+
+def _publish(store, key, dataset, new_players):
+    write_snapshot(dataset, store.snapshot_dir(key))
+    if new_players:
+        _update_manifest_players(store, key, new_players)
+    publish_dataset(dataset, store.segment_dir(key), store.source_stamp(key))
+
+
+def ingest(league, season, frame, matchweek=None, manifest_path=MANIFEST_FILE):
+    """Add one matchweek of match rows to a partition; returns the new dataset"""
+    store = PartitionStore(manifest_path)
+    key = store.resolve_key(league, season)
+    matches = MatchStore(store.match_dir(key))
+
+    if matchweek is None:
+        if 'matchweek' not in frame.columns or frame['matchweek'].nunique() != 1:
+            raise ValueError("Pass --matchweek or a single-valued matchweek column")
+        matchweek = int(frame['matchweek'].iloc[0])
+
+    started = time.perf_counter()
+    current = _current_dataset(store, key)
+    if current is None:
+        # Nothing to add to yet: the partition is built from its match rows
+        matches.write(matchweek, frame)
+        return rebuild(league, season, manifest_path)
+
+    check_match_rows(frame, current.metrics)
+    previous = matches.read(matchweek)
+    with span('ingest_delta'):
+        delta = matchweek_delta(frame, previous, current.metrics)
+
+    # The match rows are stored first: they are the source of truth that rebuild replays
+    matches.write(matchweek, frame)
+    dataset = apply_delta(current, delta, new_version(), league=key[0], season=key[1])
+    _publish(store, key, dataset, dataset.players[len(current):])
+    print(f"Ingested matchweek {matchweek} of {key[0]} {key[1]}: {len(frame)} match rows, "
+          f"{len(delta)} players updated, {len(dataset) - len(current)} new, "
+          f"{time.perf_counter() - started:.2f}s")
+    return dataset
+
+
+def _keep_source_rates(block, metric_index, keys, base, rows):
+    """
+    Put the source file's 90s, per-90 and rate values back for players without
+    match rows: FBref rounds them, and an incremental ingest only recomputes
+    those of the players in a matchweek
+    """
+    import pandas as pd
+
+    played = set() if rows is None else set(zip(rows['player'].astype(str), rows['team'].astype(str)))
+    kept = [i for i, key in enumerate(keys) if key not in played]
+    columns = [c for c in list(NINETIES_COLUMNS) + list(RATE_COLUMNS) if c in metric_index and c in base.columns]
+    if not kept or not columns:
+        return
+    source = base.set_index([base['player'].astype(str), base['team'].astype(str)])
+    source = source[~source.index.duplicated(keep='last')]
+    values = source[columns].reindex(pd.MultiIndex.from_tuples([keys[i] for i in kept]))
+    for column in columns:
+        block[metric_index[column], kept] = values[column].to_numpy(dtype=np.float64)
+
+
+def rebuild(league, season, manifest_path=MANIFEST_FILE):
+    """Recompute a partition from its source file and every stored matchweek"""
+    store = PartitionStore(manifest_path)
+    key = store.resolve_key(league, season)
+    dataset = rebuild_dataset(store, key)
+    _publish(store, key, dataset, dataset.players)
+    print(f"Rebuilt {key[0]} {key[1]} from {len(MatchStore(store.match_dir(key)).matchweeks())} matchweeks: "
+          f"{len(dataset)} players")
+    return dataset
+
+
+def rebuild_dataset(store, key):
+    """The dataset rebuild() publishes, without writing or publishing it"""
+    import pandas as pd
+
+    matches = MatchStore(store.match_dir(key))
+
+    base = read_player_excel(store.source_path(key))
+    rows = matches.rows()
+    frames = [f for f in (base, rows) if f is not None and len(f)]
+    if not frames:
+        raise ValueError(f"No data for {key[0]} {key[1]}")
+
+    # The source file's header fixes the column layout (for a new season it may be all there is);
+    # its season totals count as one more match per player
+    template = base if base is not None and len(base.columns) else rows
+    labels = set(CATEGORICAL_COLUMNS) | set(KEY_COLUMNS) | set(MATCH_COLUMNS)
+    metrics = [c for c in template.columns if c not in labels]
+    if rows is not None:
+        check_match_rows(rows, metrics)
+
+    with span('ingest_rebuild'):
+        totals = aggregate_matches(pd.concat(frames, ignore_index=True), metrics)
+        metric_index = {metric: i for i, metric in enumerate(metrics)}
+        block = np.full((len(metrics), len(totals)), np.nan)
+        for column in counting_columns(metrics):
+            if column in totals.columns:
+                block[metric_index[column]] = totals[column].to_numpy(dtype=np.float64)
+        for column, weight in WEIGHTED_COLUMNS.items():
+            if f'{column}*{weight}' in totals.columns and column in metric_index:
+                shots = block[metric_index[weight]]
+                with np.errstate(all='ignore'):
+                    block[metric_index[column]] = np.where(
+                        shots > 0, totals[f'{column}*{weight}'].to_numpy(dtype=np.float64) / shots, np.nan)
+        for column in STATIC_COLUMNS:
+            if column in totals.columns and column in metric_index:
+                block[metric_index[column]] = totals[column].to_numpy(dtype=np.float64)
+        derive_columns(block, metric_index)
+        if base is not None and len(base):
+            _keep_source_rates(block, metric_index, totals.index, base, rows)
+
+        frame = pd.DataFrame({'player': [k[0] for k in totals.index], 'team': [k[1] for k in totals.index]})
+        defaults = {'Season': key[1], 'league': key[0]}
+        for column in CATEGORICAL_COLUMNS:
+            if column == 'team':
+                continue
+            if column in totals.columns:
+                frame[column] = totals[column].to_numpy(dtype=object)
+                frame[column] = frame[column].where(frame[column].notna(), defaults.get(column))
+            else:
+                frame[column] = defaults.get(column)
+            frame[column] = frame[column].astype(object)
+        frame = pd.concat([frame, pd.DataFrame(block.T, columns=metrics)], axis=1)
+
+    return PlayerDataset.from_frame(frame, new_version())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--manifest', default=MANIFEST_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = commands.add_parser('ingest', help='add one matchweek of per-match rows')
+    ingest_parser.add_argument('league')
+    ingest_parser.add_argument('season')
+    ingest_parser.add_argument('file', help='CSV or Excel file with one row per player and match')
+    ingest_parser.add_argument('--matchweek', type=int)
+
+    rebuild_parser = commands.add_parser('rebuild', help='recompute a partition from every stored matchweek')
+    rebuild_parser.add_argument('league')
+    rebuild_parser.add_argument('season')
+
+    args = parser.parse_args(argv)
+    if args.command == 'ingest':
+        frame = read_player_excel(args.file)
+        if frame is None:
+            raise SystemExit(f"Could not read {args.file}")
+        ingest(args.league, args.season, frame, args.matchweek, args.manifest)
+    else:
+        rebuild(args.league, args.season, args.manifest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Request and phase instrumentation shared by both backends.
+
+init_app() records a latency histogram per route and an in-flight gauge,
+serves everything in the Prometheus text format on /metrics and adds a
+Server-Timing header that breaks each response down into the phases timed
+with span() (data load, DB query, PCA fit, scrape, JSON encode, ...).
+Metrics are kept per process; under gunicorn every worker reports its own.
+Cache, single-flight and other component stats are read at scrape time from
+the collectors registered with register_collector().
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Counters, gauges and histograms keyed by metric name and label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # name -> {labels: value}
+        self._gauges = {}
+        self._histograms = {}   # name -> {labels: Histogram}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def add_gauge(self, name, amount, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def register_collector(self, collector):
+        """collector() returns [(name, type, help, [(labels dict, value), ...]), ...]"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, help_text=None):
+            help_text = help_text or self._help.get(name)
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                header(name, 'counter')
+                for key, value in sorted(series.items()):
+                    lines.append(f'{name}{_labels(key)} {_number(value)}')
+            for name, series in sorted(self._gauges.items()):
+                header(name, 'gauge')
+                for key, value in sorted(series.items()):
+                    lines.append(f'{name}{_labels(key)} {_number(value)}')
+            for name, series in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{_labels(key + (("le", _number(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{_labels(key + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{_labels(key)} {_number(histogram.sum)}')
+                    lines.append(f'{name}_count{_labels(key)} {histogram.count}')
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                header(name, kind, help_text)
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key):
+    if not key:
+        return ''
+    pairs = (
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in key
+    )
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+registry.describe('quantifico_request_duration_seconds',
+                  'Time to produce a response per route (time to first byte for streams)')
+registry.describe('quantifico_requests_total', 'Requests per route and status')
+registry.describe('quantifico_requests_in_flight', 'Requests currently being handled')
+registry.describe('quantifico_phase_duration_seconds', 'Time spent in internal phases')
+register_collector = registry.register_collector
+
+
+@contextmanager
+def span(phase):
+    """Time a phase; it is added to the phase histogram and the Server-Timing header"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('quantifico_phase_duration_seconds', elapsed, phase=phase)
+        if has_request_context():
+            spans = g.setdefault('spans', {})
+            total, calls = spans.get(phase, (0.0, 0))
+            spans[phase] = (total + elapsed, calls + 1)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with encoding timed as the json_encode phase"""
+
+    def dumps(self, obj, **kwargs):
+        with span('json_encode'):
+            return super().dumps(obj, **kwargs)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _server_timing(spans, total):
+    entries = []
+    for phase, (elapsed, calls) in spans.items():
+        desc = f';desc="{calls} calls"' if calls > 1 else ''
+        entries.append(f'{phase}{desc};dur={elapsed * 1000:.1f}')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def init_app(app):
+    """Instrument every route of app and serve /metrics"""
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.in_flight_route = _route()
+        registry.add_gauge('quantifico_requests_in_flight', 1, route=g.in_flight_route)
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = _route()
+        registry.observe('quantifico_request_duration_seconds', elapsed, route=route, method=request.method)
+        registry.inc('quantifico_requests_total', route=route, method=request.method, status=response.status_code)
+        response.headers['Server-Timing'] = _server_timing(g.get('spans', {}), elapsed)
+        response.headers['Timing-Allow-Origin'] = '*'
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        route = g.pop('in_flight_route', None)
+        if route is not None:
+            registry.add_gauge('quantifico_requests_in_flight', -1, route=route)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+def _component_metrics():
+    # Imported here so the modules below can import instrumentation themselves
+    from cache import all_caches
+    from single_flight import all_flights
+
+    caches = all_caches()
+    families = [
+        ('quantifico_cache_hits_total', 'counter', 'Cache hits per cache',
+         [({'cache': c.name}, c.hits) for c in caches]),
+        ('quantifico_cache_misses_total', 'counter', 'Cache misses per cache',
+         [({'cache': c.name}, c.misses) for c in caches]),
+        ('quantifico_cache_entries', 'gauge', 'Entries held per cache',
+         [({'cache': c.name}, c.stats()['entries']) for c in caches]),
+    ]
+
+    calls, coalesced, executions = [], [], []
+    for flight in all_flights():
+        for group, counters in flight.stats().items():
+            labels = {'flight': flight.name, 'group': group}
+            calls.append((labels, counters['calls']))
+            coalesced.append((labels, counters['coalesced']))
+            executions.append((labels, counters['executions']))
+    families += [
+        ('quantifico_single_flight_calls_total', 'counter', 'Calls through single-flight', calls),
+        ('quantifico_single_flight_coalesced_total', 'counter', 'Calls that joined an in-flight execution', coalesced),
+        ('quantifico_single_flight_executions_total', 'counter', 'Executions actually run', executions),
+    ]
+    return families
+
+
+register_collector(_component_metrics)
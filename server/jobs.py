@@ -0,0 +1,195 @@
+"""
+Background jobs for slow work such as season heatmap scrapes.
+
+Jobs run on a bounded thread pool that is separate from the request threads.
+Submitting work under a key that already has a queued or running job returns
+that job, so repeated clicks do not enqueue duplicate scrapes. Progress is
+exposed through /api/jobs/<job_id> for polling and /api/jobs/<job_id>/events
+as a Server-Sent Events stream.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, Response, jsonify, stream_with_context
+
+from instrumentation import register_collector
+
+JOB_CONFIG = {
+    'max_workers': int(os.getenv('QUANTIFICO_JOB_WORKERS', 2)),
+    'ttl': int(os.getenv('QUANTIFICO_JOB_TTL', 600)),   # Seconds finished jobs stay queryable
+    'keepalive': 15,                                    # Seconds between SSE keep-alive comments
+}
+
+
+class Job:
+    def __init__(self, key, result_url=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.result_url = result_url
+        self.status = 'queued'
+        self.progress = {'completed': 0, 'total': None, 'message': None}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.revision = 0
+        self._changed = threading.Condition()
+        self._listeners = []
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def _touch(self):
+        with self._changed:
+            self.revision += 1
+            self._changed.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def subscribe(self, listener):
+        """Call listener() (from the job's thread) after every change, e.g. to wake an event loop"""
+        with self._changed:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._changed:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def update_progress(self, completed, total=None, message=None):
+        self.progress = {'completed': completed, 'total': total, 'message': message}
+        self._touch()
+
+    def wait_for_change(self, revision, timeout):
+        """Block until the job moves past revision or timeout elapses"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.revision != revision, timeout=timeout)
+            return self.revision
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result_url': self.result_url,
+            'status_url': f'/api/jobs/{self.id}',
+            'events_url': f'/api/jobs/{self.id}/events',
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or JOB_CONFIG['max_workers'],
+            thread_name_prefix='quantifico-job'
+        )
+        self._jobs = {}
+        self._active = {}   # key -> job while queued or running
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, result_url=None, **kwargs):
+        """Run fn(job, *args, **kwargs) in the background unless key is already in flight"""
+        with self._lock:
+            self._prune()
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            job = Job(key, result_url)
+            self._jobs[job.id] = job
+            self._active[key] = job
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        job._touch()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            print(traceback.format_exc())
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop(job.key, None)
+            job._touch()
+
+    def _prune(self):
+        cutoff = time.time() - JOB_CONFIG['ttl']
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._active),
+                'tracked': len(self._jobs),
+            }
+
+
+job_manager = JobManager()
+
+register_collector(lambda: [
+    ('quantifico_jobs_active', 'gauge', 'Background jobs queued or running',
+     [({}, job_manager.stats()['active'])]),
+    ('quantifico_jobs_tracked', 'gauge', 'Background jobs still queryable',
+     [({}, job_manager.stats()['tracked'])]),
+])
+
+jobs_blueprint = Blueprint('jobs', __name__)
+
+
+@jobs_blueprint.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+@jobs_blueprint.route('/api/jobs/<job_id>/events')
+def stream_job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def events():
+        revision = -1
+        while True:
+            current = job.wait_for_change(revision, JOB_CONFIG['keepalive'])
+            if current == revision:
+                yield ': keep-alive\n\n'
+                continue
+            revision = current
+            event = job.status if job.finished else 'progress'
+            yield f"event: {event}\ndata: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
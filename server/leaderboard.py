@@ -0,0 +1,149 @@
+"""
+Top-k leaderboards over any metric, with cursor pagination.
+
+Excel backend: each partition's FilterIndex (filtering.py) keeps the metric's
+argsort order per data version, so a page walks that order from the cursor
+position, testing growing chunks of it against the position/team/minutes
+filters until it has `limit` players. A page costs about limit / selectivity
+lookups, not a sort. Several seasons are combined with a k-way merge of the
+per-partition orders, and the cursor records how far each has been read.
+
+PostgreSQL backend: keyset pagination, ORDER BY the metric and player_id
+with the cursor holding the last (value, player_id) seen.
+
+Cursors are opaque: base64 JSON holding where to resume, the data versions
+they refer to and a fingerprint of the query, so a cursor cannot be replayed
+against other filters or newer data.
+"""
+import base64
+import binascii
+import hashlib
+import heapq
+import json
+
+import numpy as np
+
+from admission import check_deadline
+from filtering import get_filter_index, parse_category_args
+
+
+LEADERBOARD_CONFIG = {
+    'limit': 20,
+    'max_limit': 200,
+    'chunk': 256,   # First slice of the sorted order checked against the filters; doubles per pass
+}
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_leaderboard_args(args):
+    """Normalized query (metric, per90, order, limit, categories, min_minutes); ValueError on bad input"""
+    metric = args.get('metric')
+    if not metric:
+        raise ValueError("Pass the metric to rank by as ?metric=")
+    order = args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+
+    categories = parse_category_args(args)
+    min_minutes = args.get('min_minutes')
+    return {
+        'metric': metric,
+        'per90': args.get('per90', '').lower() in ('1', 'true', 'yes'),
+        'order': order,
+        'limit': min(max(int(args.get('limit', LEADERBOARD_CONFIG['limit'])), 1), LEADERBOARD_CONFIG['max_limit']),
+        'categories': categories,
+        'min_minutes': float(min_minutes) if min_minutes not in (None, '') else None,
+    }
+
+
+def query_fingerprint(query, partitions):
+    """Short hash of everything that defines the ranking (not the page size)"""
+    key = {name: value for name, value in query.items() if name != 'limit'}
+    key['partitions'] = sorted(partitions)
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def encode_cursor(fingerprint, position, versions, rank):
+    """position is whatever the backend resumes from: sorted-order offsets or a keyset"""
+    payload = {'q': fingerprint, 'p': position, 'v': versions, 'r': rank}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fingerprint, versions):
+    """(position, rank reached) from a cursor; InvalidCursor if it is malformed or stale"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        position = payload['p']
+        rank = int(payload['r'])
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidCursor("Malformed cursor")
+    if payload.get('q') != fingerprint:
+        raise InvalidCursor("Cursor belongs to a different leaderboard query")
+    if payload.get('v') != versions:
+        raise InvalidCursor("The data changed since this cursor was issued; start from the first page")
+    return position, rank
+
+
+def _ranked(index, label, query, test, start):
+    """
+    (sort key, label, position, row, value) for rows passing test, in ranking
+    order from position start; positions index the metric's sorted order
+    """
+    order, ordered, finite = index.sorted_column(query['metric'], query['per90'])
+    descending = query['order'] == 'desc'
+    position = start
+    chunk = LEADERBOARD_CONFIG['chunk']
+    while position < finite:
+        check_deadline()
+        stop = min(position + chunk, finite)
+        positions = np.arange(position, stop)
+        sorted_positions = finite - 1 - positions if descending else positions
+        rows = order[sorted_positions]
+        keep = test(rows)
+        for p, s, row in zip(positions[keep], sorted_positions[keep], rows[keep]):
+            value = float(ordered[s])
+            yield (-value if descending else value, label, int(p), int(row), value)
+        position = stop
+        chunk *= 2
+
+
+def leaderboard_page(datasets, query, cursor=None):
+    """
+    One page of the leaderboard across datasets ({label: PlayerDataset}).
+    Returns (entries, next_cursor); entries are (rank, label, dataset, row, value).
+    """
+    versions = {label: dataset.version for label, dataset in datasets.items()}
+    fingerprint = query_fingerprint(query, datasets)
+    if cursor:
+        positions, rank = decode_cursor(cursor, fingerprint, versions)
+        try:
+            positions = {label: int(position) for label, position in positions.items()}
+        except (AttributeError, TypeError, ValueError):
+            raise InvalidCursor("Malformed cursor")
+    else:
+        positions, rank = {label: 0 for label in datasets}, 0
+
+    streams = []
+    for label, dataset in datasets.items():
+        if not dataset.has_metric(query['metric']):
+            raise ValueError(f"Unknown metric: {query['metric']}")
+        index = get_filter_index(dataset)
+        ranges = {}
+        if query['min_minutes'] is not None:
+            ranges['Playing Time_Min'] = (query['min_minutes'], None)
+        test = index.row_test(ranges, query['categories'])
+        streams.append(_ranked(index, label, query, test, positions.get(label, 0)))
+
+    entries = []
+    for _, label, position, row, value in heapq.merge(*streams):
+        rank += 1
+        entries.append((rank, label, datasets[label], row, value))
+        positions[label] = position + 1
+        if len(entries) == query['limit']:
+            break
+
+    # A page shorter than the limit means every stream is exhausted
+    next_cursor = encode_cursor(fingerprint, positions, versions, rank) if len(entries) == query['limit'] else None
+    return entries, next_cursor
@@ -0,0 +1,251 @@
+"""
+League/season partitioned player data.
+
+data/manifest.json lists one partition per league-season with its source
+file, the Sofascore identifiers used for heatmaps and the normalized names of
+the players it contains. Partitions are loaded (through the shared-memory
+segments in shared_dataset.py) on first use and evicted least-recently-used
+once the resident partitions exceed a memory budget; the segment of an
+evicted partition is deleted once no worker has it mapped. Because the manifest
+knows which players live where, cross-partition queries only touch the
+partitions that actually contain the player.
+
+Partitions updated by matchweek ingestion (ingestion.py) keep their per-match
+rows and a snapshot of the current aggregates under matches/<league>-<season>/
+next to the manifest; the snapshot is loaded instead of the source file.
+"""
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+from dataset import DATASET_LAYOUT, PlayerDataset, read_player_excel
+from player_ids import normalize_player_name, player_slug
+from shared_dataset import (SHARED_DATA_CONFIG, detach_shared_dataset, get_shared_dataset, publish_dataset,
+                            remove_unmapped_segment, source_stamp)
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# QUANTIFICO_MANIFEST points the servers at another data set, e.g. one written
+# by synthetic.py; partition files are resolved relative to the manifest
+MANIFEST_FILE = os.getenv('QUANTIFICO_MANIFEST', os.path.join(DATA_DIR, 'manifest.json'))
+
+PARTITION_CONFIG = {
+    # Budget for resident partitions; the least recently used ones are evicted first
+    'memory_budget': int(float(os.getenv('QUANTIFICO_PARTITION_BUDGET_MB', 512)) * 1024 * 1024),
+}
+
+
+class UnknownPartition(LookupError):
+    pass
+
+
+def load_manifest(path=MANIFEST_FILE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def partition_key(league, season):
+    return (str(league).upper(), str(season))
+
+
+def _season_slug(season):
+    return str(season).replace('/', '')
+
+
+class PartitionStore:
+    """Lazily loaded, LRU-evicted league/season partitions"""
+
+    def __init__(self, manifest_path=MANIFEST_FILE):
+        self.manifest_path = os.path.abspath(manifest_path)
+        self._resident = OrderedDict()   # key -> (dataset, bytes)
+        self._lock = threading.Lock()
+        self._load_manifest()
+
+    def _load_manifest(self):
+        self.manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+        manifest = load_manifest(self.manifest_path)
+        self.default = partition_key(manifest['default']['league'], manifest['default']['season'])
+        self.partitions = {
+            partition_key(p['league'], p['season']): p for p in manifest['partitions']
+        }
+        # Normalized player name -> partitions containing that player
+        self.player_partitions = {}
+        for key, partition in self.partitions.items():
+            for name in partition.get('players', []):
+                # Normalized again: lists written before a change to normalize_player_name still match
+                self.player_partitions.setdefault(normalize_player_name(name), []).append(key)
+
+    def _check_manifest(self):
+        """Pick up player lists rewritten by an ingestion run"""
+        try:
+            if os.stat(self.manifest_path).st_mtime_ns != self.manifest_mtime:
+                self._load_manifest()
+        except (OSError, ValueError) as e:
+            print(f"Error reloading manifest: {e}")
+
+    def resolve_key(self, league=None, season=None):
+        league = league or self.default[0]
+        season = season or self.default[1]
+        key = partition_key(league, season)
+        if key not in self.partitions:
+            raise UnknownPartition(f"No data for league {league}, season {season}")
+        return key
+
+    def select(self, league=None, season=None):
+        """
+        Partition keys for league/season parameters that may also be 'all' or
+        comma-separated lists; missing values fall back to the default partition
+        """
+        def values(value, default):
+            if value and value.lower() == 'all':
+                return None
+            return [v.strip() for v in value.split(',') if v.strip()] if value else [default]
+
+        leagues = values(league, self.default[0])
+        seasons = values(season, self.default[1])
+        if leagues is not None and seasons is not None:
+            return [self.resolve_key(l, s) for l in leagues for s in seasons]
+
+        keys = [
+            key for key in self.partitions
+            if (leagues is None or key[0] in {partition_key(l, '')[0] for l in leagues})
+            and (seasons is None or key[1] in seasons)
+        ]
+        if not keys:
+            raise UnknownPartition(f"No data for league {league}, season {season}")
+        return sorted(keys, key=lambda key: (key[0], _season_slug(key[1])))
+
+    def info(self, key):
+        return self.partitions[key]
+
+    def segment_dir(self, key):
+        league, season = key
+        return os.path.join(SHARED_DATA_CONFIG['dir'], f'{league.lower()}-{_season_slug(season)}')
+
+    def source_path(self, key):
+        return os.path.join(os.path.dirname(self.manifest_path), self.partitions[key]['file'])
+
+    def match_dir(self, key):
+        """Per-match rows and aggregate snapshot of an ingested partition"""
+        league, season = key
+        return os.path.join(os.path.dirname(self.manifest_path), 'matches',
+                            f'{league.lower()}-{_season_slug(season)}')
+
+    def snapshot_dir(self, key):
+        return os.path.join(self.match_dir(key), 'snapshot')
+
+    def _source_file(self, key):
+        snapshot_meta = os.path.join(self.snapshot_dir(key), 'meta.json')
+        return snapshot_meta if os.path.exists(snapshot_meta) else self.source_path(key)
+
+    def source_stamp(self, key):
+        """Stamp of the file read_partition() reads, recorded with every published version"""
+        return source_stamp(self._source_file(key))
+
+    def read_partition(self, key):
+        """The latest ingested snapshot (a PlayerDataset) if there is one, else the source frame"""
+        snapshot = self.snapshot_dir(key)
+        if os.path.exists(os.path.join(snapshot, 'meta.json')):
+            print(f"Loading ingested snapshot from: {snapshot}")
+            dataset = PlayerDataset.load(snapshot)
+            if dataset.layout == DATASET_LAYOUT:
+                return dataset
+            # Saved by an older version of the server: replay the stored matchweeks instead
+            from ingestion import rebuild_dataset, write_snapshot
+            print(f"Snapshot layout {dataset.layout} is not {DATASET_LAYOUT}; rebuilding {key[0]} {key[1]}")
+            dataset = rebuild_dataset(self, key)
+            write_snapshot(dataset, snapshot)
+            return dataset
+        return read_player_excel(self.source_path(key))
+
+    def get(self, league=None, season=None):
+        """Dataset for a partition, loading it on first use"""
+        key = self.resolve_key(league, season)
+        dataset = get_shared_dataset(lambda: self.read_partition(key), self.segment_dir(key),
+                                     lambda: self.source_stamp(key))
+        if dataset is None:
+            return None
+
+        with self._lock:
+            resident = self._resident.get(key)
+            if resident is None or resident[0] is not dataset:
+                self._resident[key] = (dataset, dataset.memory_usage()['total'])
+            self._resident.move_to_end(key)
+            self._evict(keep=key)
+        return dataset
+
+    def _evict(self, keep):
+        used = sum(size for _, size in self._resident.values())
+        for key in list(self._resident):
+            if used <= PARTITION_CONFIG['memory_budget']:
+                break
+            if key == keep:
+                continue
+            used -= self._resident.pop(key)[1]
+            detach_shared_dataset(self.segment_dir(key))
+            # The last worker to evict it frees the tmpfs pages; a later get() republishes it
+            removed = remove_unmapped_segment(self.segment_dir(key))
+            print(f"Evicted partition {key[0]} {key[1]}" + (" and removed its segment" if removed else ""))
+
+    def resident(self):
+        with self._lock:
+            return list(self._resident)
+
+    def partitions_for_player(self, player_name):
+        """Partitions whose manifest lists this player, oldest season first"""
+        self._check_manifest()
+        keys = self.player_partitions.get(normalize_player_name(player_name), [])
+        return sorted(keys, key=lambda key: (_season_slug(key[1]), key[0]))
+
+    def partitions_for_id(self, player_id):
+        """Partitions whose season matches the season part of a player id"""
+        return [
+            key for key in self.partitions
+            if re.search(rf'-{re.escape(player_slug(key[1]))}(-\d+)?$', player_id)
+        ]
+
+    def publish(self, league=None, season=None):
+        """Publish a partition to shared memory, e.g. from the gunicorn master"""
+        key = self.resolve_key(league, season)
+        data = self.read_partition(key)
+        if data is not None:
+            publish_dataset(data, self.segment_dir(key), self.source_stamp(key))
+
+
+def refresh_manifest_players(path=MANIFEST_FILE):
+    """Rewrite the per-partition player lists from the partition files"""
+    manifest = load_manifest(path)
+    store = PartitionStore(path)
+    for partition in manifest['partitions']:
+        data = store.read_partition(partition_key(partition['league'], partition['season']))
+        if data is not None:
+            names = data.players if isinstance(data, PlayerDataset) else data['player']
+            partition['players'] = sorted({normalize_player_name(n) for n in names})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+_store = {'store': None}
+_store_lock = threading.Lock()
+
+
+def get_partition_store():
+    if _store['store'] is None:
+        with _store_lock:
+            if _store['store'] is None:
+                _store['store'] = PartitionStore()
+    return _store['store']
+
+
+if __name__ == '__main__':
+    # python partitions.py manifest            -> refresh manifest player lists
+    # python partitions.py publish [LEAGUE SEASON] -> publish a partition; workers switch over
+    command = sys.argv[1] if len(sys.argv) > 1 else 'publish'
+    if command == 'manifest':
+        refresh_manifest_players()
+    else:
+        get_partition_store().publish(*sys.argv[2:4])
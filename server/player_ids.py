@@ -0,0 +1,91 @@
+"""
+Stable player/season ids shared by both backends.
+
+An id is a URL-safe slug of name, team and season, e.g.
+'bruno-fernandes-manchester-utd-23-24', so it survives data reloads and row
+reordering. PlayerIndex maps ids and normalized names to rows (Excel backend)
+or primary keys (PostgreSQL backend) with constant-time dict lookups.
+"""
+import re
+import unicodedata
+
+
+# Letters NFKD does not decompose into an ASCII letter plus accents
+TRANSLITERATIONS = str.maketrans({
+    'ø': 'o', 'ß': 'ss', 'ð': 'd', 'đ': 'd', 'ł': 'l', 'æ': 'ae', 'œ': 'oe', 'þ': 'th', 'ı': 'i',
+})
+
+
+def normalize_player_name(name):
+    """Case, accent and whitespace insensitive form of a player name ('Martin Ødegaard' -> 'martin odegaard')"""
+    name = unicodedata.normalize('NFKD', str(name).lower().translate(TRANSLITERATIONS))
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    return ' '.join(name.lower().split())
+
+
+def player_slug(name, team=None, season=None):
+    parts = [normalize_player_name(name)]
+    if team:
+        parts.append(normalize_player_name(team))
+    if season:
+        parts.append(str(season))
+    slug = re.sub(r'[^a-z0-9]+', '-', ' '.join(parts)).strip('-')
+    return slug or 'player'
+
+
+def _tie_break(player):
+    """Order of players sharing a slug: exact name, team, birth year (unknown last), then key"""
+    name, team, born, key = player
+    return name, team, born is None, born or 0, key
+
+
+class PlayerIndex:
+    """Hash indexes from id and normalized name to a row key"""
+
+    def __init__(self, entries):
+        """
+        entries: iterable of (key, name, team, season[, born]). Players sharing a
+        slug get -2, -3, ... in _tie_break() order, so their ids do not depend
+        on the order of the rows.
+        """
+        self.id_index = {}
+        self.key_ids = {}
+        self.name_index = {}
+        groups = {}
+        for key, name, team, season, *born in entries:
+            born = born[0] if born and born[0] == born[0] else None   # NaN is unknown
+            groups.setdefault(player_slug(name, team, season), []).append((str(name), str(team), born, key))
+            self.name_index.setdefault(normalize_player_name(name), []).append(key)
+
+        ordered = {slug: sorted(players, key=_tie_break) for slug, players in groups.items()}
+        for slug, players in ordered.items():
+            self._assign(slug, players[0][-1])
+        for slug in sorted(ordered):
+            suffix = 2
+            for *_, key in ordered[slug][1:]:
+                while f'{slug}-{suffix}' in self.id_index:
+                    suffix += 1
+                self._assign(f'{slug}-{suffix}', key)
+
+    def _assign(self, player_id, key):
+        self.id_index[player_id] = key
+        self.key_ids[key] = player_id
+
+    def resolve(self, player_key):
+        """
+        Resolve an id, or a player name for backwards compatibility, to a row
+        key. Names shared by several players resolve to the first one; use the
+        id to pick a specific player/season.
+        """
+        key = self.id_index.get(player_key)
+        if key is not None:
+            return key
+        keys = self.name_index.get(normalize_player_name(player_key))
+        return keys[0] if keys else None
+
+    def id_of(self, key):
+        return self.key_ids.get(key)
+
+    def matches(self, player_name):
+        """Every row key whose player has this name"""
+        return list(self.name_index.get(normalize_player_name(player_name), []))
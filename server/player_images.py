@@ -0,0 +1,261 @@
+"""
+Player images resolved, cached and resized on the server.
+
+The first request for a player asks the lookup provider for an image URL,
+downloads it once and stores it in QUANTIFICO_IMAGE_DIR together with an
+index.json mapping the player to it, so later requests (and restarts) never
+hit the provider again. Thumbnails are rendered at fixed sizes (with Pillow
+when it is installed; the original is served otherwise) and named by their
+content hash, which doubles as the ETag. Responses carry long-lived
+Cache-Control headers and answer If-None-Match with 304.
+
+Providers are picked with QUANTIFICO_IMAGE_PROVIDER:
+  google          Google Custom Search (GOOGLE_API_KEY, GOOGLE_CX)
+  local           files named <player-slug>.<ext> in QUANTIFICO_IMAGE_SOURCE_DIR
+  module:attr     any class or factory returning an object with lookup(name) and fetch(url)
+"""
+import hashlib
+import importlib
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from flask import jsonify, request
+
+from instrumentation import span
+from player_ids import normalize_player_name, player_slug
+from single_flight import SingleFlight
+
+
+IMAGE_CONFIG = {
+    'dir': os.getenv('QUANTIFICO_IMAGE_DIR',
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'player-images')),
+    'provider': os.getenv('QUANTIFICO_IMAGE_PROVIDER', 'google'),
+    'timeout': float(os.getenv('QUANTIFICO_IMAGE_TIMEOUT', 10)),         # Seconds per provider call
+    'max_age': int(os.getenv('QUANTIFICO_IMAGE_MAX_AGE', 7 * 24 * 3600)),  # Browser cache lifetime
+    'retry_missing': int(os.getenv('QUANTIFICO_IMAGE_RETRY', 24 * 3600)),  # Seconds before a miss is looked up again
+    'max_bytes': 10 * 1024 * 1024,
+}
+
+# Longest side in pixels
+THUMBNAIL_SIZES = {'small': 64, 'medium': 150, 'large': 300}
+DEFAULT_SIZE = 'medium'
+
+CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+                 '.webp': 'image/webp', '.gif': 'image/gif'}
+
+
+class GoogleImageProvider:
+    """Google Custom Search image lookups, the query the client used to send"""
+
+    def __init__(self, api_key=None, cx=None):
+        self.api_key = api_key or os.getenv('GOOGLE_API_KEY') or os.getenv('REACT_APP_GOOGLE_API_KEY')
+        self.cx = cx or os.getenv('GOOGLE_CX') or os.getenv('REACT_APP_GOOGLE_CX')
+
+    def lookup(self, player_name):
+        if not self.api_key or not self.cx:
+            print("Player images: GOOGLE_API_KEY / GOOGLE_CX are not set")
+            return None
+        params = urllib.parse.urlencode({
+            'q': f'{player_name} premier league face profile picture transparent background',
+            'searchType': 'image',
+            'imgType': 'photo',
+            'num': 1,
+            'key': self.api_key,
+            'cx': self.cx,
+        })
+        url = f'https://www.googleapis.com/customsearch/v1?{params}'
+        with urllib.request.urlopen(url, timeout=IMAGE_CONFIG['timeout']) as response:
+            items = json.load(response).get('items') or []
+        return items[0]['link'] if items else None
+
+    def fetch(self, url):
+        """(bytes, content type)"""
+        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (quantifico image cache)'})
+        with urllib.request.urlopen(req, timeout=IMAGE_CONFIG['timeout']) as response:
+            data = response.read(IMAGE_CONFIG['max_bytes'] + 1)
+            content_type = response.headers.get_content_type()
+        if len(data) > IMAGE_CONFIG['max_bytes']:
+            raise ValueError(f"Image at {url} is larger than {IMAGE_CONFIG['max_bytes']} bytes")
+        return data, content_type
+
+
+class LocalImageProvider:
+    """Images from a directory of <player-slug>.<ext> files, for tests and offline use"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv('QUANTIFICO_IMAGE_SOURCE_DIR', '.')
+
+    def lookup(self, player_name):
+        slug = player_slug(player_name)
+        for extension in CONTENT_TYPES:
+            path = os.path.join(self.directory, slug + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def fetch(self, path):
+        with open(path, 'rb') as f:
+            return f.read(), CONTENT_TYPES[os.path.splitext(path)[1].lower()]
+
+
+PROVIDERS = {'google': GoogleImageProvider, 'local': LocalImageProvider}
+
+
+def load_provider(spec):
+    if spec in PROVIDERS:
+        return PROVIDERS[spec]()
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+def _extension(content_type):
+    for extension, known in CONTENT_TYPES.items():
+        if known == content_type:
+            return extension
+    return '.img'
+
+
+class PlayerImageCache:
+    """Player -> original image -> thumbnails, persisted under one directory"""
+
+    def __init__(self, directory=None, provider=None):
+        self.directory = directory or IMAGE_CONFIG['dir']
+        self._provider = provider
+        self._lock = threading.Lock()
+        self._flights = SingleFlight('player_images')
+        self._index = None   # normalized name -> entry
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            self._provider = load_provider(IMAGE_CONFIG['provider'])
+        return self._provider
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _load_index(self, reload=False):
+        if self._index is None or reload:
+            try:
+                with open(self._path('index.json'), encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(f'index.json.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self._path('index.json'))
+
+    def _write(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name)
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return path
+
+    def _update(self, key, entry):
+        # Re-read first so entries other worker processes added are kept
+        with self._lock:
+            self._load_index(reload=True)[key] = entry
+            self._save_index()
+
+    def _resolve(self, key, player_name):
+        """Look the player up with the provider and store the original image"""
+        with span('image_lookup'):
+            source = self.provider.lookup(player_name)
+        if not source:
+            entry = {'source': None, 'checked_at': time.time()}
+        else:
+            with span('image_fetch'):
+                data, content_type = self.provider.fetch(source)
+            digest = hashlib.sha1(data).hexdigest()
+            self._write(digest + _extension(content_type), data)
+            entry = {'source': source, 'original': digest + _extension(content_type),
+                     'content_type': content_type, 'thumbnails': {}, 'checked_at': time.time()}
+        self._update(key, entry)
+        return entry
+
+    def entry(self, player_name):
+        """Index entry for a player, resolving it on first use (or after a retry period for misses)"""
+        key = normalize_player_name(player_name)
+        with self._lock:
+            entry = self._load_index().get(key)
+            if entry is None:
+                # Another worker process may have resolved it already
+                entry = self._load_index(reload=True).get(key)
+        stale_miss = (entry is not None and entry['source'] is None
+                      and time.time() - entry['checked_at'] > IMAGE_CONFIG['retry_missing'])
+        if entry is None or stale_miss:
+            entry = self._flights.do(key, lambda: self._resolve(key, player_name), group='resolve')
+        return key, entry
+
+    def _render(self, key, entry, size):
+        """(file name, content type) of a thumbnail, rendering it on first use"""
+        try:
+            from PIL import Image
+        except ImportError:
+            # Without Pillow every size is the original image
+            return entry['original'], entry['content_type']
+
+        with open(self._path(entry['original']), 'rb') as f:
+            original = f.read()
+        with span('image_resize'):
+            image = Image.open(io.BytesIO(original))
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            image.thumbnail((THUMBNAIL_SIZES[size], THUMBNAIL_SIZES[size]), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', optimize=True)
+        data = buffer.getvalue()
+        name = hashlib.sha1(data).hexdigest() + '.png'
+        self._write(name, data)
+        entry = dict(entry, thumbnails={**entry['thumbnails'], size: name})
+        self._update(key, entry)
+        return name, 'image/png'
+
+    def thumbnail(self, player_name, size=DEFAULT_SIZE):
+        """(path, content type, etag) of a player's thumbnail, or None if there is no image"""
+        key, entry = self.entry(player_name)
+        if entry['source'] is None:
+            return None
+        name = entry['thumbnails'].get(size)
+        if name is not None and os.path.exists(self._path(name)):
+            content_type = CONTENT_TYPES.get(os.path.splitext(name)[1], entry['content_type'])
+        else:
+            name, content_type = self._flights.do((key, size), lambda: self._render(key, entry, size), group='resize')
+        return self._path(name), content_type, os.path.splitext(name)[0]
+
+
+image_cache = PlayerImageCache()
+
+
+def player_image_response(app, player_name):
+    """Conditional, cacheable response with the player's thumbnail at ?size="""
+    size = request.args.get('size', DEFAULT_SIZE)
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({'error': f"size must be one of {', '.join(THUMBNAIL_SIZES)}"}), 400
+
+    thumbnail = image_cache.thumbnail(player_name, size)
+    if thumbnail is None:
+        response = jsonify({'error': 'No image found'})
+        response.status_code = 404
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+        return response
+
+    path, content_type, etag = thumbnail
+    with open(path, 'rb') as f:
+        response = app.response_class(f.read(), mimetype=content_type)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={IMAGE_CONFIG['max_age']}"
+    return response.make_conditional(request)
@@ -0,0 +1,57 @@
+"""
+Worker processes for CPU-bound work such as the scatter plot PCA.
+
+A fit holds the GIL for its whole duration, so in a threaded or async server
+it stalls every other request of the process. With QUANTIFICO_CPU_WORKERS
+set, run_cpu_bound() sends the function to a process pool instead and the
+calling thread only waits for the result. Functions and arguments must be
+picklable, and workers are spawned rather than forked, so they import only
+the module that defines the function, not the app.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from startup import prewarm
+
+PROCESS_POOL_CONFIG = {
+    'workers': int(os.getenv('QUANTIFICO_CPU_WORKERS', 0)),   # 0 runs everything in the calling thread
+    'prewarm': 'pandas,sklearn',                               # Imported by every worker at start-up
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """The shared process pool, started on first use; None when it is disabled"""
+    global _executor
+    if PROCESS_POOL_CONFIG['workers'] <= 0:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=PROCESS_POOL_CONFIG['workers'],
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=prewarm,
+                    initargs=(PROCESS_POOL_CONFIG['prewarm'],),
+                )
+    return _executor
+
+
+def run_cpu_bound(fn, *args):
+    """fn(*args), in a worker process when the pool is enabled"""
+    executor = get_executor()
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
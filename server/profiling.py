@@ -0,0 +1,197 @@
+"""
+Opt-in profiling for both backends.
+
+Nothing here is installed unless configured, so a server without
+QUANTIFICO_PROFILE_TOKEN or QUANTIFICO_PROFILE_SAMPLE_HZ runs no extra code.
+
+Per request: send the token in an X-Quantifico-Profile header (or a _profile
+query parameter) and that one request runs under a profiler. The profile is
+written to QUANTIFICO_PROFILE_DIR and its name returned in X-Quantifico-Profile-Id;
+download it from /api/profiles/<name> with the same token. The format is
+chosen with X-Quantifico-Profile-Format / _profile_format:
+  pstats     deterministic cProfile output, for pstats or snakeviz
+  collapsed  sampled stacks ("frame;frame;frame count"), for flamegraph.pl or speedscope
+
+Background: QUANTIFICO_PROFILE_SAMPLE_HZ > 0 samples every thread at that
+rate and writes the aggregated collapsed stacks to disk every
+QUANTIFICO_PROFILE_FLUSH seconds.
+"""
+import cProfile
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import abort, g, request, send_from_directory
+
+PROFILING_CONFIG = {
+    'token': os.getenv('QUANTIFICO_PROFILE_TOKEN'),
+    'dir': os.getenv('QUANTIFICO_PROFILE_DIR', os.path.join('/tmp', 'quantifico-profiles')),
+    'request_interval': float(os.getenv('QUANTIFICO_PROFILE_INTERVAL', 0.001)),   # Seconds between request samples
+    'sample_hz': float(os.getenv('QUANTIFICO_PROFILE_SAMPLE_HZ', 0)),             # Background samples per second
+    'flush': float(os.getenv('QUANTIFICO_PROFILE_FLUSH', 60)),                    # Seconds between background files
+}
+
+FORMATS = ('pstats', 'collapsed')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse_stack(frame):
+    """Root-first 'a;b;c' stack for a frame"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples thread stacks from a daemon thread into collapsed-stack counts"""
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id   # None samples every thread
+        self.counts = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        if self.thread_id is not None:
+            frames = {self.thread_id: frames.get(self.thread_id)}
+        with self._lock:
+            for thread_id, frame in frames.items():
+                if frame is None or thread_id == own:
+                    continue
+                self.counts[collapse_stack(frame)] += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='quantifico-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def drain(self):
+        """Collapsed-stack text for the samples so far, resetting the counts"""
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+def _profile_path(name):
+    os.makedirs(PROFILING_CONFIG['dir'], exist_ok=True)
+    return os.path.join(PROFILING_CONFIG['dir'], name)
+
+
+def _profile_name(extension):
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', route).strip('-') or 'root'
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident() % 100000}-{slug}.{extension}"
+
+
+def _token_ok(token):
+    expected = PROFILING_CONFIG['token']
+    return bool(expected and token) and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def _start_request_profile():
+    token = request.headers.get('X-Quantifico-Profile') or request.args.get('_profile')
+    if not token or not _token_ok(token):
+        return
+    fmt = request.headers.get('X-Quantifico-Profile-Format') or request.args.get('_profile_format') or 'pstats'
+    if fmt not in FORMATS:
+        fmt = 'pstats'
+
+    if fmt == 'pstats':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = StackSampler(PROFILING_CONFIG['request_interval'], threading.get_ident()).start()
+    g.profile = (fmt, profiler)
+
+
+def _finish_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    fmt, profiler = profile
+    name = _profile_name(fmt)
+    try:
+        if fmt == 'pstats':
+            profiler.disable()
+            profiler.dump_stats(_profile_path(name))
+        else:
+            profiler.stop()
+            with open(_profile_path(name), 'w') as f:
+                f.write(profiler.drain())
+        response.headers['X-Quantifico-Profile-Id'] = name
+    except Exception as e:
+        print(f"Could not write profile {name}: {e}")
+    return response
+
+
+def _serve_profile(name):
+    token = request.headers.get('X-Quantifico-Profile') or request.args.get('_profile')
+    if not token or not _token_ok(token):
+        abort(404)
+    return send_from_directory(PROFILING_CONFIG['dir'], name, as_attachment=True)
+
+
+_background = {'sampler': None}
+
+
+def start_background_sampling(hz=None, flush=None):
+    """Sample every thread at hz and write collapsed stacks every flush seconds"""
+    hz = PROFILING_CONFIG['sample_hz'] if hz is None else hz
+    flush = PROFILING_CONFIG['flush'] if flush is None else flush
+    if hz <= 0 or _background['sampler'] is not None:
+        return _background['sampler']
+
+    sampler = StackSampler(1.0 / hz).start()
+    _background['sampler'] = sampler
+
+    def write_periodically():
+        while True:
+            time.sleep(flush)
+            stacks = sampler.drain()
+            if not stacks:
+                continue
+            name = f"background-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.collapsed"
+            try:
+                with open(_profile_path(name), 'w') as f:
+                    f.write(stacks)
+            except Exception as e:
+                print(f"Could not write profile {name}: {e}")
+
+    threading.Thread(target=write_periodically, name='quantifico-profile-writer', daemon=True).start()
+    return sampler
+
+
+def init_profiling(app):
+    """Install the profiling hooks that are configured; a no-op otherwise"""
+    if PROFILING_CONFIG['token']:
+        app.before_request(_start_request_profile)
+        app.after_request(_finish_request_profile)
+        app.add_url_rule('/api/profiles/<path:name>', 'get_profile', _serve_profile)
+    if PROFILING_CONFIG['sample_hz'] > 0:
+        start_background_sampling()
+    return app
@@ -0,0 +1,64 @@
+"""
+Multi-player radar comparison, shared by both backends.
+
+/api/radar/compare normalizes every requested player against the same cohort
+statistics in one array operation, so comparing ten players costs one cohort
+lookup instead of ten /api/radar calls.
+"""
+import os
+
+import numpy as np
+
+
+RADAR_CONFIG = {
+    'max_players': int(os.getenv('QUANTIFICO_RADAR_COMPARE_MAX', 20)),
+}
+
+
+def parse_compare_players(args):
+    """Player keys from ?players=a,b,c (or repeated ?players=); ValueError if none or too many"""
+    players = []
+    for value in args.getlist('players'):
+        players.extend(p.strip() for p in value.split(',') if p.strip())
+    players = list(dict.fromkeys(players))
+    if not players:
+        raise ValueError("Pass the players to compare as ?players=a,b,c")
+    if len(players) > RADAR_CONFIG['max_players']:
+        raise ValueError(f"At most {RADAR_CONFIG['max_players']} players can be compared")
+    return players
+
+
+def _normalize(values, min_vals, max_vals):
+    """0-100 scale per metric (last axis); 50 where a metric does not vary"""
+    span = max_vals - min_vals
+    with np.errstate(all='ignore'):
+        scaled = (values - min_vals) / span * 100
+    return np.where(span == 0, 50.0, scaled)
+
+
+def _rows(matrix):
+    """Nested lists with NaN as None, for JSON"""
+    return [[None if np.isnan(v) else float(v) for v in row] for row in np.atleast_2d(matrix)]
+
+
+def build_compare_payload(players, metrics, values, min_vals, max_vals, avg_vals, not_found=()):
+    """
+    Matrix-shaped radar payload. values is player x metric; min/max/avg are
+    per metric. values[i][j] is player i's normalized value for metrics[j].
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(players), len(metrics))
+    min_vals, max_vals, avg_vals = (np.asarray(v, dtype=np.float64) for v in (min_vals, max_vals, avg_vals))
+
+    return {
+        'metrics': list(metrics),
+        'players': list(players),
+        'values': _rows(_normalize(values, min_vals, max_vals)),
+        'league_average': _rows(_normalize(avg_vals, min_vals, max_vals))[0],
+        'raw_values': {
+            'players': _rows(values),
+            'league_avg': _rows(avg_vals)[0],
+            'min': _rows(min_vals)[0],
+            'max': _rows(max_vals)[0],
+        },
+        'not_found': list(not_found),
+    }
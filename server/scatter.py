@@ -0,0 +1,48 @@
+"""
+Attacking and defensive components of the PostgreSQL scatter plot.
+
+Kept apart from app_postgresql.py so process_pool.py workers can import it
+without creating the Flask app.
+"""
+
+# Columns of the scatter query combined into each axis
+ATTACKING_METRICS = [
+    'sca',                     # SCA
+    'key_passes',              # Key passes
+    'progressive_carries',     # Progressive carries
+    'progressive_passes',      # Progressive passes
+    'xag',                     # xAG/90
+    'npxg',                    # npxG/90
+    'dribbles_completed_pct'   # Take ons success rate
+]
+
+DEFENSIVE_METRICS = [
+    'challenge_tackles_pct',   # Tackles percentage
+    'blocks',                  # Defensive blocks
+    'interceptions',           # Defensive interceptions
+    'tackles'
+]
+
+
+def scatter_components(rows):
+    """
+    ((attacking values, explained variance), (defensive values, explained
+    variance)) of the first principal component of each metric group, for
+    rows of the scatter query as dicts.
+    """
+    # pandas and sklearn are only imported by the code that needs them
+    import pandas as pd
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+
+    df = pd.DataFrame(rows)
+
+    def calculate_pca(metrics):
+        X = df[metrics].fillna(0)
+        X_scaled = StandardScaler().fit_transform(X)
+        pca = PCA(n_components=1)
+        principal_components = pca.fit_transform(X_scaled)
+        return principal_components.flatten().tolist(), float(pca.explained_variance_ratio_[0])
+
+    return calculate_pca(ATTACKING_METRICS), calculate_pca(DEFENSIVE_METRICS)
+
@@ -0,0 +1,274 @@
+"""
+Shared-memory player dataset for pre-fork (gunicorn) deployments.
+
+The master process publishes the compact PlayerDataset (see dataset.py), i.e.
+the numeric player x metric matrix together with its derived indexes, as a
+versioned set of .npy files in a tmpfs directory. Workers memory-map those files read-only, so every worker shares the same
+physical pages instead of holding its own pandas copy. A reload publishes a
+new version and atomically swaps the CURRENT pointer; workers notice the new
+pointer on their next request and re-attach.
+
+Every version records the dataset layout (DATASET_LAYOUT) and a stamp (mtime
+and size) of the file it was built from. A worker attaching to a version
+whose layout or source stamp no longer matches, e.g. a segment left in tmpfs
+by an older server or published before the source file was replaced,
+republishes it from the source instead.
+
+A worker holds a shared flock on <segment dir>.lock while it has the segment
+mapped. remove_unmapped_segment() takes it exclusively, so a segment evicted
+by every worker that used it is deleted from tmpfs instead of filling it up.
+
+Building and publishing a segment holds an exclusive flock on <segment
+dir>.build. A worker that finds nothing current to attach waits for it and
+re-reads CURRENT, so one process builds a partition and the others attach to
+its version instead of publishing copies of their own. Within a worker each
+segment directory has its own lock: a cold load of one partition does not
+hold up requests for the partitions already attached.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # No flock (Windows): segments are never removed
+    fcntl = None
+
+from dataset import DATASET_LAYOUT, PlayerDataset, read_player_excel
+
+
+def _default_shared_dir():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/quantifico'
+    return os.path.join(tempfile.gettempdir(), 'quantifico')
+
+
+SHARED_DATA_CONFIG = {
+    'dir': os.getenv('QUANTIFICO_SHARED_DIR', _default_shared_dir()),
+    'keep_versions': 2,       # Older versions are unlinked after a publish
+    'check_interval': 1.0,    # Seconds between CURRENT pointer checks in a worker
+}
+
+
+def _pointer_path(base_dir):
+    return os.path.join(base_dir, 'CURRENT')
+
+
+def _segment_lock(base_dir, operation, suffix='.lock'):
+    """Open file holding an flock on a segment directory, or None if it is taken or flock is unavailable"""
+    if fcntl is None:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(base_dir)), exist_ok=True)
+    lock = open(os.path.abspath(base_dir) + suffix, 'a')
+    try:
+        fcntl.flock(lock, operation)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def source_stamp(path):
+    """mtime and size of a source file, or None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def _is_current(dataset, source):
+    return dataset.layout == DATASET_LAYOUT and (source is None or dataset.source == source)
+
+
+def new_version():
+    return f"{time.time_ns():x}-{os.getpid()}"
+
+
+def publish_dataset(data, base_dir=None, source=None):
+    """
+    Write data as a new shared version and point CURRENT at it. data is the
+    raw frame, or a PlayerDataset that was already built (e.g. by
+    ingestion.py), which is published under its own version. source is the
+    source_stamp() of the file data was read from.
+    """
+    base_dir = base_dir or SHARED_DATA_CONFIG['dir']
+    # Keeps a worker's remove_unmapped_segment() from deleting the directory mid-write
+    lock = _segment_lock(base_dir, fcntl.LOCK_SH) if fcntl else None
+    build_lock = _segment_lock(base_dir, fcntl.LOCK_EX, '.build') if fcntl else None
+    try:
+        return _publish(data, base_dir, source)
+    finally:
+        for held in (build_lock, lock):
+            if held is not None:
+                held.close()
+
+
+def _publish(data, base_dir, source):
+    os.makedirs(base_dir, exist_ok=True)
+
+    if isinstance(data, PlayerDataset):
+        dataset = data
+    else:
+        dataset = PlayerDataset.from_frame(data, new_version())
+    if source is not None:
+        dataset.source = source
+    version = dataset.version
+
+    target = os.path.join(base_dir, version)
+    if not os.path.isdir(target) or not _is_current(PlayerDataset.load(target), dataset.source):
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=base_dir)
+        dataset.save(staging)
+        # A stale copy of the version is replaced; workers that mapped it keep their pages
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+
+    pointer_tmp = _pointer_path(base_dir) + f'.{os.getpid()}.tmp'
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(pointer_tmp, _pointer_path(base_dir))
+
+    _remove_old_versions(base_dir, version)
+    print(f"Published shared dataset version {version} ({dataset.memory_usage()['total']} bytes)")
+    return version
+
+
+def _remove_old_versions(base_dir, current_version):
+    """Unlink stale versions; workers still attached keep their mapping alive"""
+    versions = sorted(
+        (entry for entry in os.scandir(base_dir)
+         if entry.is_dir() and not entry.name.startswith('.')),
+        key=lambda entry: entry.stat().st_mtime_ns,
+        reverse=True
+    )
+    keep = SHARED_DATA_CONFIG['keep_versions']
+    for entry in versions[keep:]:
+        if entry.name != current_version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# Attached datasets keyed by segment directory (one per data partition),
+# the shared locks telling other workers the segment is mapped, and the
+# thread lock of each segment directory (_attach_lock guards _dir_locks)
+_attached = {}
+_segment_locks = {}
+_dir_locks = {}
+_attach_lock = threading.Lock()
+
+
+def _dir_lock(base_dir):
+    with _attach_lock:
+        return _dir_locks.setdefault(base_dir, threading.Lock())
+
+
+def _read_pointer(base_dir):
+    try:
+        with open(_pointer_path(base_dir), encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _load_current(base_dir, version, source):
+    """The published version, or None if it is missing or stale"""
+    try:
+        dataset = PlayerDataset.load(os.path.join(base_dir, version))
+    except FileNotFoundError:
+        return None
+    if not _is_current(dataset, source):
+        print(f"Shared dataset version {version} is stale (layout {dataset.layout}, source {dataset.source}; "
+              f"expected layout {DATASET_LAYOUT}, source {source}); republishing")
+        return None
+    return dataset
+
+
+def get_shared_dataset(loader=read_player_excel, base_dir=None, source=None):
+    """
+    Return the currently published dataset, attaching or re-attaching as needed.
+    If nothing has been published yet (e.g. running without gunicorn), or the
+    published version is stale, the dataset is built from loader() (a frame or
+    a PlayerDataset) and published from this process. source() returns the
+    source_stamp() the published version must have (None: any).
+    """
+    base_dir = base_dir or SHARED_DATA_CONFIG['dir']
+    dataset, checked_at = _attached.get(base_dir, (None, 0.0))
+    now = time.monotonic()
+    if dataset is not None and now - checked_at < SHARED_DATA_CONFIG['check_interval']:
+        return dataset
+
+    with _dir_lock(base_dir):
+        dataset, _ = _attached.get(base_dir, (None, 0.0))
+        if base_dir not in _segment_locks and fcntl is not None:
+            _segment_locks[base_dir] = _segment_lock(base_dir, fcntl.LOCK_SH)
+        version = _read_pointer(base_dir)
+        attached = None
+        if version is not None and (dataset is None or dataset.version != version):
+            attached = _load_current(base_dir, version, source() if source else None)
+            if attached is None:
+                version = None
+        if version is None:
+            attached = _build(loader, base_dir, source)
+            if attached is None:
+                return dataset
+            version = attached.version
+
+        if attached is not None:
+            dataset = attached
+            usage = dataset.memory_usage()
+            print(f"Attached shared dataset version {version} "
+                  f"({usage['total']} bytes, {usage.get('reduction')}x smaller than the source frame)")
+        _attached[base_dir] = (dataset, now)
+        return dataset
+
+
+def _build(loader, base_dir, source):
+    """
+    Under the build lock: the version another process published while this
+    one waited for it, or a new one built from loader(); None if loader()
+    has no data
+    """
+    build_lock = _segment_lock(base_dir, fcntl.LOCK_EX, '.build') if fcntl else None
+    try:
+        version = _read_pointer(base_dir)
+        if version is not None:
+            dataset = _load_current(base_dir, version, source() if source else None)
+            if dataset is not None:
+                return dataset
+        data = loader()
+        if data is None:
+            return None
+        # Stamped after loading: the loader may have rewritten its source (see PartitionStore.read_partition).
+        # No remove_unmapped_segment() can run meanwhile: this worker holds the segment lock
+        version = _publish(data, base_dir, source() if source else None)
+        return PlayerDataset.load(os.path.join(base_dir, version))
+    finally:
+        if build_lock is not None:
+            build_lock.close()
+
+
+def detach_shared_dataset(base_dir=None):
+    """Drop this worker's mapping of a segment directory"""
+    base_dir = base_dir or SHARED_DATA_CONFIG['dir']
+    with _dir_lock(base_dir):
+        _attached.pop(base_dir, None)
+        lock = _segment_locks.pop(base_dir, None)
+        if lock is not None:
+            lock.close()
+
+
+def remove_unmapped_segment(base_dir):
+    """
+    Delete a segment directory unless a worker still has it mapped (holds its
+    lock); True if it was removed. Requests of this worker still reading the
+    detached dataset keep their pages until they finish.
+    """
+    lock = _segment_lock(base_dir, fcntl.LOCK_EX | fcntl.LOCK_NB) if fcntl else None
+    if lock is None:
+        return False
+    try:
+        shutil.rmtree(base_dir, ignore_errors=True)
+    finally:
+        lock.close()
+    return True
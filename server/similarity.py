@@ -0,0 +1,200 @@
+"""
+"Who plays like X?" nearest-neighbour search, shared by both backends.
+
+A SimilarityIndex holds the per-90 scouting metrics of one data version,
+standardized against the players with enough minutes, as a metric x player
+float32 matrix. A query computes the distance from the reference player to
+every candidate one metric row at a time and picks the top k with
+argpartition, so a search over 100k player-seasons takes a few milliseconds
+and any subset of metrics can be used without rebuilding anything. Indexes
+are built once per data version and kept in a ResultCache.
+"""
+import os
+
+import numpy as np
+
+from cache import ResultCache
+from dataset import convert_value_to_millions, get_primary_position, primary_positions
+from instrumentation import span
+from single_flight import SingleFlight
+
+
+SIMILARITY_CONFIG = {
+    'k': 10,
+    'max_k': 100,
+    'min_minutes': int(os.getenv('QUANTIFICO_SIMILAR_MIN_MINUTES', 450)),   # Default candidate floor
+    'clip': 5.0,   # Largest |z| kept, so one freak small-sample rate cannot dominate a distance
+}
+
+# Display name -> (Excel column, PostgreSQL column, divide by 90s played)
+SIMILARITY_METRICS = {
+    'npxG': ('Expected_npxG', 'ps.npxg', True),
+    'xAG': ('Expected_xAG', 'ps.xag', True),
+    'Shots': ('shooting_Standard_Sh', 'ss.shots', True),
+    'Touches in Box': ('possession_Touches_Att Pen', 'poss.touches_att_pen', True),
+    'Shot Creating Actions': ('goal_shot_creation_SCA_SCA', 'cs.sca', True),
+    'Key Passes': ('passing_KP_', 'pass.key_passes', True),
+    'Crosses into Box': ('passing_CrsPA_', 'pass.crosses_into_penalty_area', True),
+    'Passes Completed': ('passing_Total_Cmp', 'pass.passes_completed', True),
+    'Pass Completion %': ('passing_Total_Cmp%', 'pass.passes_completed_pct', False),
+    'Prog. Passes': ('passing_PrgP_', 'pass.progressive_passes', True),
+    'Prog. Carries': ('possession_Carries_PrgC', 'poss.progressive_carries', True),
+    'Prog. Passes Received': ('possession_Receiving_PrgR', 'poss.progressive_passes_received', True),
+    'Successful Take-ons': ('possession_Take-Ons_Succ', 'poss.dribbles_completed', True),
+    'Tackles+Interceptions': ('defensive_Tkl+Int_', 'ds.tackles_interceptions', True),
+    'Blocks': ('defensive_Blocks_Blocks', 'ds.blocks', True),
+    'Clearances': ('defensive_Clr_', 'ds.clearances', True),
+}
+
+POSITIONS = ('GK', 'DF', 'MF', 'FW')
+
+
+class SimilarityIndex:
+    """Standardized per-90 metrics of one data version"""
+
+    def __init__(self, metrics, values, minutes, positions, ages, market_values):
+        """
+        values is metric x player, already per 90; positions are primary
+        positions (GK/DF/MF/FW/NA), market_values in millions.
+        """
+        self.metrics = list(metrics)
+        self.metric_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.minutes = np.asarray(minutes, dtype=np.float32)
+        self.positions = np.asarray(positions)
+        self.ages = np.asarray(ages, dtype=np.float32)
+        self.market_values = np.asarray(market_values, dtype=np.float32)
+
+        values = np.asarray(values, dtype=np.float64)
+        population = self.minutes >= SIMILARITY_CONFIG['min_minutes']
+        if population.sum() < 2:
+            population = np.ones(len(self.minutes), dtype=bool)
+        with np.errstate(all='ignore'):
+            mean = np.nanmean(values[:, population], axis=1, keepdims=True)
+            std = np.nanstd(values[:, population], axis=1, keepdims=True)
+            std[~(std > 0)] = 1.0
+            z = (values - mean) / std
+        # Missing stats count as average
+        z = np.nan_to_num(z, nan=0.0, posinf=0.0, neginf=0.0)
+        clip = SIMILARITY_CONFIG['clip']
+        self.z = np.ascontiguousarray(np.clip(z, -clip, clip), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.minutes)
+
+    @classmethod
+    def from_columns(cls, columns, minutes, nineties, positions, ages, market_values):
+        """Build from raw columns (display name -> values), converting counts to per 90"""
+        nineties = np.asarray(nineties, dtype=np.float64)
+        with np.errstate(all='ignore'):
+            per_game = np.where(nineties > 0, 1.0 / nineties, np.nan)
+        rows = []
+        for metric, values in columns.items():
+            values = np.asarray(values, dtype=np.float64)
+            rows.append(values * per_game if SIMILARITY_METRICS[metric][2] else values)
+        return cls(columns.keys(), np.vstack(rows), minutes, positions, ages, market_values)
+
+    def candidates(self, positions=None, min_age=None, max_age=None, min_value=None, max_value=None,
+                   min_minutes=None):
+        """Boolean mask of the players passing every filter"""
+        mask = self.minutes >= (SIMILARITY_CONFIG['min_minutes'] if min_minutes is None else min_minutes)
+        if positions:
+            mask &= np.isin(self.positions, list(positions))
+        if min_age is not None:
+            mask &= self.ages >= min_age
+        if max_age is not None:
+            mask &= self.ages <= max_age
+        if min_value is not None:
+            mask &= self.market_values >= min_value
+        if max_value is not None:
+            mask &= self.market_values <= max_value
+        return mask
+
+    def nearest(self, row, metrics=None, k=None, mask=None):
+        """(rows, distances) of the k candidates closest to row, nearest first"""
+        k = SIMILARITY_CONFIG['k'] if k is None else k
+        metric_rows = [self.metric_index[m] for m in metrics] if metrics else range(len(self.metrics))
+
+        distances = np.zeros(len(self), dtype=np.float32)
+        for i in metric_rows:
+            diff = self.z[i] - self.z[i, row]
+            distances += diff * diff
+
+        distances[row] = np.inf
+        if mask is not None:
+            distances[~mask] = np.inf
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return top, np.sqrt(distances[top])
+
+
+def index_for_dataset(dataset):
+    """SimilarityIndex over a PlayerDataset (Excel backend)"""
+    columns = {
+        metric: dataset.column(column) if dataset.has_metric(column) else np.full(len(dataset), np.nan)
+        for metric, (column, _, _) in SIMILARITY_METRICS.items()
+    }
+    return SimilarityIndex.from_columns(
+        columns, dataset.column('Playing Time_Min'), dataset.column('Playing Time_90s'),
+        primary_positions(dataset.categories['pos_'], dataset.codes['pos_']), dataset.age, dataset.value_millions
+    )
+
+
+def index_for_rows(rows):
+    """
+    SimilarityIndex over (pos_, age_, value, minutes, 90s, *SIMILARITY_METRICS)
+    rows (PostgreSQL backend)
+    """
+    columns = list(zip(*rows)) or [()] * (5 + len(SIMILARITY_METRICS))
+    positions, ages, values, minutes, nineties, *metric_values = columns
+
+    def floats(column):
+        return np.array([np.nan if v is None else float(v) for v in column], dtype=np.float64)
+
+    return SimilarityIndex.from_columns(
+        {metric: floats(column) for metric, column in zip(SIMILARITY_METRICS, metric_values)},
+        np.nan_to_num(floats(minutes)), floats(nineties),
+        [get_primary_position(p) for p in positions],
+        np.nan_to_num(floats(ages)), [convert_value_to_millions(v) for v in values]
+    )
+
+
+def parse_similarity_args(args):
+    """(metrics, k, filters) from query parameters; ValueError on bad input"""
+    metrics = [m.strip() for m in args.get('metrics', '').split(',') if m.strip()] or list(SIMILARITY_METRICS)
+    unknown = [m for m in metrics if m not in SIMILARITY_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown similarity metrics: {', '.join(unknown)}")
+
+    k = min(max(int(args.get('k', SIMILARITY_CONFIG['k'])), 1), SIMILARITY_CONFIG['max_k'])
+
+    positions = [p.strip().upper() for p in args.get('position', '').split(',') if p.strip()]
+    if any(p not in POSITIONS for p in positions):
+        raise ValueError(f"position must be one of {', '.join(POSITIONS)}")
+
+    filters = {'positions': positions or None}
+    for name in ('min_age', 'max_age', 'min_value', 'max_value', 'min_minutes'):
+        value = args.get(name)
+        filters[name] = float(value) if value not in (None, '') else None
+    return metrics, k, filters
+
+
+similarity_indexes = ResultCache('similarity_index', max_entries=16)
+_builds = SingleFlight('similarity_index')
+
+
+def get_similarity_index(version, build):
+    """Index for a data version, built once by whichever request needs it first"""
+    index = similarity_indexes.get(version)
+    if index is None:
+        def run():
+            with span('similarity_index'):
+                built = build()
+            similarity_indexes.set(version, built)
+            return built
+
+        index = _builds.do(version, run)
+    return index
@@ -0,0 +1,133 @@
+"""
+Single-flight coalescing for expensive work.
+
+Concurrent calls with the same key share one execution: the first caller
+(the leader) runs the work and every caller that arrives while it is in
+flight waits for, and receives, the same result or exception. Followers give
+up after a timeout instead of queueing behind a stuck leader. Nothing is
+cached once the flight lands; that is what cache.py is for.
+"""
+import os
+import threading
+import weakref
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request
+
+SINGLE_FLIGHT_CONFIG = {
+    'timeout': float(os.getenv('QUANTIFICO_SINGLE_FLIGHT_TIMEOUT', 30)),   # Seconds a follower waits
+}
+
+
+_flights = weakref.WeakSet()
+
+
+def all_flights():
+    """Every live SingleFlight, for metrics"""
+    return sorted(_flights, key=lambda flight: flight.name)
+
+
+class SingleFlightTimeout(TimeoutError):
+    pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls per key and counts how often they were shared"""
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {}   # group -> counters
+        _flights.add(self)
+
+    def _count(self, group, counter):
+        counters = self._stats.setdefault(group, {
+            'calls': 0, 'executions': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0
+        })
+        counters[counter] += 1
+
+    def do(self, key, fn, timeout=None, group=None):
+        """Run fn() once for all concurrent callers with this key"""
+        group = group or self.name
+        with self._lock:
+            self._count(group, 'calls')
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._count(group, 'executions')
+            else:
+                flight.waiters += 1
+                self._count(group, 'coalesced')
+
+        if leader:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.error = e
+                with self._lock:
+                    self._count(group, 'errors')
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            timeout = SINGLE_FLIGHT_CONFIG['timeout'] if timeout is None else timeout
+            if not flight.done.wait(timeout):
+                with self._lock:
+                    self._count(group, 'timeouts')
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for {group}")
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        """Counters per group; hit_rate is the share of calls that joined a flight"""
+        with self._lock:
+            return {
+                group: {**counters, 'hit_rate': counters['coalesced'] / counters['calls'] if counters['calls'] else 0.0}
+                for group, counters in self._stats.items()
+            }
+
+
+request_flights = SingleFlight('requests')
+
+
+def request_key():
+    """Normalized endpoint + params for the current request"""
+    params = sorted(request.args.items(multi=True))
+    return (request.endpoint, request.path, tuple(params))
+
+
+def coalesce(view):
+    """
+    Route decorator: identical concurrent requests are answered from one run
+    of the view. Followers get their own copy of the leader's response.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        def run():
+            response = make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        try:
+            body, status, headers = request_flights.do(request_key(), run, group=request.endpoint)
+        except SingleFlightTimeout as e:
+            return jsonify({'error': str(e)}), 504
+        return current_app.response_class(body, status=status, headers=headers)
+
+    return wrapper
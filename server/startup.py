@@ -0,0 +1,172 @@
+"""
+Worker start-up: heavy dependencies and the cold-start benchmark.
+
+The apps import pandas, sklearn, matplotlib/seaborn, ScraperFC and tqdm
+inside the functions that use them, so a fresh worker only pays for Flask,
+numpy and the shared dataset. prewarm() imports them ahead of time, e.g. from
+gunicorn's post_fork hook with QUANTIFICO_PREWARM=all.
+
+    python startup.py [--app app] [--repeat 5] [--output startup.json]
+
+measures, each in fresh interpreters, the import time of every heavy module,
+the import time of the app and the time to the first served request per route.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+
+# Groups of modules imported lazily by the routes that need them
+HEAVY_MODULES = {
+    'pandas': ['pandas'],
+    'sklearn': ['sklearn.preprocessing', 'sklearn.decomposition'],
+    'matplotlib': ['matplotlib.pyplot', 'matplotlib.patches'],
+    'seaborn': ['seaborn'],
+    'scraper': ['ScraperFC'],
+    'tqdm': ['tqdm'],
+}
+
+BENCHMARK_ROUTES = {
+    'app': [
+        '/api/search?q=bru',
+        '/api/player/Bruno Fernandes',
+        '/api/parallel/Bruno Fernandes',
+        '/api/scatter/Bruno Fernandes',
+        '/api/radar/Bruno Fernandes',
+        '/api/available-metrics',
+    ],
+    'app_postgresql': [
+        '/api/search?q=bru',
+        '/api/player/Bruno Fernandes',
+        '/api/parallel/Bruno Fernandes',
+        '/api/scatter/Bruno Fernandes',
+        '/api/radar/Bruno Fernandes',
+        '/api/available-metrics',
+    ],
+}
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def prewarm(groups=None):
+    """Import the given HEAVY_MODULES groups (all by default); returns seconds per group"""
+    if groups is None or groups == 'all':
+        groups = list(HEAVY_MODULES)
+    elif isinstance(groups, str):
+        groups = [group.strip() for group in groups.split(',') if group.strip()]
+
+    timings = {}
+    for group in groups:
+        start = time.perf_counter()
+        try:
+            if group == 'matplotlib':
+                import matplotlib
+                matplotlib.use('Agg')  # Required for headless mode
+            for module in HEAVY_MODULES[group]:
+                __import__(module)
+        except Exception as e:
+            print(f"Could not prewarm {group}: {e}")
+            continue
+        timings[group] = time.perf_counter() - start
+    return timings
+
+
+def prewarm_in_background(groups=None):
+    """Prewarm on a daemon thread so the worker can serve immediately"""
+    def run():
+        timings = prewarm(groups)
+        if timings:
+            print(f"Prewarmed {', '.join(f'{k} ({v:.2f}s)' for k, v in timings.items())} in pid {os.getpid()}")
+
+    thread = threading.Thread(target=run, name='quantifico-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_python(code):
+    """Run code in a fresh interpreter and return the JSON it prints last"""
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=SERVER_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _module_import_time(group):
+    return _run_python(
+        "import json, startup\n"
+        f"timings = startup.prewarm([{group!r}])\n"
+        f"print(json.dumps(timings.get({group!r})))\n"
+    )
+
+
+def _first_request(app_module, route):
+    return _run_python(
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {app_module} as module\n"
+        "imported = time.perf_counter()\n"
+        "client = module.app.test_client()\n"
+        f"status = client.get({route!r}).status_code\n"
+        "served = time.perf_counter()\n"
+        "heavy = [m for m in ('pandas', 'sklearn', 'matplotlib', 'seaborn', 'ScraperFC', 'tqdm') if m in sys.modules]\n"
+        "print(json.dumps({'import': imported - start, 'first_request': served - imported,\n"
+        "                  'ready': served - start, 'status': status, 'heavy_modules_loaded': heavy}))\n"
+    )
+
+
+def _summary(samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return None
+    return {'median': statistics.median(samples), 'min': min(samples), 'max': max(samples)}
+
+
+def run_benchmark(app_module='app', repeat=5, routes=None):
+    routes = routes or BENCHMARK_ROUTES[app_module]
+    result = {
+        'app': app_module,
+        'python': sys.version.split()[0],
+        'repeat': repeat,
+        'modules': {},
+        'routes': {},
+    }
+
+    for group in HEAVY_MODULES:
+        result['modules'][group] = _summary([_module_import_time(group) for _ in range(repeat)])
+
+    for route in routes:
+        runs = [_first_request(app_module, route) for _ in range(repeat)]
+        result['routes'][route] = {
+            'status': runs[-1]['status'],
+            'heavy_modules_loaded': runs[-1]['heavy_modules_loaded'],
+            'import': _summary([r['import'] for r in runs]),
+            'first_request': _summary([r['first_request'] for r in runs]),
+            'ready': _summary([r['ready'] for r in runs]),
+        }
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold-start import and first-request times')
+    parser.add_argument('--app', default='app', choices=sorted(BENCHMARK_ROUTES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.app, args.repeat)
+    for group, timing in report['modules'].items():
+        print(f"import {group:<12} {timing['median'] * 1000:8.1f} ms" if timing else f"import {group:<12} unavailable")
+    for route, timing in report['routes'].items():
+        print(f"{route:<40} import {timing['import']['median'] * 1000:7.1f} ms  "
+              f"first request {timing['first_request']['median'] * 1000:7.1f} ms  "
+              f"[{timing['status']}] loaded: {', '.join(timing['heavy_modules_loaded']) or '-'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
@@ -0,0 +1,476 @@
+"""
+Synthetic player data in the FBref layout, for load tests and scaling benchmarks.
+
+A PlayerDataModel is fitted to the shipped player table: one Gaussian copula
+per primary position (GK/DF/MF/FW) over every numeric column, with empirical
+marginals, so per-column distributions and cross-column correlations (and
+their differences between positions) carry over. Market value is modelled
+as a number and formatted back to the '€12.50m' / '€900k' labels. Missing
+values are copied as whole-row patterns from real players of the same
+position, which keeps fields that are missing together (e.g. shooting
+ratios for players without shots) consistent. Names, nations and position
+strings are resampled from the source.
+
+    python synthetic.py --rows 100000 --out /tmp/synthetic [--leagues 2 --seasons 3]
+        [--format csv --format xlsx --format postgres] [--postgres-dsn DSN]
+        [--heatmap-teams 20]
+
+writes one file per league-season partition plus a manifest.json that the
+servers load with QUANTIFICO_MANIFEST=/tmp/synthetic/manifest.json, a
+statisman.sql dump in the schema of data/creatingStatismanDB.ipynb for
+psql, and Sofascore-style match and heatmap payloads that
+SyntheticSofascore replays in place of ScraperFC's scraper. Rows are
+generated in chunks, so 1M player-seasons fit in a modest amount of memory
+(the Excel format needs each partition in memory and is limited to
+1,048,575 rows per partition).
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from dataset import PLAYER_DATA_FILE, convert_value_to_millions, get_primary_position, read_player_excel
+from player_ids import normalize_player_name
+
+
+SYNTHETIC_CONFIG = {
+    'chunk_rows': 50000,        # Rows generated and written at a time
+    'squad_size': None,         # Players per team; defaults to the source's average
+    'matches_per_team': 38,
+    'heatmap_points': (30, 90), # Heatmap points per player and match
+    'seed': 0,
+}
+
+NOTEBOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'creatingStatismanDB.ipynb')
+
+STRING_COLUMNS = ['player', 'Value', 'Season', 'league', 'team', 'nation_', 'pos_']
+POSITIONS = ['GK', 'DF', 'MF', 'FW']
+
+# Where each position spends its time on Sofascore's 0-100 pitch
+HEATMAP_CENTRES = {'GK': (6, 50), 'DF': (28, 50), 'MF': (50, 50), 'FW': (74, 50), 'NA': (50, 50)}
+
+
+def format_value(millions):
+    """Inverse of convert_value_to_millions, in Transfermarkt's steps"""
+    if millions >= 1:
+        return f"€{millions:.2f}m"
+    return f"€{max(25, int(round(millions * 1000 / 25)) * 25)}k"
+
+
+class _PositionCopula:
+    def __init__(self, values, missing):
+        # values: rows x columns, NaN where missing
+        n, k = values.shape
+        self.missing = missing          # Boolean row patterns to resample
+        self.quantiles = []             # Per column: (probabilities, sorted values)
+        scores = np.zeros((n, k))
+        from scipy.special import ndtri
+
+        for j in range(k):
+            column = values[:, j]
+            present = ~np.isnan(column)
+            observed = np.sort(column[present])
+            if len(observed) == 0:
+                observed = np.zeros(1)
+            self.quantiles.append((np.linspace(0, 1, len(observed)), observed))
+            if present.sum() > 1:
+                ranks = column[present].argsort().argsort()
+                scores[present, j] = ndtri((ranks + 1) / (present.sum() + 1))
+
+        correlation = np.corrcoef(scores, rowvar=False) if n > 1 else np.eye(k)
+        correlation = np.nan_to_num(correlation, nan=0.0)
+        np.fill_diagonal(correlation, 1.0)
+        # Nearest positive semi-definite matrix; few rows per position leave it rank deficient
+        eigenvalues, eigenvectors = np.linalg.eigh(correlation)
+        eigenvalues = np.clip(eigenvalues, 1e-6, None)
+        self.factor = eigenvectors * np.sqrt(eigenvalues)
+
+    def sample(self, n, rng):
+        from scipy.special import ndtr
+
+        uniform = ndtr(rng.standard_normal((n, self.factor.shape[1])) @ self.factor.T)
+        values = np.empty_like(uniform)
+        for j, (probabilities, observed) in enumerate(self.quantiles):
+            values[:, j] = np.interp(uniform[:, j], probabilities, observed)
+        values[self.missing[rng.integers(0, len(self.missing), n)]] = np.nan
+        return values
+
+
+class PlayerDataModel:
+    """Per-position Gaussian copulas fitted to a player table"""
+
+    def __init__(self, df):
+        self.columns = list(df.columns)
+        self.numeric = [c for c in self.columns if c not in STRING_COLUMNS]
+        self.integer = {
+            c for c in self.numeric
+            if np.all(np.mod(df[c].dropna().to_numpy(dtype=float), 1) == 0)
+        }
+        self.squad_size = len(df) / max(1, df['team'].nunique())
+        self.teams = list(df['team'].drop_duplicates())
+        self.nations = df['nation_'].fillna('').value_counts(normalize=True)
+
+        names = [str(name).split() for name in df['player']]
+        self.first_names = [parts[0] for parts in names if len(parts) > 1]
+        self.last_names = [' '.join(parts[1:]) for parts in names if len(parts) > 1]
+
+        primary = df['pos_'].map(get_primary_position)
+        self.position_weights = primary.value_counts(normalize=True).reindex(POSITIONS).fillna(0)
+        self.position_strings = {}
+        self.copulas = {}
+        fitted = df[self.numeric].astype(float).copy()
+        fitted['Value'] = [convert_value_to_millions(v) for v in df['Value']]
+        self.fitted_columns = self.numeric + ['Value']
+        for position in POSITIONS:
+            rows = (primary == position).to_numpy()
+            if not rows.any():
+                continue
+            values = fitted[self.fitted_columns].to_numpy()[rows]
+            self.copulas[position] = _PositionCopula(values, np.isnan(values))
+            self.position_strings[position] = df['pos_'][rows].value_counts(normalize=True)
+
+    @classmethod
+    def from_file(cls, path=PLAYER_DATA_FILE):
+        df = read_player_excel(path)
+        if df is None:
+            raise ValueError(f"Could not read {path}")
+        return cls(df)
+
+    def sample(self, n, rng, league, season, team_names):
+        """n synthetic player-seasons as a DataFrame in the source column layout"""
+        import pandas as pd
+
+        counts = rng.multinomial(n, self.position_weights.to_numpy() / self.position_weights.sum())
+        frames = []
+        for position, count in zip(POSITIONS, counts):
+            if count == 0 or position not in self.copulas:
+                continue
+            values = self.copulas[position].sample(count, rng)
+            frame = pd.DataFrame(values, columns=self.fitted_columns)
+            strings = self.position_strings[position]
+            frame['pos_'] = rng.choice(strings.index.to_numpy(), size=count, p=strings.to_numpy())
+            frames.append(frame)
+        frame = pd.concat(frames, ignore_index=True).sample(frac=1, random_state=rng.integers(1 << 31))
+        frame = frame.reset_index(drop=True)
+
+        for column in self.integer:
+            frame[column] = frame[column].round()
+        strings = pd.DataFrame({
+            'Value': [format_value(v) if v == v else format_value(0) for v in frame['Value']],
+            'player': [
+                f"{first} {last}" for first, last in zip(
+                    rng.choice(self.first_names, size=len(frame)), rng.choice(self.last_names, size=len(frame))
+                )
+            ],
+            'Season': season,
+            'league': league,
+            'team': rng.choice(team_names, size=len(frame)),
+            'nation_': rng.choice(self.nations.index.to_numpy(), size=len(frame), p=self.nations.to_numpy()),
+        })
+        frame = pd.concat([frame.drop(columns=['Value']), strings], axis=1)
+        return frame[self.columns]
+
+    def team_names(self, count):
+        """Source team names, numbered once they run out"""
+        return [
+            self.teams[i % len(self.teams)] + ('' if i < len(self.teams) else f' {i // len(self.teams) + 1}')
+            for i in range(count)
+        ]
+
+
+def _seasons(count, last='23/24'):
+    start = int(last.split('/')[0])
+    return [f"{(start - i) % 100:02d}/{(start - i + 1) % 100:02d}" for i in range(count)]
+
+
+def _chunks(total, size):
+    while total > 0:
+        yield min(total, size)
+        total -= size
+
+
+def load_notebook_schema(path=NOTEBOOK_FILE):
+    """
+    Tables, column types and the source-column mapping of the statisman
+    database, read from the notebook that creates it:
+    [(table, [(column, type)], [(column, source column)])]
+    """
+    with open(path, encoding='utf-8') as f:
+        notebook = json.load(f)
+    source = '\n'.join(''.join(cell['source']) for cell in notebook['cells'] if cell['cell_type'] == 'code')
+
+    classes = re.findall(r"class (\w+)\(Base\):\n    __tablename__ = '(\w+)'\n((?:    .*\n)+)", source)
+    mappings = dict(re.findall(
+        r"= (\w+)\(\n\s+player_id=player\.player_id,\n\s+season='[^']*',\n"
+        r"((?:\s+\w+=convert_numpy_types\(player_data\['.+?'\]\),?\n)+)", source
+    ))
+    schema = []
+    for class_name, table, body in classes:
+        columns = re.findall(r"    (\w+) = Column\((\w+)", body)
+        mapping = re.findall(r"(\w+)=convert_numpy_types\(player_data\['(.+?)'\]\)", mappings.get(class_name, ''))
+        schema.append((table, columns, mapping))
+    return schema
+
+
+SQL_TYPES = {'Integer': 'INTEGER', 'BigInteger': 'BIGINT', 'Float': 'DOUBLE PRECISION', 'String': 'VARCHAR'}
+
+
+def schema_sql(schema):
+    statements = [f"DROP TABLE IF EXISTS {table} CASCADE;" for table, _, _ in reversed(schema)]
+    for table, columns, _ in schema:
+        definitions = []
+        for column, kind in columns:
+            if (table == 'players_info' and column == 'player_id') or (table != 'players_info' and column == 'stat_id'):
+                definitions.append(f"{column} SERIAL PRIMARY KEY")
+            elif column == 'player_id':
+                definitions.append(f"{column} INTEGER REFERENCES players_info(player_id)")
+            else:
+                definitions.append(f"{column} {SQL_TYPES[kind]}")
+        statements.append(f"CREATE TABLE {table} (\n    " + ",\n    ".join(definitions) + "\n);")
+    return '\n'.join(statements) + '\n'
+
+
+def _copy_value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return '\\N'
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def copy_blocks(schema, frame, first_player_id):
+    """{table: (columns, COPY text)} for a chunk of players"""
+    player_ids = range(first_player_id, first_player_id + len(frame))
+    blocks = {}
+    for table, columns, mapping in schema:
+        if table == 'players_info':
+            names = [c for c, _ in columns]
+            sources = {'player_id': list(player_ids), 'season': frame['Season'], 'value': frame['Value']}
+            for column in ('age_', 'born_'):
+                sources[column] = [int(v) if v == v else None for v in frame[column]]
+            values = [sources[c] if c in sources else frame[c] for c in names]
+            rows = ['\t'.join(_copy_value(v) for v in row) for row in zip(*values)]
+        elif mapping:
+            names = ['player_id', 'season'] + [c for c, _ in mapping]
+            sources = frame[[source for _, source in mapping]].to_numpy(dtype=float)
+            rows = [
+                '\t'.join([str(player_id), _copy_value(season)] + [_copy_value(v) for v in values])
+                for player_id, season, values in zip(player_ids, frame['Season'], sources)
+            ]
+        else:
+            continue
+        blocks[table] = (names, '\n'.join(rows) + '\n')
+    return blocks
+
+
+class _SqlWriter:
+    def __init__(self, path, schema):
+        self.schema = schema
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(schema_sql(schema))
+
+    def write(self, frame, first_player_id):
+        for table, (names, text) in copy_blocks(self.schema, frame, first_player_id).items():
+            self.file.write(f"COPY {table} ({', '.join(names)}) FROM stdin;\n{text}\\.\n")
+
+    def close(self):
+        for table, _, _ in self.schema:
+            key = 'player_id' if table == 'players_info' else 'stat_id'
+            self.file.write(f"SELECT setval(pg_get_serial_sequence('{table}', '{key}'), "
+                            f"COALESCE((SELECT MAX({key}) FROM {table}), 1));\n")
+        self.file.close()
+
+
+class _PostgresWriter:
+    def __init__(self, dsn, schema):
+        import psycopg2
+
+        self.schema = schema
+        self.connection = psycopg2.connect(dsn)
+        with self.connection.cursor() as cursor:
+            cursor.execute(schema_sql(schema))
+
+    def write(self, frame, first_player_id):
+        with self.connection.cursor() as cursor:
+            for table, (names, text) in copy_blocks(self.schema, frame, first_player_id).items():
+                cursor.copy_expert(f"COPY {table} ({', '.join(names)}) FROM STDIN", io.StringIO(text))
+
+    def close(self):
+        with self.connection.cursor() as cursor:
+            for table, _, _ in self.schema:
+                key = 'player_id' if table == 'players_info' else 'stat_id'
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{key}'), "
+                               f"COALESCE((SELECT MAX({key}) FROM {table}), 1))")
+        self.connection.commit()
+        self.connection.close()
+
+
+def synthetic_heatmaps(rng, squads, match_id_start=1):
+    """
+    Fixtures and per-player heatmaps among squads {team: [(player, position)]},
+    one dict per match in the shape ScraperFC returns
+    """
+    teams = list(squads)
+    matches_per_team = SYNTHETIC_CONFIG['matches_per_team']
+    low, high = SYNTHETIC_CONFIG['heatmap_points']
+    match_id = match_id_start
+    for round_number in range(matches_per_team // 2 if len(teams) > 1 else 0):
+        order = rng.permutation(len(teams))
+        for home, away in zip(order[0::2], order[1::2]):
+            heatmaps = {}
+            for side, team in ((0, teams[home]), (1, teams[away])):
+                squad = squads[team]
+                for i in rng.choice(len(squad), size=min(14, len(squad)), replace=False):
+                    player, position = squad[i]
+                    x0, y0 = HEATMAP_CENTRES.get(position, HEATMAP_CENTRES['NA'])
+                    if side:
+                        x0 = 100 - x0
+                    points = rng.normal((x0, y0), (14, 22), size=(rng.integers(low, high), 2))
+                    heatmaps[player] = {
+                        'id': int(rng.integers(1, 1 << 30)),
+                        'heatmap': np.clip(points, 0, 100).round(1).tolist()
+                    }
+            yield {
+                'match': {'id': match_id, 'homeTeam': {'name': teams[home]}, 'awayTeam': {'name': teams[away]}},
+                'heatmaps': heatmaps
+            }
+            match_id += 1
+
+
+class SyntheticSofascore:
+    """Replays heatmap payloads written by generate() in place of ScraperFC.Sofascore"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv('QUANTIFICO_SYNTHETIC_SOFASCORE')
+        self._matches = {}     # (year, league) -> match dicts
+        self._heatmaps = {}    # match id -> heatmaps
+        with open(os.path.join(self.directory, 'index.json'), encoding='utf-8') as f:
+            self.index = json.load(f)
+
+    def _load(self, year, league):
+        key = (year, league)
+        if key not in self._matches:
+            matches = []
+            name = self.index.get(f'{league}|{year}')
+            if name:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        matches.append(record['match'])
+                        self._heatmaps[record['match']['id']] = record['heatmaps']
+            self._matches[key] = matches
+        return self._matches[key]
+
+    def get_match_dicts(self, year, league):
+        return self._load(year, league)
+
+    def scrape_heatmaps(self, match_id):
+        return self._heatmaps.get(match_id, {})
+
+
+def generate(model, rows, out_dir, formats=('csv',), leagues=1, seasons=1, postgres_dsn=None,
+             heatmap_teams=20, seed=None):
+    rng = np.random.default_rng(SYNTHETIC_CONFIG['seed'] if seed is None else seed)
+    os.makedirs(out_dir, exist_ok=True)
+    schema = load_notebook_schema() if 'postgres' in formats or postgres_dsn else None
+    sinks = []
+    if 'postgres' in formats:
+        sinks.append(_SqlWriter(os.path.join(out_dir, 'statisman.sql'), schema))
+    if postgres_dsn:
+        sinks.append(_PostgresWriter(postgres_dsn, schema))
+
+    heatmap_dir = os.path.join(out_dir, 'sofascore')
+    if heatmap_teams:
+        os.makedirs(heatmap_dir, exist_ok=True)
+    heatmap_index = {}
+
+    partitions = [(f'SYN{l + 1}', season) for l in range(leagues) for season in _seasons(seasons)]
+    manifest = {'default': {'league': partitions[0][0], 'season': partitions[0][1]}, 'partitions': []}
+    squad_size = SYNTHETIC_CONFIG['squad_size'] or model.squad_size
+    next_player_id = 1
+    match_id = 1
+
+    for number, (league_key, season) in enumerate(partitions):
+        partition_rows = rows // len(partitions) + (1 if number < rows % len(partitions) else 0)
+        team_names = model.team_names(max(2, int(round(partition_rows / squad_size))))
+        league = f'SYN-League {league_key[3:]}'
+        slug = f"{league_key.lower()}-{season.replace('/', '')}"
+        players = set()
+        squads = {team: [] for team in team_names[:heatmap_teams]}
+        excel_frames = []
+        csv_path = os.path.join(out_dir, f'{slug}.csv')
+
+        for index, chunk in enumerate(_chunks(partition_rows, SYNTHETIC_CONFIG['chunk_rows'])):
+            frame = model.sample(chunk, rng, league, season, team_names)
+            if 'csv' in formats:
+                frame.to_csv(csv_path, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+            if 'xlsx' in formats:
+                excel_frames.append(frame)
+            for sink in sinks:
+                sink.write(frame, next_player_id)
+            next_player_id += len(frame)
+            players.update(normalize_player_name(name) for name in frame['player'])
+            for name, team, position in zip(frame['player'], frame['team'], frame['pos_']):
+                if team in squads:
+                    squads[team].append((name, get_primary_position(position)))
+            print(f"{league_key} {season}: {min(partition_rows, (index + 1) * SYNTHETIC_CONFIG['chunk_rows'])}"
+                  f"/{partition_rows} rows")
+
+        if excel_frames:
+            import pandas as pd
+            pd.concat(excel_frames, ignore_index=True).to_excel(
+                os.path.join(out_dir, f'{slug}.xlsx'), index=False, engine='openpyxl'
+            )
+
+        if heatmap_teams:
+            name = f'{slug}.ndjson'
+            with open(os.path.join(heatmap_dir, name), 'w', encoding='utf-8') as f:
+                for record in synthetic_heatmaps(rng, {t: s for t, s in squads.items() if s}, match_id):
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                    match_id = record['match']['id'] + 1
+            heatmap_index[f'{league_key}|{season}'] = name
+
+        manifest['partitions'].append({
+            'league': league_key,
+            'season': season,
+            'league_name': league,
+            'file': f'{slug}.csv' if 'csv' in formats else f'{slug}.xlsx',
+            'sofascore': {'league': league_key, 'year': season, 'teams': {}},
+            'players': sorted(players),
+        })
+
+    for sink in sinks:
+        sink.close()
+    if heatmap_teams:
+        with open(os.path.join(heatmap_dir, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump(heatmap_index, f, indent=2)
+    if 'csv' in formats or 'xlsx' in formats:
+        with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic player data in the FBref layout')
+    parser.add_argument('--rows', type=int, default=10000, help='Player-seasons in total')
+    parser.add_argument('--out', required=True, help='Output directory')
+    parser.add_argument('--source', default=PLAYER_DATA_FILE, help='Excel/CSV file to learn from')
+    parser.add_argument('--format', action='append', choices=['csv', 'xlsx', 'postgres'],
+                        help='Output formats (default: csv); postgres writes statisman.sql')
+    parser.add_argument('--postgres-dsn', help='Also load the rows into this database (replaces its tables)')
+    parser.add_argument('--leagues', type=int, default=1)
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--heatmap-teams', type=int, default=20,
+                        help='Teams per partition with synthetic Sofascore heatmaps (0 to skip)')
+    parser.add_argument('--seed', type=int, default=SYNTHETIC_CONFIG['seed'])
+    args = parser.parse_args()
+
+    formats = args.format or ['csv']
+    if 'xlsx' in formats and args.rows / (args.leagues * args.seasons) > 1048575:
+        sys.exit("Excel partitions are limited to 1,048,575 rows; use more partitions or --format csv")
+    generate(PlayerDataModel.from_file(args.source), args.rows, args.out, formats, args.leagues, args.seasons,
+             args.postgres_dsn, args.heatmap_teams, args.seed)
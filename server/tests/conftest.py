@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    """Publish shared datasets under tmp_path instead of /dev/shm"""
+    from shared_dataset import SHARED_DATA_CONFIG
+    monkeypatch.setitem(SHARED_DATA_CONFIG, 'dir', str(tmp_path / 'shm'))
+    return tmp_path / 'shm'
+
+
+@pytest.fixture(scope='session')
+def player_frame():
+    """The shipped FBref player table"""
+    from dataset import read_player_excel
+    return read_player_excel()
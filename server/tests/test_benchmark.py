@@ -0,0 +1,36 @@
+from benchmark import _percentile, compare
+
+
+def report(p95_ms, throughput_rps, errors=0, peak_rss_mb=100.0):
+    return {'backends': {'app': {
+        'peak_rss_mb': peak_rss_mb,
+        'routes': {'/api/players': {'p95_ms': p95_ms, 'throughput_rps': throughput_rps, 'errors': errors}},
+    }}}
+
+
+def test_regressions_above_the_threshold_are_flagged():
+    baseline = report(10.0, 500.0)
+    regressions = compare(baseline, report(12.0, 400.0, errors=1, peak_rss_mb=130.0), threshold=0.1)
+    assert len(regressions) == 4
+    assert any('p95 10.00 -> 12.00' in message for message in regressions)
+    assert any('throughput 500.0 -> 400.0' in message for message in regressions)
+    assert any('peak RSS' in message for message in regressions)
+
+
+def test_improvements_and_noise_are_not_flagged():
+    baseline = report(10.0, 500.0)
+    assert compare(baseline, report(6.0, 800.0, peak_rss_mb=80.0)) == []
+    assert compare(baseline, report(10.9, 460.0, peak_rss_mb=109.0), threshold=0.1) == []
+
+
+def test_routes_missing_from_the_baseline_are_skipped():
+    current = report(50.0, 1.0)
+    current['backends']['app']['routes']['/api/new'] = {'p95_ms': 99.0, 'throughput_rps': 1.0, 'errors': 3}
+    assert not any('/api/new' in message for message in compare(report(50.0, 1.0), current))
+
+
+def test_percentile():
+    samples = sorted(range(1, 101))
+    assert _percentile(samples, 0.5) == 51
+    assert _percentile(samples, 0.99) == 99
+    assert _percentile([], 0.5) is None
@@ -0,0 +1,31 @@
+import pytest
+
+from derived import DERIVED_METRICS, DERIVED_ORDER, Derived, dependency_order
+
+
+def test_every_derived_metric_comes_after_its_inputs():
+    assert sorted(DERIVED_ORDER) == sorted(DERIVED_METRICS)
+    position = {name: i for i, name in enumerate(DERIVED_ORDER)}
+    for name, definition in DERIVED_METRICS.items():
+        for dependency in definition.inputs:
+            if dependency in DERIVED_METRICS:
+                assert position[dependency] < position[name], (dependency, name)
+
+
+def test_declaration_order_does_not_matter():
+    definitions = {
+        'c': Derived(['a', 'b'], None, ''),
+        'b': Derived(['a', 'x'], None, ''),
+        'a': Derived(['x'], None, ''),
+    }
+    assert dependency_order(definitions) == ['a', 'b', 'c']
+
+
+def test_cycle_is_rejected():
+    definitions = {
+        'a': Derived(['c'], None, ''),
+        'b': Derived(['a'], None, ''),
+        'c': Derived(['b'], None, ''),
+    }
+    with pytest.raises(ValueError, match='depend on each other'):
+        dependency_order(definitions)
@@ -0,0 +1,18 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from export import parse_export_metrics
+
+DEFAULT = {'Minutes': 'Playing Time_Min'}
+
+
+def test_metrics_object_is_used():
+    args = MultiDict({'metrics': '{"xG": "Expected_xG"}'})
+    assert parse_export_metrics(args, DEFAULT) == {'xG': 'Expected_xG'}
+    assert parse_export_metrics(MultiDict(), DEFAULT) == DEFAULT
+
+
+@pytest.mark.parametrize('metrics', ['["Playing Time_Min"]', '"Expected_xG"', '{"xG": 1}', '{"xG": '])
+def test_other_metrics_are_client_errors(metrics):
+    with pytest.raises(ValueError):
+        parse_export_metrics(MultiDict({'metrics': metrics}), DEFAULT)
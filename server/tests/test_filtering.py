@@ -0,0 +1,22 @@
+from werkzeug.datastructures import MultiDict
+
+from dataset import PlayerDataset
+from filtering import get_filter_index, parse_filter_args
+from leaderboard import parse_leaderboard_args
+
+
+def test_position_labels_are_upper_cased():
+    args = MultiDict([('position', 'mf, fw'), ('position', 'MF'), ('team', 'Arsenal'), ('metric', 'Expected_xG')])
+    _, categories = parse_filter_args(args)
+    assert categories == {'position': ['FW', 'MF'], 'team': ['Arsenal']}
+    assert parse_leaderboard_args(args)['categories'] == categories
+
+
+def test_lower_case_position_matches(player_frame):
+    index = get_filter_index(PlayerDataset.from_frame(player_frame))
+    matched = {}
+    for position in ('mf', 'MF'):
+        ranges, categories = parse_filter_args(MultiDict({'position': position}))
+        matched[position] = index.query(ranges, categories)
+    assert len(matched['MF']) > 0
+    assert list(matched['mf']) == list(matched['MF'])
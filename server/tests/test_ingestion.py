@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import ingestion
+from dataset import PLAYER_DATA_FILE
+
+COUNTING = ['Performance_Gls', 'Performance_G-PK', 'Performance_Ast', 'Expected_xG', 'Expected_npxG',
+            'Expected_xAG', 'shooting_Standard_Sh', 'shooting_Standard_SoT', 'passing_KP_',
+            'defensive_Tkl+Int_', 'passing_Total_Cmp', 'passing_Total_Att']
+
+
+def write_manifest(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({
+        'default': {'league': 'EPL', 'season': '23/24'},
+        'partitions': [{'league': 'EPL', 'season': '23/24', 'file': PLAYER_DATA_FILE, 'players': []}],
+    }))
+    return str(path)
+
+
+def matchweek(player_frame, seed):
+    rng = np.random.default_rng(seed)
+    picked = player_frame.sample(25, random_state=seed)
+    frame = pd.DataFrame({'player': picked['player'].tolist() + [f'New Player {seed}'],
+                          'team': picked['team'].tolist() + ['Arsenal']})
+    frame['Playing Time_Min'] = 90.0
+    for column in COUNTING:
+        frame[column] = rng.integers(0, 5, len(frame)).astype(float)
+    frame['pos_'] = [None] * 25 + ['MF']
+    return frame
+
+
+def assert_same_dataset(a, b):
+    assert a.players == b.players
+    assert a.metrics == b.metrics
+    assert a.categories == b.categories
+    for column in a.codes:
+        assert np.array_equal(a.codes[column], b.codes[column])
+    np.testing.assert_allclose(np.asarray(a.matrix), np.asarray(b.matrix), rtol=1e-5, atol=1e-5)
+    assert np.array_equal(a.midfielder_rows, b.midfielder_rows)
+    np.testing.assert_allclose(np.asarray(a.midfielder_stats), np.asarray(b.midfielder_stats), rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(np.asarray(a.value_millions), np.asarray(b.value_millions))
+    # A principal component's sign is arbitrary
+    np.testing.assert_allclose(np.abs(a.scatter_pca), np.abs(b.scatter_pca), atol=1e-3)
+    for component, variance in a.scatter_variance.items():
+        assert abs(variance - b.scatter_variance[component]) < 1e-6
+
+
+def test_ingest_then_rebuild_gives_the_same_dataset(tmp_path, shared_dir, player_frame):
+    manifest = write_manifest(tmp_path)
+    ingestion.ingest('EPL', '23/24', matchweek(player_frame, 1), matchweek=1, manifest_path=manifest)
+    ingested = ingestion.ingest('EPL', '23/24', matchweek(player_frame, 2), matchweek=2, manifest_path=manifest)
+    rebuilt = ingestion.rebuild('EPL', '23/24', manifest_path=manifest)
+    assert len(rebuilt) == len(player_frame) + 2
+    assert_same_dataset(ingested, rebuilt)
+
+
+def test_corrected_matchweek_replaces_the_stored_one(tmp_path, shared_dir, player_frame):
+    manifest = write_manifest(tmp_path)
+    frame = matchweek(player_frame, 3)
+    ingestion.ingest('EPL', '23/24', frame, matchweek=1, manifest_path=manifest)
+    corrected = frame.assign(passing_KP_=frame['passing_KP_'] + 1)
+    ingested = ingestion.ingest('EPL', '23/24', corrected, matchweek=1, manifest_path=manifest)
+    assert_same_dataset(ingested, ingestion.rebuild('EPL', '23/24', manifest_path=manifest))
+
+
+def test_goals_per_shot_leave_out_penalties(tmp_path, shared_dir, player_frame):
+    manifest = write_manifest(tmp_path)
+    saka = player_frame[player_frame['player'] == 'Bukayo Saka'].iloc[0]
+    frame = pd.DataFrame({'player': ['Bukayo Saka'], 'team': [saka['team']], 'Playing Time_Min': [0.0]})
+    dataset = ingestion.ingest('EPL', '23/24', frame, matchweek=1, manifest_path=manifest)
+    row = dataset.row('Bukayo Saka')
+    expected = saka['Performance_G-PK'] / saka['shooting_Standard_Sh']
+    assert abs(dataset.metric('shooting_Standard_G/Sh', row) - expected) < 1e-6
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from dataset import PlayerDataset
+from leaderboard import LEADERBOARD_CONFIG, InvalidCursor, leaderboard_page, parse_leaderboard_args
+
+METRIC = 'Per 90 Minutes_npxG'
+
+
+@pytest.fixture(scope='module')
+def datasets(player_frame):
+    return {'EPL 23/24': PlayerDataset.from_frame(player_frame)}
+
+
+def query(**args):
+    return parse_leaderboard_args(MultiDict({'metric': METRIC, 'min_minutes': '450', **args}))
+
+
+def walk(datasets, limit):
+    entries, cursor, pages = [], None, 0
+    while True:
+        page, cursor = leaderboard_page(datasets, query(limit=str(limit)), cursor)
+        entries += page
+        pages += 1
+        if cursor is None:
+            return entries, pages
+
+
+def test_pages_concatenate_to_the_full_ranking(datasets):
+    dataset = datasets['EPL 23/24']
+    values = dataset.column(METRIC)
+    minutes = dataset.column('Playing Time_Min')
+    eligible = np.flatnonzero(np.isfinite(values) & (minutes >= 450))
+    expected = sorted(values[eligible].astype(float), reverse=True)
+
+    entries, pages = walk(datasets, 7)
+    assert pages == len(expected) // 7 + 1
+    assert [rank for rank, *_ in entries] == list(range(1, len(expected) + 1))
+    assert [value for *_, value in entries] == pytest.approx(expected)
+    assert sorted(row for _, _, _, row, _ in entries) == sorted(eligible.tolist())
+
+    # Paging does not reorder ties: one big page lists the same players in the same order
+    limit = LEADERBOARD_CONFIG['max_limit']
+    first, _ = leaderboard_page(datasets, query(limit=str(limit)))
+    assert [row for _, _, _, row, _ in first] == [row for _, _, _, row, _ in entries[:limit]]
+
+
+def test_cursor_of_another_query_is_rejected(datasets):
+    _, cursor = leaderboard_page(datasets, query(limit='5'))
+    with pytest.raises(InvalidCursor, match='different leaderboard query'):
+        leaderboard_page(datasets, query(limit='5', order='asc'), cursor)
+
+
+def test_tampered_cursor_is_rejected(datasets):
+    _, cursor = leaderboard_page(datasets, query(limit='5'))
+    with pytest.raises(InvalidCursor):
+        leaderboard_page(datasets, query(limit='5'), cursor[:-3] + 'xyz')
+    with pytest.raises(InvalidCursor, match='Malformed'):
+        leaderboard_page(datasets, query(limit='5'), 'not a cursor')
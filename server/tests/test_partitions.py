@@ -0,0 +1,135 @@
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+
+import partitions
+from dataset import DATASET_LAYOUT, PLAYER_DATA_FILE
+from shared_dataset import (SHARED_DATA_CONFIG, detach_shared_dataset, get_shared_dataset,
+                            remove_unmapped_segment)
+
+
+def write_manifest(tmp_path, seasons, source=PLAYER_DATA_FILE):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({
+        'default': {'league': 'EPL', 'season': seasons[0]},
+        'partitions': [{'league': 'EPL', 'season': season, 'file': source, 'players': []}
+                       for season in seasons],
+    }))
+    return str(path)
+
+
+def test_evicted_partition_segment_is_removed(tmp_path, shared_dir, monkeypatch):
+    monkeypatch.setitem(partitions.PARTITION_CONFIG, 'memory_budget', 1)
+    store = partitions.PartitionStore(write_manifest(tmp_path, ['23/24', '22/23']))
+    first, second = ('EPL', '23/24'), ('EPL', '22/23')
+
+    store.get(*first)
+    assert os.path.isdir(store.segment_dir(first))
+    store.get(*second)
+    assert store.resident() == [second]
+    assert not os.path.exists(store.segment_dir(first))
+
+    # Used again after eviction, it is republished from the source
+    assert store.get(*first) is not None
+    assert os.path.isdir(store.segment_dir(first))
+    detach_shared_dataset(store.segment_dir(second))
+
+
+def test_mapped_segment_is_kept(tmp_path, shared_dir):
+    store = partitions.PartitionStore(write_manifest(tmp_path, ['23/24']))
+    key = ('EPL', '23/24')
+    store.get(*key)
+    assert not remove_unmapped_segment(store.segment_dir(key))
+    assert os.path.isdir(store.segment_dir(key))
+
+    detach_shared_dataset(store.segment_dir(key))
+    assert remove_unmapped_segment(store.segment_dir(key))
+    assert not os.path.exists(store.segment_dir(key))
+
+
+def test_stale_segment_is_republished(tmp_path, shared_dir):
+    source = shutil.copy(PLAYER_DATA_FILE, tmp_path / 'players.xlsx')
+    store = partitions.PartitionStore(write_manifest(tmp_path, ['23/24'], str(source)))
+    key = ('EPL', '23/24')
+    published = store.get(*key).version
+
+    # A segment from a server without derived metric rows
+    meta_path = os.path.join(store.segment_dir(key), published, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta.pop('layout')
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    detach_shared_dataset(store.segment_dir(key))
+    dataset = store.get(*key)
+    assert dataset.version != published
+    assert dataset.layout == DATASET_LAYOUT
+    assert dataset.source == store.source_stamp(key)
+
+    # The source file replaced in place
+    republished = dataset.version
+    os.utime(source, ns=(0, 0))
+    detach_shared_dataset(store.segment_dir(key))
+    dataset = store.get(*key)
+    assert dataset.version != republished
+    assert dataset.source == store.source_stamp(key)
+
+    # Unchanged: attached as it is
+    detach_shared_dataset(store.segment_dir(key))
+    assert store.get(*key).version == dataset.version
+    detach_shared_dataset(store.segment_dir(key))
+
+
+def test_cold_load_does_not_block_attached_partitions(tmp_path, shared_dir, monkeypatch):
+    monkeypatch.setitem(SHARED_DATA_CONFIG, 'check_interval', 0)
+    store = partitions.PartitionStore(write_manifest(tmp_path, ['23/24', '22/23']))
+    warm, cold = ('EPL', '23/24'), ('EPL', '22/23')
+    store.get(*warm)
+
+    loading, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        loading.set()
+        release.wait(10)
+        return store.read_partition(cold)
+
+    thread = threading.Thread(target=get_shared_dataset, args=(slow_loader, store.segment_dir(cold)))
+    thread.start()
+    try:
+        assert loading.wait(10)
+        started = time.monotonic()
+        assert store.get(*warm) is not None
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        thread.join()
+    detach_shared_dataset(store.segment_dir(warm))
+    detach_shared_dataset(store.segment_dir(cold))
+
+
+def _attach_in_process(store, key, builds, versions):
+    def loader():
+        builds.put(os.getpid())
+        time.sleep(0.5)
+        return store.read_partition(key)
+    versions.put(get_shared_dataset(loader, store.segment_dir(key), lambda: store.source_stamp(key)).version)
+
+
+def test_one_process_builds_a_partition(tmp_path, shared_dir):
+    store = partitions.PartitionStore(write_manifest(tmp_path, ['23/24']))
+    key = ('EPL', '23/24')
+    context = multiprocessing.get_context('fork')
+    builds, versions = context.Queue(), context.Queue()
+    workers = [context.Process(target=_attach_in_process, args=(store, key, builds, versions)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    published = {versions.get(timeout=60) for _ in workers}
+    for worker in workers:
+        worker.join()
+
+    assert len(published) == 1
+    assert builds.qsize() == 1
+    assert sorted(os.listdir(store.segment_dir(key))) == sorted(['CURRENT', *published])
@@ -0,0 +1,41 @@
+import random
+
+from dataset import PlayerDataset
+from player_ids import PlayerIndex, normalize_player_name, player_slug
+
+ENTRIES = [
+    (0, 'Danilo', 'Arsenal', '23/24', 2001),
+    (1, 'Danilo', 'Arsenal', '23/24', 1999),
+    (2, 'Danílo', 'Arsenal', '23/24', None),
+    (3, 'Bukayo Saka', 'Arsenal', '23/24', 2001),
+]
+
+
+def test_duplicate_slug_ids_do_not_depend_on_row_order():
+    expected = PlayerIndex(ENTRIES).key_ids
+    assert sorted(expected.values()) == ['bukayo-saka-arsenal-23-24', 'danilo-arsenal-23-24',
+                                         'danilo-arsenal-23-24-2', 'danilo-arsenal-23-24-3']
+    shuffled = list(ENTRIES)
+    for seed in range(5):
+        random.Random(seed).shuffle(shuffled)
+        assert PlayerIndex(shuffled).key_ids == expected
+
+
+def test_letters_without_decomposition_are_transliterated():
+    assert normalize_player_name('Martin Ødegaard') == 'martin odegaard'
+    assert normalize_player_name('Pascal Groß') == 'pascal gross'
+    assert normalize_player_name('Łukasz Fabiański') == 'lukasz fabianski'
+    assert normalize_player_name('Đorđe Petrović') == 'dorde petrovic'
+    assert normalize_player_name('Johann Berg Guðmundsson') == 'johann berg gudmundsson'
+    assert normalize_player_name('Æsir Œuvre Þór') == 'aesir oeuvre thor'
+    assert player_slug('Martin Ødegaard', 'Arsenal', '23/24') == 'martin-odegaard-arsenal-23-24'
+
+
+def test_ascii_spellings_resolve(player_frame):
+    dataset = PlayerDataset.from_frame(player_frame)
+    odegaard = dataset.row('Martin Ødegaard')
+    assert odegaard is not None
+    assert dataset.row('Martin Odegaard') == odegaard
+    assert dataset.row('martin-odegaard-arsenal-23-24') == odegaard
+    assert dataset.row('Pascal Gross') == dataset.row('Pascal Groß') is not None
+    assert dataset.row('Lukasz Fabianski') == dataset.row('Łukasz Fabiański') is not None
@@ -0,0 +1,335 @@
+"""
+Access-log-driven cache warming for the per-player panels.
+
+Requests to the warmable routes (radar, parallel, scatter and heatmap) are
+appended to an access log shared by every worker, one JSON line each. A
+low-priority background thread per worker counts the paths in the tail of
+that log and replays the most requested ones through the app, so after a
+deploy or a data refresh the first analyst to open a star player gets a
+cached response instead of the cold path:
+
+- radar/parallel/scatter responses are kept in a response cache keyed by
+  the data version, so a new version turns every entry cold and the next
+  pass recomputes the top players for it
+- heatmaps go through the heatmap cache; the warmer waits for each season
+  scrape job before starting the next, so it never fills the job pool
+
+A pass runs shortly after startup and then every `interval` seconds. It
+skips whatever is still warm, waits while real requests are in flight and
+stops when its wall-time or CPU budget is used up. Every request to a
+warmable route is counted as a warm or cold hit in
+quantifico_warm_requests_total.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from urllib.parse import parse_qsl, urlencode
+
+from flask import current_app, g, make_response, request
+
+from cache import ResultCache
+from instrumentation import register_collector, registry
+from jobs import job_manager
+from single_flight import request_key
+
+
+WARM_CONFIG = {
+    'enabled': os.getenv('QUANTIFICO_WARM', '1').lower() not in ('0', 'false', 'no'),
+    'log': os.getenv('QUANTIFICO_ACCESS_LOG',
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'access-log.jsonl')),
+    'window_bytes': int(os.getenv('QUANTIFICO_WARM_WINDOW_BYTES', 4 * 1024 * 1024)),   # Log tail that is counted
+    'top': int(os.getenv('QUANTIFICO_WARM_TOP', 50)),                     # Paths warmed per pass
+    'interval': float(os.getenv('QUANTIFICO_WARM_INTERVAL', 60)),         # Seconds between passes
+    'startup_delay': float(os.getenv('QUANTIFICO_WARM_DELAY', 5)),
+    'time_budget': float(os.getenv('QUANTIFICO_WARM_TIME_BUDGET', 300)),  # Wall seconds per pass
+    'cpu_budget': float(os.getenv('QUANTIFICO_WARM_CPU_BUDGET', 30)),     # CPU seconds per pass
+    'idle_wait': 2.0,     # Longest wait for in-flight requests before warming the next path
+    'nice': 10,           # Added to the warmer thread's scheduling niceness (Linux)
+    'max_responses': 1024,
+}
+
+# Requests the warmer replays carry this header; they are not logged or counted as hits
+WARM_HEADER = 'X-Quantifico-Warm'
+
+# Query parameters never written to the access log: the profiling token (profiling.py) is a
+# secret, and a replayed path must not profile again
+UNLOGGED_PARAMS = ('_profile', '_profile_format')
+
+registry.describe('quantifico_warm_requests_total', 'Requests to warmable routes by whether the result was already warm')
+
+response_cache = ResultCache('warm_responses', max_entries=WARM_CONFIG['max_responses'])
+
+
+def loggable_path(path):
+    """path without the UNLOGGED_PARAMS query parameters"""
+    base, _, query = path.partition('?')
+    params = parse_qsl(query, keep_blank_values=True)
+    if not any(name in UNLOGGED_PARAMS for name, _ in params):
+        return path
+    query = urlencode([(name, value) for name, value in params if name not in UNLOGGED_PARAMS])
+    return f'{base}?{query}' if query else base
+
+
+class AccessLog:
+    """Append-only JSON lines log of warmable requests, counted from its tail"""
+
+    def __init__(self, path=None, window_bytes=None):
+        self.path = path or WARM_CONFIG['log']
+        self.window_bytes = window_bytes or WARM_CONFIG['window_bytes']
+        self._lock = threading.Lock()
+        self._counted_size = None
+        self._counts = Counter()
+        self._routes = {}   # path -> endpoint
+
+    def record(self, endpoint, path, player=None):
+        line = json.dumps({'t': round(time.time(), 3), 'endpoint': endpoint, 'path': loggable_path(path),
+                           'player': player},
+                          separators=(',', ':')) + '\n'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Single small appends, so lines from several workers do not interleave
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            if os.path.getsize(self.path) > 4 * self.window_bytes:
+                self._rotate()
+        except OSError as e:
+            print(f"Error writing access log: {e}")
+
+    def _rotate(self):
+        with self._lock:
+            try:
+                os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass   # Another worker rotated it first
+
+    def _tail(self):
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            start = max(0, size - self.window_bytes)
+            f.seek(start)
+            data = f.read()
+        lines = data.decode('utf-8', errors='replace').splitlines()
+        return size, lines[1:] if start else lines   # The first line of a partial read is cut
+
+    def top(self, n):
+        """[(path, endpoint, count)] of the n most requested paths in the window"""
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+                if size != self._counted_size:
+                    size, lines = self._tail()
+                    counts, routes = Counter(), {}
+                    for line in lines:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        # Lines logged before UNLOGGED_PARAMS were stripped are never replayed with them
+                        path = loggable_path(entry['path'])
+                        counts[path] += 1
+                        routes[path] = entry['endpoint']
+                    self._counts, self._routes, self._counted_size = counts, routes, size
+            except FileNotFoundError:
+                self._counts, self._routes, self._counted_size = Counter(), {}, None
+            return [(path, self._routes[path], count) for path, count in self._counts.most_common(n)]
+
+
+class Warmer:
+    """Background replay of the most requested warmable paths"""
+
+    def __init__(self, app, data_version, access_log=None):
+        """data_version() returns the version of the data behind the current request"""
+        self.app = app
+        self.data_version = data_version
+        self.access_log = access_log or AccessLog()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.stats = Counter()   # passes, warmed, skipped, failed, budget stops
+        self.last_pass = {}
+
+    def start(self):
+        """Start the thread once per process (called on the first request, so after a fork)"""
+        if not WARM_CONFIG['enabled'] or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='quantifico-warmer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            # Linux applies niceness per thread, so only warming is deprioritized
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WARM_CONFIG['nice'])
+        except (AttributeError, OSError):
+            pass
+        time.sleep(WARM_CONFIG['startup_delay'])
+        while True:
+            try:
+                self.warm()
+            except Exception as e:
+                print(f"Cache warming pass failed: {e}")
+            time.sleep(WARM_CONFIG['interval'])
+
+    def response_key(self):
+        """Response cache key of the current request, or None if the data version is unavailable"""
+        try:
+            return (self.data_version(), request_key())
+        except Exception:
+            return None
+
+    def _is_warm(self, path):
+        # The pushed context matches the URL, so request.endpoint is set as for the real request
+        with self.app.test_request_context(path):
+            key = self.response_key()
+        return key is not None and key in response_cache
+
+    def _wait_until_idle(self):
+        deadline = time.monotonic() + WARM_CONFIG['idle_wait']
+        while self.in_flight > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _wait_for_job(self, job_id, deadline):
+        job = job_manager.get(job_id)
+        revision = -1
+        while job is not None and not job.finished and time.monotonic() < deadline:
+            revision = job.wait_for_change(revision, min(5.0, max(deadline - time.monotonic(), 0.01)))
+        return job is None or job.finished
+
+    def warm(self, n=None):
+        """One pass over the top paths; returns its summary"""
+        started, cpu_started = time.monotonic(), time.thread_time()
+        deadline = started + WARM_CONFIG['time_budget']
+        summary = Counter()
+        client = self.app.test_client()
+
+        for path, endpoint, count in self.access_log.top(n or WARM_CONFIG['top']):
+            if time.monotonic() >= deadline or time.thread_time() - cpu_started >= WARM_CONFIG['cpu_budget']:
+                summary['budget_stops'] += 1
+                break
+            cached_route = endpoint in WARM_ROUTES and WARM_ROUTES[endpoint]
+            try:
+                if cached_route and self._is_warm(path):
+                    summary['skipped'] += 1
+                    continue
+                self._wait_until_idle()
+                response = client.get(path, headers={WARM_HEADER: '1'})
+                if response.status_code == 202:
+                    # A heatmap scrape: let it finish before starting another
+                    if not self._wait_for_job(response.get_json()['id'], deadline):
+                        summary['budget_stops'] += 1
+                        break
+                elif response.status_code != 200:
+                    summary['failed'] += 1
+                    continue
+                summary['warmed'] += 1
+            except Exception as e:
+                print(f"Error warming {path}: {e}")
+                summary['failed'] += 1
+
+        summary['passes'] = 1
+        self.stats.update(summary)
+        self.last_pass = {
+            **summary,
+            'seconds': time.monotonic() - started,
+            'cpu_seconds': time.thread_time() - cpu_started,
+        }
+        if summary['warmed'] or summary['budget_stops']:
+            print(f"Cache warming pass: {dict(self.last_pass)}")
+        return self.last_pass
+
+
+# Endpoint -> whether its responses go through the response cache (heatmaps have their own cache)
+WARM_ROUTES = {
+    'get_radar_data': True,
+    'get_parallel_data': True,
+    'get_scatter_data': True,
+    'get_heatmap': False,
+}
+
+
+def warmable(view):
+    """
+    Route decorator for the WARM_ROUTES: serves warm responses from the
+    response cache and records whether each request found its result warm.
+    Put it above @coalesce so one run fills the cache for every waiter.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        warmer = current_app.extensions.get('warmer')
+        if warmer is None:
+            return view(*args, **kwargs)
+
+        key = warmer.response_key() if WARM_ROUTES.get(request.endpoint) else None
+        if key is not None:
+            cached = response_cache.get(key)
+            if cached is not None:
+                g.warm_result = 'warm'
+                body, status, headers = cached
+                return current_app.response_class(body, status=status, headers=headers)
+
+        response = make_response(view(*args, **kwargs))
+        if response.is_streamed:
+            return response
+        if key is not None:
+            g.warm_result = 'cold'
+            if response.status_code == 200:
+                response_cache.set(key, (response.get_data(), response.status_code, list(response.headers.items())))
+        else:
+            # Heatmaps: a 202 means the season had to be scraped
+            g.warm_result = 'cold' if response.status_code == 202 else 'warm'
+        return response
+
+    return wrapper
+
+
+def init_warmer(app, data_version):
+    """Log warmable requests, count warm/cold hits and start the warmer on the first request"""
+    warmer = Warmer(app, data_version)
+    app.extensions['warmer'] = warmer
+
+    @app.before_request
+    def track_request():
+        if request.headers.get(WARM_HEADER):
+            return
+        warmer.start()
+        with warmer._lock:
+            warmer.in_flight += 1
+        g.warm_tracked = True
+
+    @app.after_request
+    def record_access(response):
+        result = g.get('warm_result')
+        if result is not None and not request.headers.get(WARM_HEADER):
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            registry.inc('quantifico_warm_requests_total', route=rule, result=result)
+            if response.status_code in (200, 202):
+                warmer.access_log.record(request.endpoint, request.full_path.rstrip('?'),
+                                         (request.view_args or {}).get('player_id'))
+        return response
+
+    @app.teardown_request
+    def untrack_request(exc):
+        if g.pop('warm_tracked', False):
+            with warmer._lock:
+                warmer.in_flight -= 1
+
+    register_collector(lambda: [
+        ('quantifico_warm_passes_total', 'counter', 'Cache warming passes run',
+         [({}, warmer.stats['passes'])]),
+        ('quantifico_warm_paths_total', 'counter', 'Paths handled by the cache warmer by outcome',
+         [({'outcome': outcome}, warmer.stats[outcome]) for outcome in ('warmed', 'skipped', 'failed')]),
+        ('quantifico_warm_budget_stops_total', 'counter', 'Warming passes stopped by the time or CPU budget',
+         [({}, warmer.stats['budget_stops'])]),
+        ('quantifico_warm_last_pass_seconds', 'gauge', 'Duration of the last warming pass',
+         [({'clock': 'wall'}, warmer.last_pass.get('seconds', 0.0)),
+          ({'clock': 'cpu'}, warmer.last_pass.get('cpu_seconds', 0.0))]),
+    ])
+    return warmer